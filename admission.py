@@ -0,0 +1,94 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+
+# Admission control: load is shed early and cheaply, before any database work, so requests that
+# are admitted still finish in bounded time when offered load exceeds capacity.
+
+
+class Overloaded(Exception):
+    pass
+
+
+# Caps concurrent work; up to `max_queue` callers wait for a slot, the rest are rejected
+class ConcurrencyLimiter:
+    def __init__(self, max_concurrent=4, max_queue=16, timeout=30):
+        self.semaphore = threading.Semaphore(max_concurrent)
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.waiting = 0
+
+    def acquire(self):
+        if self.semaphore.acquire(blocking=False):
+            return
+        with self.lock:
+            if self.waiting >= self.max_queue:
+                raise Overloaded("Too many pending requests")
+            self.waiting += 1
+        try:
+            if not self.semaphore.acquire(timeout=self.timeout):
+                raise Overloaded("Timed out waiting for a free slot")
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+    def release(self):
+        self.semaphore.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# Refills `rate` tokens per second up to `burst`; each request takes one
+class TokenBucket:
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    # Seconds until a token is available; 0 means one was taken
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+# One token bucket per key (client IP, session id). The least recently seen keys are dropped
+# beyond `max_keys`; a dropped key simply starts again with a full bucket.
+class RateLimiter:
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    # Seconds the caller should wait before retrying, or 0 when the request is allowed
+    def check(self, key):
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, now)
+                if len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+            return bucket.take(now)
+
+
+# Retry-After takes whole seconds
+def retry_after(seconds):
+    return max(1, math.ceil(seconds))
@@ -1,14 +1,17 @@
 import sys
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QStackedWidget, QWidget, QVBoxLayout, 
-    QLabel, QLineEdit, QPushButton, QMessageBox, QFormLayout, QHBoxLayout, QListWidget
+    QLabel, QLineEdit, QPushButton, QMessageBox, QFormLayout, QHBoxLayout, QListWidget, QListWidgetItem,
+    QFileDialog
 )
-from PyQt5.QtCore import Qt
-from client import AUBoutique
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSize
+from PyQt5.QtGui import QIcon, QPixmap
+from client import AUBoutique, replica_pools
 import random
 import os
-from openai import OpenAI
-client = OpenAI()
+import assistant
+import offline_cache
+chatgpt_cache = assistant.ResponseCache(maxsize=128, ttl=600)
 
 
 class MainWindow(QMainWindow):
@@ -17,65 +20,44 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("AUBoutique")
         self.setGeometry(100, 100, 800, 600)
 
-        # Instance of AUBoutique
-        self.boutique = AUBoutique()
+        # Instance of AUBoutique; reads go to AUBOUTIQUE_REPLICAS when set. The catalogue, ratings and rates
+        # from the last run are kept in a local cache so pages render before the server answers.
+        self.boutique = AUBoutique(replicas=replica_pools(os.environ.get('AUBOUTIQUE_REPLICAS')),
+                                   offline_cache=offline_cache.OfflineCache())
 
         # Stack of pages
         self.stack = QStackedWidget()
         self.setCentralWidget(self.stack)
 
-        # Pages
+        # Pages are built the first time they are shown
+        self.page_classes = {
+            'login': LoginPage,
+            'register': RegisterPage,
+            'home': HomePage,
+            'products': ProductsPage,
+            'currency': CurrencyPage,
+            'chat': ChatPage,
+            'search': SearchPage,
+            'rate': RateProductPage,
+            'add_product': AddProductPage,
+            'user_products': UserProductsPage,
+            'chatgpt': ChatGPTPage
+        }
         self.pages = {}
-        self.init_pages()
-
-        self.pages['chatgpt'] = ChatGPTPage(self)
-        self.stack.addWidget(self.pages['chatgpt'])
-
-    def init_pages(self):
-        # Login Page
-        self.pages['login'] = LoginPage(self)
-        self.stack.addWidget(self.pages['login'])
-
-        # Registration Page
-        self.pages['register'] = RegisterPage(self)
-        self.stack.addWidget(self.pages['register'])
-
-        # Home Page
-        self.pages['home'] = HomePage(self)
-        self.stack.addWidget(self.pages['home'])
-
-        # Product Page
-        self.pages['products'] = ProductsPage(self)
-        self.stack.addWidget(self.pages['products'])
-
-        # Currency Page
-        self.pages['currency'] = CurrencyPage(self)
-        self.stack.addWidget(self.pages['currency'])
-        # Chat Page
-        self.pages['chat'] = ChatPage(self)
-        self.stack.addWidget(self.pages['chat'])
-
-        # Search Page
-        self.pages['search'] = SearchPage(self)
-        self.stack.addWidget(self.pages['search'])
-
-        # Rate Product Page
-        self.pages['rate'] = RateProductPage(self)
-        self.stack.addWidget(self.pages['rate'])
-
-        # Add Product Page
-        self.pages['add_product'] = AddProductPage(self)
-        self.stack.addWidget(self.pages['add_product'])
-
-        # User Products Page
-        self.pages['user_products'] = UserProductsPage(self)
-        self.stack.addWidget(self.pages['user_products'])
-        
+
         # Switch to Login Page initially
         self.switch_page('login')
 
+    def get_page(self, page_name):
+        page = self.pages.get(page_name)
+        if page is None:
+            page = self.page_classes[page_name](self)
+            self.pages[page_name] = page
+            self.stack.addWidget(page)
+        return page
+
     def switch_page(self, page_name):
-        self.stack.setCurrentWidget(self.pages[page_name])
+        self.stack.setCurrentWidget(self.get_page(page_name))
 
 
 class LoginPage(QWidget):
@@ -120,7 +102,7 @@ class LoginPage(QWidget):
         if "error" in response:
             QMessageBox.critical(self, "Error", response["error"])
         else:
-            chat_page = self.parent.pages['chat']
+            chat_page = self.parent.get_page('chat')
             self.parent.boutique.start_listening(chat_page)
             QMessageBox.information(self, "Success", "Logged in successfully!")
             self.parent.switch_page('home')
@@ -178,36 +160,6 @@ class RegisterPage(QWidget):
             self.parent.switch_page('login')
 
 
-class HomePage(QWidget):
-    def __init__(self, parent):
-        super().__init__()
-        self.parent = parent
-        layout = QVBoxLayout()
-
-        self.welcome_label = QLabel("Welcome to AUBoutique!")
-        self.welcome_label.setAlignment(Qt.AlignCenter)
-        layout.addWidget(self.welcome_label)
-
-        self.list_products_button = QPushButton("List Products")
-        self.list_products_button.clicked.connect(lambda: self.parent.switch_page('products'))
-        layout.addWidget(self.list_products_button)
-
-        self.logout_button = QPushButton("Logout")
-        self.logout_button.clicked.connect(self.handle_logout)
-        layout.addWidget(self.logout_button)
-
-        self.setLayout(layout)
-
-    def handle_logout(self):
-        self.parent.boutique.stop_listening()
-        response = self.parent.boutique.logout_user()
-        if "error" in response:
-            QMessageBox.critical(self, "Error", response["error"])
-        else:
-            QMessageBox.information(self, "Success", "Logged out successfully!")
-            self.parent.switch_page('login')
-
-
 class UserProductsPage(QWidget):
     def __init__(self, parent):
         super().__init__()
@@ -267,7 +219,12 @@ class AddProductPage(QWidget):
         self.form_layout.addRow("Category:", self.category_input)
         self.form_layout.addRow("Price:", self.price_input)
         self.form_layout.addRow("Description:", self.description_input)
-        self.form_layout.addRow("Image URL:", self.image_input)
+        self.upload_button = QPushButton("Upload Image...")
+        self.upload_button.clicked.connect(self.handle_upload_image)
+        image_layout = QHBoxLayout()
+        image_layout.addWidget(self.image_input)
+        image_layout.addWidget(self.upload_button)
+        self.form_layout.addRow("Image URL:", image_layout)
         self.form_layout.addRow("Quantity:", self.quantity_input)
         layout.addLayout(self.form_layout)
 
@@ -283,6 +240,17 @@ class AddProductPage(QWidget):
 
         self.setLayout(layout)
 
+    def handle_upload_image(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, "Choose Image", "", "Images (*.png *.jpg *.jpeg *.gif *.webp)")
+        if not file_name:
+            return
+        with open(file_name, 'rb') as f:
+            response = self.parent.boutique.upload_image(f.read())
+        if "error" in response:
+            QMessageBox.critical(self, "Error", response["error"])
+        else:
+            self.image_input.setText(response["image"])
+
     def handle_add_product(self):
         name = self.name_input.text()
         category = self.category_input.text()
@@ -405,6 +373,7 @@ class ProductsPage(QWidget):
 
         # List Widget to Display Products
         self.products_list = QListWidget()
+        self.products_list.setIconSize(QSize(64, 64))
         layout.addWidget(self.products_list)
 
         # Buy Button
@@ -422,24 +391,85 @@ class ProductsPage(QWidget):
         self.back_button.clicked.connect(lambda: self.parent.switch_page('home'))
         layout.addWidget(self.back_button)
 
+        # Last catalogue response shown in the list, and thumbnail downloads still running
+        self.rendered_products = None
+        self.thumbnail_workers = []
+
         # Set Layout
         self.setLayout(layout)
 
+        # Show the catalogue from the offline cache at once, then sync it in the background
+        cached = self.parent.boutique.cached_products()
+        if cached:
+            self.render_products(cached)
+        self.sync_worker = BackgroundCall(self.parent.boutique.sync_products)
+        self.sync_worker.done.connect(self.handle_background_sync)
+        self.sync_worker.start()
+
+    def handle_background_sync(self, response):
+        if "error" in response:
+            # Keep showing the cached catalogue while the server cannot be reached
+            self.title_label.setText("Products (offline copy)")
+        else:
+            self.title_label.setText("Products")
+            self.render_products(response)
+
     def load_products(self):
-        # Fetch products from the backend
-        response = self.parent.boutique.list_products()
+        # Sync the local catalogue replica; only products changed since the last refresh are transferred,
+        # and an unchanged catalogue comes back as the same list object
+        self.render_products(self.parent.boutique.sync_products())
+
+    def render_products(self, response):
+        if response is self.rendered_products:
+            return
         if "error" in response:
             QMessageBox.critical(self, "Error", response["error"])
         else:
             self.products_list.clear()  # Clear existing items in the list
             products = response
+            missing = {}
             if products:
                 for product in products:
-                    # Display product details (adjust as needed for your backend response structure)
-                    product_details = f"ID: {product['id']} | Name: {product['name']} | Price: {product['price']} USD| Quantity: {product["quantity"]} | average rating: {self.parent.boutique.view_average_rating(product['id'])['average_rating']}"
-                    self.products_list.addItem(product_details)
+                    # Ratings arrive with the delta, so no per-product rating request is needed
+                    product_details = f"ID: {product['id']} | Name: {product['name']} | Price: {product['price']} USD| Quantity: {product['quantity']} | average rating: {product['average_rating']}"
+                    item = QListWidgetItem(product_details)
+                    # Thumbnails come from the local image cache after the first load; the rest are
+                    # downloaded off the UI thread and set when they arrive
+                    thumbnail = self.parent.boutique.cached_image(product['image'], size='thumb')
+                    if thumbnail:
+                        self.set_thumbnail(item, thumbnail)
+                    elif product['image']:
+                        missing.setdefault(product['image'], []).append(item)
+                    self.products_list.addItem(item)
             else:
                 self.products_list.addItem("No products available.")
+            self.rendered_products = response
+            if missing:
+                # Workers are kept until they finish, even if a newer render starts its own
+                worker = BackgroundCall(self.fetch_thumbnails, list(missing))
+                worker.done.connect(lambda thumbnails: self.show_thumbnails(response, missing, thumbnails))
+                worker.finished.connect(lambda: self.thumbnail_workers.remove(worker))
+                self.thumbnail_workers.append(worker)
+                worker.start()
+
+    @staticmethod
+    def set_thumbnail(item, data):
+        pixmap = QPixmap()
+        pixmap.loadFromData(data)
+        item.setIcon(QIcon(pixmap))
+
+    # Runs on a BackgroundCall thread
+    def fetch_thumbnails(self, urls):
+        return {url: self.parent.boutique.fetch_image(url, size='thumb') for url in urls}
+
+    def show_thumbnails(self, response, missing, thumbnails):
+        # The list was re-rendered meanwhile; its own thumbnails are on the way
+        if response is not self.rendered_products or "error" in thumbnails:
+            return
+        for url, data in thumbnails.items():
+            if data:
+                for item in missing[url]:
+                    self.set_thumbnail(item, data)
 
     def handle_buy_product(self):
         # Get selected product details
@@ -541,13 +571,28 @@ class CurrencyPage(QWidget):
 
         self.setLayout(layout)
 
+        # Rates from the offline cache first, refreshed in the background
+        cached = self.parent.boutique.cached_currency_rates('USD')
+        if cached:
+            self.render_rates(cached)
+        self.rates_worker = BackgroundCall(self.parent.boutique.get_currency_rates, 'USD')
+        self.rates_worker.done.connect(self.handle_background_rates)
+        self.rates_worker.start()
+
+    def handle_background_rates(self, rates):
+        if "error" not in rates:
+            self.render_rates(rates)
+
+    def render_rates(self, rates):
+        self.currency_list.clear()
+        for currency, rate in rates.items():
+            self.currency_list.addItem(f"{currency} : {rate}")
+
     def load_rates(self):
         base_currency = 'USD'  # Set to your default or chosen base currency
         rates = self.parent.boutique.get_currency_rates(base_currency)
         if "error" not in rates:
-            self.currency_list.clear()
-            for currency, rate in rates.items():
-                self.currency_list.addItem(f"{currency} : {rate}")
+            self.render_rates(rates)
         else:
             QMessageBox.critical(self, "Error", "Failed to fetch currency rates")
 
@@ -595,35 +640,64 @@ class ChatGPTPage(QWidget):
         self.chat_display.addItem(f"You: {user_message}")
         self.user_input.clear()
 
-        # Send the message to ChatGPT API
-        response = self.send_to_chatgpt(user_message)
-        if response:
-            self.chat_display.addItem(f"ChatGPT: {response}")
-        else:
-            self.chat_display.addItem("ChatGPT: Error retrieving response.")
+        if not os.getenv("OPENAI_API_KEY"):
+            print("Error: OPENAI_API_KEY is not set.")
+            self.chat_display.addItem("ChatGPT: API key not found.")
+            return
 
-    def send_to_chatgpt(self, message):
-        api_key = os.getenv("OPENAI_API_KEY")  
+        # Stream the reply into a single chat line as chunks arrive
+        self.response_text = ""
+        self.response_item = QListWidgetItem("ChatGPT: ")
+        self.chat_display.addItem(self.response_item)
+        self.send_button.setEnabled(False)
+        self.worker = ChatGPTWorker(user_message)
+        self.worker.chunk_received.connect(self.append_chunk)
+        self.worker.failed.connect(self.handle_error)
+        self.worker.finished.connect(lambda: self.send_button.setEnabled(True))
+        self.worker.start()
+
+    def append_chunk(self, chunk):
+        self.response_text += chunk
+        self.response_item.setText(f"ChatGPT: {self.response_text}")
+        self.chat_display.scrollToBottom()
+
+    def handle_error(self, error):
+        print(f"Error communicating with ChatGPT API: {error}")
+        if not self.response_text:
+            self.response_item.setText("ChatGPT: Error retrieving response.")
+
+
+class ChatGPTWorker(QThread):
+    chunk_received = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+    def __init__(self, message):
+        super().__init__()
+        self.message = message
 
-        if not api_key:
-            print("Error: OPENAI_API_KEY is not set.")
-            return "API key not found."
-
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {
-                    "role": "user",
-                    "content": message
-                }
-            ]
-        )
+    def run(self):
+        try:
+            for chunk in assistant.stream_reply(assistant.get_client(), self.message, chatgpt_cache):
+                self.chunk_received.emit(chunk)
+        except Exception as e:
+            self.failed.emit(str(e))
+
+
+# Runs a client call off the GUI thread and delivers its result (or {"error": ...}) through `done`
+class BackgroundCall(QThread):
+    done = pyqtSignal(object)
+
+    def __init__(self, func, *args):
+        super().__init__()
+        self.func = func
+        self.args = args
+
+    def run(self):
         try:
-            return completion.choices[0].message.content
+            result = self.func(*self.args)
         except Exception as e:
-            print(f"Error communicating with ChatGPT API: {e}")
-            return None
+            result = {"error": str(e)}
+        self.done.emit(result)
 
 
 class SearchPage(QWidget):
@@ -1,23 +1,98 @@
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponse, Http404
 from django.views import View
 from django.urls import path
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.utils.decorators import method_decorator
+import functools
 import hashlib
 import json
 import os
-from openai import OpenAI
 from django.middleware.csrf import get_token
-from client import AUBoutique
-
-# Initialize the boutique class instance
-boutique = AUBoutique()
-client = OpenAI()
+from asgiref.sync import sync_to_async
+import client
+import async_client
+from client import AUBoutique, ConnectionPool
+from async_client import AsyncAUBoutique, AsyncConnectionPool
+import assistant
+import currency
+import image_store
+
+# Every Django request shares one keep-alive connection pool to server.py and one rates cache;
+# user identity lives in the Django session, never in a shared client
+server_pool = ConnectionPool('localhost', 8080, max_idle=32)
+async_server_pool = AsyncConnectionPool('localhost', 8080, max_idle=32)
+# Read-only calls go to these replicas when AUBOUTIQUE_REPLICAS is set
+replica_pools = client.replica_pools(os.environ.get('AUBOUTIQUE_REPLICAS'))
+async_replica_pools = async_client.replica_pools(os.environ.get('AUBOUTIQUE_REPLICAS'))
+rates_cache = currency.RatesCache(snapshot_path='rates_snapshot.json')
+image_cache = image_store.ImageCache()
+# Shared across requests: identical prompts are answered from the cache, and at most
+# four completions run at once with a short queue behind them
+chatgpt_cache = assistant.ResponseCache(maxsize=256, ttl=600)
+chatgpt_limiter = assistant.ConcurrencyLimiter(max_concurrent=4, max_queue=16, timeout=30)
+
+# Products per /browse request on the catalogue page, and per page of search results
+CATALOGUE_PAGE = 10000
+RESULTS_PAGE = 25
 
 def hash_password(password):
     return hashlib.sha256(password.encode('utf-8')).hexdigest()
 
+# A failed listing is a dict: {"error": ...} from the client, or the handler's {"message": ...}
+def listing_error(response):
+    if isinstance(response, dict) and "products" not in response:
+        return JsonResponse({"error": response.get("error") or response.get("message")}, status=400)
+    return None
+
+# Non-negative integer from a form field; missing or malformed values give None
+def form_int(value):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number >= 0 else None
+
+# Client bound to the logged-in user of this request's session
+def session_client(request):
+    boutique = AUBoutique(pool=server_pool, rates_cache=rates_cache, image_cache=image_cache, replicas=replica_pools)
+    boutique.user_id = request.session.get('user_id')
+    boutique.username = request.session.get('username')
+    boutique.session_id = request.session.session_key
+    # Read-your-writes across requests: the session remembers the position of its last write
+    boutique.write_position = request.session.get('write_position', 0)
+
+    def remember_position(position):
+        request.session['write_position'] = position
+
+    boutique.on_write_position = remember_position
+    return boutique
+
+# Async counterpart for the listing views; session access stays on a sync thread
+async def async_session_client(request):
+    user_id, username, session_id, write_position = await sync_to_async(
+        lambda: (request.session.get('user_id'), request.session.get('username'), request.session.session_key,
+                 request.session.get('write_position', 0)))()
+    boutique = AsyncAUBoutique(pool=async_server_pool, rates_cache=rates_cache, image_cache=image_cache,
+                               replicas=async_replica_pools)
+    boutique.user_id = user_id
+    boutique.username = username
+    boutique.session_id = session_id
+    boutique.write_position = write_position
+    return boutique
+
+# login_required for the async views: the sync decorator reads request.user, which loads the user
+# from the session database and is refused inside the event loop, so this one awaits request.auser()
+def async_login_required(view):
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
 # Views
 class LoginView(View):
     def get(self, request):
@@ -28,10 +103,11 @@ class LoginView(View):
         password = request.POST.get('password')
         client_port = 8081  # Example port, adjust accordingly
 
-        response = boutique.login_user(username, password, client_port)
+        response = session_client(request).login_user(username, password, client_port)
         if "error" in response:
             return JsonResponse({"error": response["error"]}, status=400)
         else:
+            request.session['user_id'] = response['user_id']
             request.session['username'] = username
             return redirect('home')
 
@@ -47,7 +123,7 @@ class RegisterView(View):
         username = request.POST.get('username')
         password = request.POST.get('password')
 
-        response = boutique.register_user(first_name, last_name, email, username, password)
+        response = session_client(request).register_user(first_name, last_name, email, username, password)
         if "error" in response:
             return JsonResponse({"error": response["error"]}, status=400)
         else:
@@ -60,13 +136,22 @@ class HomeView(View):
         return render(request, 'home.html', {"username": request.session.get('username')})
 
 
-@method_decorator(login_required, name='dispatch')
+@method_decorator(async_login_required, name='dispatch')
 class ProductsView(View):
-    def get(self, request):
-        response = boutique.list_products()
-        if "error" in response:
-            return JsonResponse({"error": response["error"]}, status=400)
-        return render(request, 'products.html', {"products": response})
+    # /browse rows already carry average_rating and rating_count, so the whole catalogue with its
+    # ratings takes one request per CATALOGUE_PAGE products
+    async def get(self, request):
+        boutique = await async_session_client(request)
+        products = []
+        while True:
+            response = await boutique.browse_products(limit=CATALOGUE_PAGE, offset=len(products))
+            error = listing_error(response)
+            if error:
+                return error
+            products += response["products"]
+            if not response["products"] or len(products) >= response["total"]:
+                break
+        return render(request, 'products.html', {"products": products})
 
 
 @method_decorator(login_required, name='dispatch')
@@ -82,36 +167,69 @@ class AddProductView(View):
         image = request.POST.get('image')
         quantity = request.POST.get('quantity')
 
+        boutique = session_client(request)
+        # An uploaded file takes precedence over a typed image URL
+        image_file = request.FILES.get('image_file')
+        if image_file:
+            upload = boutique.upload_image(image_file.read())
+            if "error" in upload:
+                return JsonResponse({"error": upload["error"]}, status=400)
+            image = upload["image"]
         response = boutique.add_product(name, category, price, description, image, quantity)
         if "error" in response:
             return JsonResponse({"error": response["error"]}, status=400)
         return redirect('products')
 
 
-@method_decorator(login_required, name='dispatch')
+# Store images are served under the same /images/ URLs the server hands out, from the shared disk cache
+class ImageView(View):
+    def get(self, request, name):
+        size = 'thumb' if request.GET.get('size') == 'thumb' else None
+        data = session_client(request).fetch_image(f"/images/{name}", size)
+        if data is None:
+            raise Http404("Image not found")
+        response = HttpResponse(data, content_type=image_store.CONTENT_TYPES[name.rsplit('.', 1)[1]])
+        response['Cache-Control'] = image_store.CACHE_CONTROL
+        return response
+
+
+@method_decorator(async_login_required, name='dispatch')
 class SearchProductsView(View):
-    def get(self, request):
+    async def get(self, request):
         return render(request, 'search.html')
 
-    def post(self, request):
+    # Results come RESULTS_PAGE at a time (the next page starts after the last id shown), so only the
+    # ratings of the products on the page are fetched
+    async def post(self, request):
         search_term = request.POST.get('search_term')
-        response = boutique.search_product(search_term)
-        if "error" in response:
-            return JsonResponse({"error": response["error"]}, status=400)
-        return render(request, 'search_results.html', {"products": response})
-
-
-@method_decorator(login_required, name='dispatch')
+        after = form_int(request.POST.get('after'))
+        boutique = await async_session_client(request)
+        response = await boutique.search_product(search_term, after=after, limit=RESULTS_PAGE)
+        error = listing_error(response)
+        if error:
+            return error
+        products = await boutique.with_average_ratings(response)
+        next_after = products[-1]['id'] if len(products) == RESULTS_PAGE else None
+        return render(request, 'search_results.html', {"products": products, "search_term": search_term, "next_after": next_after})
+
+
+@method_decorator(async_login_required, name='dispatch')
 class UserProductsView(View):
-    def get(self, request):
+    async def get(self, request):
         return render(request, 'user_products.html')
 
-    def post(self, request):
+    # Paged like the search results; the route has no paging, so the page is cut from the full listing
+    async def post(self, request):
         username = request.POST.get('username')
-        response = boutique.search_user_products(username)
-        if "error" in response:
-            return JsonResponse({"error": response["error"]}, status=400)
-        return render(request, 'user_products_results.html', {"products": response})
+        offset = form_int(request.POST.get('offset')) or 0
+        boutique = await async_session_client(request)
+        response = await boutique.search_user_products(username)
+        error = listing_error(response)
+        if error:
+            return error
+        products = await boutique.with_average_ratings(response[offset:offset + RESULTS_PAGE])
+        next_offset = offset + RESULTS_PAGE if len(response) > offset + RESULTS_PAGE else None
+        return render(request, 'user_products_results.html', {"products": products, "username": username, "next_offset": next_offset})
 
 
 @method_decorator(login_required, name='dispatch')
@@ -123,7 +241,7 @@ class RateProductView(View):
         product_id = request.POST.get('product_id')
         rating = int(request.POST.get('rating'))
 
-        response = boutique.rate_product(product_id, rating)
+        response = session_client(request).rate_product(product_id, rating)
         if "error" in response:
             return JsonResponse({"error": response["error"]}, status=400)
         return redirect('products')
@@ -133,7 +251,7 @@ class RateProductView(View):
 class BuyProductView(View):
     def post(self, request):
         product_id = request.POST.get('product_id')
-        response = boutique.buy_product(product_id)
+        response = session_client(request).buy_product(product_id)
         if "error" in response:
             return JsonResponse({"error": response["error"]}, status=400)
         return redirect('products')
@@ -143,7 +261,7 @@ class BuyProductView(View):
 class ViewCurrencyRatesView(View):
     def get(self, request):
         base_currency = 'USD'
-        rates = boutique.get_currency_rates(base_currency)
+        rates = session_client(request).get_currency_rates(base_currency)
         if "error" not in rates:
             return render(request, 'currency_rates.html', {"rates": rates})
         else:
@@ -159,7 +277,7 @@ class ChatView(View):
         receiver_username = request.POST.get('receiver_username')
         message = request.POST.get('message')
 
-        response = boutique.p2p_chat(receiver_username, message)
+        response = session_client(request).p2p_chat(receiver_username, message)
         if "error" in response:
             return JsonResponse({"error": response["error"]}, status=400)
         return JsonResponse({"message": "Message sent successfully!"})
@@ -175,25 +293,42 @@ class ChatGPTView(View):
         if not user_message:
             return JsonResponse({"error": "Message cannot be empty."}, status=400)
 
-        response = self.send_to_chatgpt(user_message)
-        return JsonResponse({"response": response})
+        if not os.getenv("OPENAI_API_KEY"):
+            return JsonResponse({"response": "API key not found."})
 
-    def send_to_chatgpt(self, message):
-        api_key = os.getenv("OPENAI_API_KEY")
+        # Cached answers don't need a completion slot
+        cached = chatgpt_cache.get(user_message)
+        if cached is not None:
+            if request.POST.get('stream'):
+                return StreamingHttpResponse([cached], content_type='text/plain; charset=utf-8')
+            return JsonResponse({"response": cached})
+
+        try:
+            chatgpt_limiter.acquire()
+        except assistant.Overloaded as e:
+            return JsonResponse({"error": str(e)}, status=503, headers={"Retry-After": "5"})
 
-        if not api_key:
-            return "API key not found."
+        if request.POST.get('stream'):
+            # Slot is released once the stream is exhausted or the client goes away
+            chunks = assistant.ClosingIterator(self.stream_chatgpt(user_message), chatgpt_limiter.release)
+            return StreamingHttpResponse(chunks, content_type='text/plain; charset=utf-8')
 
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": message}
-            ]
-        )
+        try:
+            response = self.send_to_chatgpt(user_message)
+        finally:
+            chatgpt_limiter.release()
+        return JsonResponse({"response": response})
+
+    def stream_chatgpt(self, message):
+        try:
+            yield from assistant.stream_reply(assistant.get_client(), message, chatgpt_cache)
+        except Exception as e:
+            print(f"Error communicating with ChatGPT API: {e}")
+            yield "Error retrieving response."
 
+    def send_to_chatgpt(self, message):
         try:
-            return completion.choices[0].message.content
+            return assistant.complete(assistant.get_client(), message, chatgpt_cache)
         except Exception as e:
             print(f"Error communicating with ChatGPT API: {e}")
             return "Error retrieving response."
@@ -202,6 +337,8 @@ class ChatGPTView(View):
 @method_decorator(login_required, name='dispatch')
 class LogoutView(View):
     def get(self, request):
+        if request.session.get('user_id') is not None:
+            session_client(request).logout_user()
         request.session.flush()
         return redirect('login')
 
@@ -212,6 +349,7 @@ urlpatterns = [
     path('home/', HomeView.as_view(), name='home'),
     path('products/', ProductsView.as_view(), name='products'),
     path('add-product/', AddProductView.as_view(), name='add_product'),
+    path('images/<str:name>', ImageView.as_view(), name='image'),
     path('search-products/', SearchProductsView.as_view(), name='search_products'),
     path('user-products/', UserProductsView.as_view(), name='user_products'),
     path('rate-product/', RateProductView.as_view(), name='rate_product'),
@@ -263,7 +401,7 @@ urlpatterns = [
 <h1>Products</h1>
 <ul>
     {% for product in products %}
-        <li>{{ product.name }} - {{ product.price }} USD</li>
+        <li>{% if product.image|slice:":8" == "/images/" %}<img src="{{ product.image }}?size=thumb" width="64" height="64" loading="lazy"> {% endif %}{{ product.name }} - {{ product.price }} USD - average rating: {{ product.average_rating }}</li>
     {% endfor %}
 </ul>
 <a href="/home/">Back to Home</a>
@@ -271,12 +409,12 @@ urlpatterns = [
 
 # add_product.html
 """
-<form method="post">{% csrf_token %}
+<form method="post" enctype="multipart/form-data">{% csrf_token %}
     Name: <input type="text" name="name"><br>
     Category: <input type="text" name="category"><br>
     Price: <input type="number" name="price"><br>
     Description: <textarea name="description"></textarea><br>
-    Image URL: <input type="url" name="image"><br>
+    Image URL: <input type="text" name="image"> or upload: <input type="file" name="image_file" accept="image/*"><br>
     Quantity: <input type="number" name="quantity"><br>
     <button type="submit">Add Product</button>
 </form>
@@ -297,7 +435,7 @@ urlpatterns = [
 <h1>Search Results</h1>
 <ul>
     {% for product in products %}
-        <li>{{ product.name }} - {{ product.price }} USD</li>
+        <li>{% if product.image|slice:":8" == "/images/" %}<img src="{{ product.image }}?size=thumb" width="64" height="64" loading="lazy"> {% endif %}{{ product.name }} - {{ product.price }} USD - average rating: {{ product.average_rating }}</li>
     {% endfor %}
 </ul>
 <a href="/search-products/">Back to Search</a>
@@ -317,7 +455,7 @@ urlpatterns = [
 <h1>User's Products</h1>
 <ul>
     {% for product in products %}
-        <li>{{ product.name }} - {{ product.price }} USD</li>
+        <li>{% if product.image|slice:":8" == "/images/" %}<img src="{{ product.image }}?size=thumb" width="64" height="64" loading="lazy"> {% endif %}{{ product.name }} - {{ product.price }} USD - average rating: {{ product.average_rating }}</li>
     {% endfor %}
 </ul>
 <a href="/user-products/">Back to Search</a>
@@ -360,6 +498,7 @@ urlpatterns = [
 <h1>Chat with ChatGPT</h1>
 <form method="post">{% csrf_token %}
     Your Message: <input type="text" name="message"><br>
+    <label><input type="checkbox" name="stream" value="1"> Stream response</label><br>
     <button type="submit">Send</button>
 </form>
 """
@@ -0,0 +1,119 @@
+import time
+import threading
+from collections import OrderedDict
+
+# The limiter is shared with the server's admission control; re-exported for existing callers
+from admission import ConcurrencyLimiter, Overloaded
+
+MODEL = "gpt-4o-mini"
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+# The OpenAI SDK is slow to import, so it is loaded on the first request
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+            _client = OpenAI()
+        return _client
+
+
+def normalize_prompt(message):
+    return ' '.join(message.split()).casefold()
+
+
+def build_messages(message):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": message}
+    ]
+
+
+# LRU cache of completed responses; entries expire after `ttl` seconds
+class ResponseCache:
+    def __init__(self, maxsize=256, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, prompt):
+        key = normalize_prompt(prompt)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, prompt, response):
+        key = normalize_prompt(prompt)
+        with self.lock:
+            self.entries[key] = (time.monotonic(), response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+def stream_reply(client, message, cache=None):
+    """Yield the assistant's reply as text chunks arrive; a cached reply is yielded in one piece."""
+    if cache is not None:
+        cached = cache.get(message)
+        if cached is not None:
+            yield cached
+            return
+    parts = []
+    stream = client.chat.completions.create(model=MODEL, messages=build_messages(message), stream=True)
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            yield delta
+    if cache is not None and parts:
+        cache.put(message, ''.join(parts))
+
+
+def complete(client, message, cache=None):
+    if cache is not None:
+        cached = cache.get(message)
+        if cached is not None:
+            return cached
+    completion = client.chat.completions.create(model=MODEL, messages=build_messages(message))
+    response = completion.choices[0].message.content
+    if cache is not None and response:
+        cache.put(message, response)
+    return response
+
+
+# Iterator that runs `on_close` exactly once, whether it is exhausted or closed early
+class ClosingIterator:
+    def __init__(self, iterable, on_close):
+        self.iterator = iter(iterable)
+        self.on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        on_close, self.on_close = self.on_close, None
+        if on_close is not None:
+            if hasattr(self.iterator, 'close'):
+                self.iterator.close()
+            on_close()
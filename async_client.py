@@ -0,0 +1,490 @@
+import json
+import socket
+import asyncio
+import hashlib
+import weakref
+import threading
+import urllib.parse
+from collections import OrderedDict
+
+import currency
+import compression
+import wire_format
+import image_store
+from client import build_request, parse_headers, rejection, facet_params, CatalogueReplica, NoResponse
+
+
+async def read_response(reader):
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except ConnectionResetError as e:
+        raise NoResponse("Connection reset by server") from e
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise
+        raise NoResponse("Connection closed by server") from e
+    status, headers = parse_headers(head[:-4])
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers, compression.decode_body(headers, body)
+
+
+# Pool of keep-alive asyncio streams to server.py. Streams belong to the event loop that opened
+# them, and async_to_sync runs each Django request on its own loop (and thread), so every running
+# loop gets its own idle list and connection cap; state for a closed loop is dropped.
+class LoopConnections:
+    def __init__(self, max_connections):
+        self.idle = []
+        self.semaphore = asyncio.Semaphore(max_connections)
+
+
+class AsyncConnectionPool:
+    def __init__(self, host='localhost', port=8080, max_idle=16, max_connections=64, timeout=30):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.loops = weakref.WeakKeyDictionary()
+
+    def for_loop(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            for other in [other for other in self.loops if other.is_closed()]:
+                del self.loops[other]
+            if loop not in self.loops:
+                self.loops[loop] = LoopConnections(self.max_connections)
+            return self.loops[loop]
+
+    async def connect(self):
+        return await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+
+    async def exchange(self, reader, writer, payload):
+        try:
+            writer.write(payload)
+            await writer.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise NoResponse(str(e)) from e
+        return await asyncio.wait_for(read_response(reader), self.timeout)
+
+    # As in client.ConnectionPool, only a request that never reached the server is sent again: a
+    # reused stream that fails on send or closes before any response byte. A timeout (an OSError
+    # in 3.11) or a partial response goes to the caller, since the server may already have run it.
+    async def request(self, payload):
+        connections = self.for_loop()
+        async with connections.semaphore:
+            reused = bool(connections.idle)
+            reader, writer = connections.idle.pop() if reused else await self.connect()
+            try:
+                response = await self.exchange(reader, writer, payload)
+            except NoResponse:
+                writer.close()
+                if not reused:
+                    raise
+                reader, writer = await self.connect()
+                try:
+                    response = await self.exchange(reader, writer, payload)
+                except BaseException:
+                    writer.close()
+                    raise
+            except BaseException:
+                writer.close()
+                raise
+            if len(connections.idle) < self.max_idle:
+                connections.idle.append((reader, writer))
+            else:
+                writer.close()
+            return response
+
+    # Close the idle streams of the running loop
+    async def close(self):
+        connections = self.for_loop()
+        idle, connections.idle = connections.idle, []
+        for _, writer in idle:
+            writer.close()
+            await writer.wait_closed()
+
+
+# Pools to read replicas from a "host:port,host:port" list (e.g. AUBOUTIQUE_REPLICAS)
+def replica_pools(spec, timeout=30):
+    pools = []
+    for address in filter(None, (spec or '').split(',')):
+        host, _, port = address.strip().rpartition(':')
+        pools.append(AsyncConnectionPool(host or 'localhost', int(port), timeout=timeout))
+    return pools
+
+
+# asyncio counterpart of client.AUBoutique with the same methods and return values, including the
+# offline cache; its SQLite and disk-cache calls run in worker threads so the event loop never waits on them
+class AsyncAUBoutique:
+    def __init__(self, host='localhost', port=8080, rates_cache=None, pool=None, timeout=30, result_format=None,
+                 image_cache=None, replicas=None, offline_cache=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.result_format = result_format
+        self.pool = pool or AsyncConnectionPool(host, port, timeout=timeout)
+        # Read replicas with read-your-writes, as in client.AUBoutique
+        self.replicas = list(replicas or [])
+        self.next_replica = 0
+        self.write_position = 0
+        self.on_write_position = None
+        # Optional offline_cache.OfflineCache, used as by client.AUBoutique
+        self.offline_cache = offline_cache
+        self.offline_loaded = False
+        self.rates_cache = rates_cache or (currency.RatesCache(store=offline_cache) if offline_cache
+                                           else currency.RatesCache(snapshot_path='rates_snapshot.json'))
+        self.image_cache = image_cache or image_store.ImageCache()
+        self.session_id = None
+        self.validated = OrderedDict()
+        self.max_validated = 32
+        self.replica = CatalogueReplica()
+        self.sync_lock = asyncio.Lock()
+        self.user_id = None
+        self.username = None
+        self.client_port = None
+        self.listener = None
+
+    @staticmethod
+    def hash_password(password):
+        return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+    async def handle_peer_message(self, reader, writer, chat_page):
+        try:
+            data = await asyncio.wait_for(reader.read(), self.timeout)
+            message_data = json.loads(data.decode('utf-8'))
+            chat_page.display_received_message(message_data['from_username'], message_data['message'])
+        except Exception as e:
+            print(f"Error receiving message: {e}")
+        finally:
+            writer.close()
+
+    async def start_listening(self, chat_page):
+        self.listener = await asyncio.start_server(
+            lambda reader, writer: self.handle_peer_message(reader, writer, chat_page), '0.0.0.0', self.client_port)
+
+    async def stop_listening(self):
+        if self.listener:
+            self.listener.close()
+            await self.listener.wait_closed()
+            self.listener = None
+
+    async def send_request(self, method, path, body=None, read_only=False):
+        status, headers, json_part = await self.exchange(method, path, body, read_only=read_only)
+        rejected = rejection(status, headers, json_part)
+        if rejected:
+            return rejected
+        try:
+            return json.loads(json_part)
+        except json.JSONDecodeError:
+            return {"error": "Failed to decode JSON from server response"}
+
+    async def send_conditional_request(self, method, path, body=None, read_only=False):
+        key = (method, path, json.dumps(body, sort_keys=True))
+        cached = self.validated.get(key)
+        if cached is None and self.offline_cache:
+            cached = await self.stored_response(key)
+        extra_headers = {"If-None-Match": cached[0]} if cached else None
+        try:
+            status, headers, json_part = await self.exchange(method, path, body, extra_headers, read_only)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            if cached and self.offline_cache:
+                return cached[1]
+            raise
+        if status == 304 and cached:
+            self.validated.move_to_end(key)
+            return cached[1]
+        rejected = rejection(status, headers, json_part)
+        if rejected:
+            return rejected
+        try:
+            response = wire_format.decode(headers.get('content-type'), json_part)
+        except ValueError:
+            return {"error": "Failed to decode server response"}
+        if 'etag' in headers:
+            self.validated[key] = (headers['etag'], response)
+            self.validated.move_to_end(key)
+            while len(self.validated) > self.max_validated:
+                self.validated.popitem(last=False)
+            if self.offline_cache:
+                await asyncio.to_thread(self.offline_cache.put_response, json.dumps([self.source()] + list(key)), headers['etag'],
+                                        headers.get('content-type'), json_part)
+        return response
+
+    # Server identity for the offline cache, which may hold data from several servers
+    def source(self):
+        return f"{self.host}:{self.port}"
+
+    async def stored_response(self, key):
+        stored = await asyncio.to_thread(self.offline_cache.get_response, json.dumps([self.source()] + list(key)))
+        if not stored:
+            return None
+        etag, content_type, body = stored
+        try:
+            cached = (etag, wire_format.decode(content_type, body))
+        except ValueError:
+            return None
+        self.validated[key] = cached
+        return cached
+
+    async def exchange(self, method, path, body=None, extra_headers=None, read_only=False):
+        if self.session_id:
+            extra_headers = dict(extra_headers or {}, **{"X-Session-Id": self.session_id})
+        if read_only and self.replicas:
+            response = await self.replica_exchange(method, path, body, extra_headers)
+            if response:
+                return response
+        response = await self.pool.request(build_request(method, path, self.host, body, extra_headers))
+        self.track_position(response[1])
+        return response
+
+    async def replica_exchange(self, method, path, body, extra_headers):
+        pool = self.replicas[self.next_replica % len(self.replicas)]
+        self.next_replica += 1
+        extra_headers = dict(extra_headers or {}, **{"X-Min-Position": self.write_position})
+        try:
+            response = await pool.request(build_request(method, path, pool.host, body, extra_headers))
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            return None
+        return None if response[0] in (409, 503) else response
+
+    def track_position(self, headers):
+        position = int(headers.get('x-replication-position', 0))
+        if position > self.write_position:
+            self.write_position = position
+            if self.on_write_position:
+                self.on_write_position(position)
+
+    # Run several client calls concurrently, e.g.
+    #     products, mine = await boutique.gather(boutique.list_products(), boutique.search_user_products(name))
+    async def gather(self, *calls):
+        return await asyncio.gather(*calls)
+
+    async def with_average_ratings(self, products, limit=16):
+        """Attach `average_rating` to each product, fetching at most `limit` ratings at a time."""
+        if isinstance(products, dict):
+            return products
+        semaphore = asyncio.Semaphore(limit)
+
+        async def fetch(product):
+            async with semaphore:
+                rating = await self.view_average_rating(product['id'])
+            return dict(product, average_rating=rating.get('average_rating'))
+
+        return await asyncio.gather(*(fetch(product) for product in products))
+
+    async def register_user(self, first_name, last_name, email, username, password):
+        data = {
+            "first_name": first_name,
+            "last_name": last_name,
+            "email": email,
+            "username": username,
+            "password": self.hash_password(password)
+        }
+        return await self.send_request('POST', '/register', data)
+
+    async def login_user(self, username, password, client_port):
+        try:
+            self.client_port = client_port
+            ip_address = socket.gethostbyname(socket.gethostname())
+            data = {
+                "username": username,
+                "password": self.hash_password(password),
+                "port": client_port,
+                "ip_address": ip_address
+            }
+            response = await self.send_request('POST', '/login', data)
+
+            if "user_id" in response:
+                self.user_id = response["user_id"]
+                self.username = username
+                return response
+            else:
+                return {"error": "Login failed. Please check your credentials."}
+        except Exception as e:
+            return {"error": "An error occurred during login.", "details": str(e)}
+
+    async def logout_user(self):
+        response = await self.send_request('POST', '/logout', {"user_id": self.user_id})
+        self.user_id = None
+        self.username = None
+        return response
+
+    async def add_product(self, name, category, price, description, image, quantity):
+        data = {
+            "name": name,
+            "owner_id": self.user_id,
+            "category": category,
+            "price": price,
+            "description": description,
+            "image": image,
+            "quantity": quantity
+        }
+        return await self.send_request('POST', '/add_product', data)
+
+    async def list_products(self, currency=None, category=None, price=None, in_stock=None, after=None, limit=None):
+        path = '/products'
+        params = facet_params(category, price, in_stock)
+        if currency:
+            params["currency"] = currency
+        if after is not None:
+            params["after"] = after
+        if limit is not None:
+            params["limit"] = limit
+        if self.result_format:
+            params["format"] = self.result_format
+        if params:
+            path += '?' + urllib.parse.urlencode(params)
+        return await self.send_conditional_request('GET', path, read_only=True)
+
+    async def sync_products(self, batch_size=1000):
+        async with self.sync_lock:
+            await self.load_offline_catalogue()
+            while True:
+                since = self.replica.seq
+                delta = await self.send_request('POST', '/product_changes', {"since": since, "limit": batch_size})
+                if "changes" not in delta:
+                    return {"error": delta.get("message", "Failed to sync products")}
+                self.replica.apply(delta)
+                if self.offline_cache:
+                    await asyncio.to_thread(self.offline_cache.save_catalogue, self.source(), 0 if delta.get("reset") else since,
+                                            delta["seq"], delta["changes"], delta["deleted"])
+                if not delta["more"]:
+                    return self.replica.list()
+
+    # The catalogue as last synced, possibly in an earlier run, without contacting the server
+    async def cached_products(self):
+        async with self.sync_lock:
+            await self.load_offline_catalogue()
+            return self.replica.list()
+
+    async def load_offline_catalogue(self):
+        if self.offline_cache and not self.offline_loaded:
+            self.replica.seq, self.replica.products = await asyncio.to_thread(self.offline_cache.load_catalogue, self.source())
+            self.replica.snapshot = None
+            self.offline_loaded = True
+
+    async def upload_image(self, data):
+        _, _, body = await self.exchange('POST', '/upload_image', data)
+        try:
+            response = json.loads(body)
+        except json.JSONDecodeError:
+            return {"error": "Failed to decode JSON from server response"}
+        if "image" not in response:
+            return {"error": response.get("message", "Failed to upload image")}
+        return response
+
+    # The image if it is in the local cache, without contacting the server
+    async def cached_image(self, url, size=None):
+        name = image_store.store_image_name(url)
+        return await asyncio.to_thread(self.image_cache.get, image_store.ImageCache.key(name, size)) if name else None
+
+    async def fetch_image(self, url, size=None):
+        name = image_store.store_image_name(url)
+        if name is None:
+            return None
+        key = image_store.ImageCache.key(name, size)
+        data = await asyncio.to_thread(self.image_cache.get, key)
+        if data is None:
+            status, _, data = await self.exchange('GET', f"/images/{name}" + (f"?size={size}" if size else ''))
+            if status != 200:
+                return None
+            await asyncio.to_thread(self.image_cache.put, key, data)
+        return data
+
+    async def buy_product(self, product_id):
+        data = {"buyer_id": self.user_id, "product_id": product_id}
+        return await self.send_request('POST', '/buy_product', data)
+
+    async def search_product(self, search_term, currency=None, after=None, limit=None):
+        data = {"search_term": search_term}
+        if currency:
+            data["currency"] = currency
+        if after is not None:
+            data["after"] = after
+        if limit is not None:
+            data["limit"] = limit
+        if self.result_format:
+            data["format"] = self.result_format
+        return await self.send_conditional_request('POST', '/search_product', data, read_only=True)
+
+    async def search_user_products(self, username, currency=None):
+        data = {"username": username}
+        if currency:
+            data["currency"] = currency
+        if self.result_format:
+            data["format"] = self.result_format
+        return await self.send_conditional_request('POST', '/search_user_products', data, read_only=True)
+
+    async def rate_product(self, product_id, rating):
+        data = {"user_id": self.user_id, "product_id": product_id, "rating": rating}
+        return await self.send_request('POST', '/rate_product', data)
+
+    async def seller_dashboard(self, username=None, days=30):
+        data = {"username": username or self.username, "days": days}
+        return await self.send_request('POST', '/seller_dashboard', data, read_only=True)
+
+    async def browse_products(self, category=None, price=None, in_stock=None, min_price=None, max_price=None, sort='id',
+                              limit=50, offset=0, currency=None):
+        params = dict(facet_params(category, price, in_stock), sort=sort, limit=limit, offset=offset)
+        if min_price is not None:
+            params["min_price"] = min_price
+        if max_price is not None:
+            params["max_price"] = max_price
+        if currency:
+            params["currency"] = currency
+        return await self.send_conditional_request('GET', '/browse?' + urllib.parse.urlencode(params), read_only=True)
+
+    async def facets(self, category=None, price=None, in_stock=None):
+        return await self.send_request('GET', '/facets?' + urllib.parse.urlencode(facet_params(category, price, in_stock)), read_only=True)
+
+    async def leaderboard(self, board='top_rated', category=None, limit=10):
+        params = {"board": board, "limit": limit}
+        if category:
+            params["category"] = category
+        return await self.send_request('GET', '/leaderboard?' + urllib.parse.urlencode(params), read_only=True)
+
+    async def similar_products(self, product_id, limit=10):
+        data = {"product_id": product_id, "limit": limit}
+        return await self.send_request('POST', '/similar_products', data, read_only=True)
+
+    async def view_average_rating(self, product_id):
+        data = {"product_id": product_id}
+        return await self.send_request('POST', '/get_average_rating', data, read_only=True)
+
+    async def get_connection_info(self, username):
+        data = {"username": username}
+        response = await self.send_request('POST', '/get_user_connection_info', data)
+        if "ip_address" in response and "port" in response:
+            return response["ip_address"], response["port"]
+        return None, None
+
+    async def p2p_chat(self, receiver_username, message):
+        ip, port = await self.get_connection_info(receiver_username)
+        if ip and port:
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), self.timeout)
+                writer.write(json.dumps({"from_username": self.username, "message": message}).encode('utf-8'))
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+                return {"message": "Message sent successfully"}
+            except Exception as e:
+                return {"error": f"Failed to send message: {e}"}
+        return {"error": "Could not retrieve user connection info"}
+
+    async def conversation_history(self, with_username, limit=50, before=None):
+        data = {"user_id": self.user_id, "with_username": with_username, "limit": limit}
+        if before:
+            data["before"] = before
+        return await self.send_request('POST', '/conversation', data)
+
+    # Last known rates without contacting the provider; None if there are none
+    async def cached_currency_rates(self, base_currency):
+        return await asyncio.to_thread(self.rates_cache.cached, base_currency)
+
+    async def get_currency_rates(self, base_currency):
+        try:
+            return await asyncio.to_thread(self.rates_cache.get_rates, base_currency)
+        except currency.RatesUnavailable as e:
+            return {"error": str(e)}
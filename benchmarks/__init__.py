@@ -0,0 +1,5 @@
+# Benchmarks and load generation for the AUBoutique server/client protocol.
+#
+# Run from the repository root, e.g.:
+#     python -m benchmarks.seed --db bench.db --users 200 --products 5000
+#     python -m benchmarks.loadgen --db bench.db --clients 32 --duration 30 --output results.json
@@ -0,0 +1,125 @@
+import time
+import random
+import sqlite3
+import argparse
+import statistics
+
+import facets
+import catalogue_columns
+from benchmarks import seed
+from benchmarks.harness import write_report
+
+# Browse queries on the NumPy column arrays vs the same query in SQLite (indexed on category), at
+# growing catalogue sizes. Both return the page's rows with their rating aggregates.
+QUERIES = [
+    ({}, {"sort": "id"}),
+    ({}, {"sort": "-price"}),
+    ({"category": "books"}, {"sort": "price"}),
+    ({"category": "books", "in_stock": True}, {"sort": "-rating"}),
+    ({"in_stock": True}, {"sort": "-rating_count", "min_price": 20, "max_price": 80}),
+    ({"price": "100-250"}, {"sort": "-rating", "offset": 1000})
+]
+SQL_KEYS = {"price": "COALESCE(p.price, 0)", "rating_count": "COALESCE(r.rating_count, 0)"}
+
+
+# ORDER BY for a sort option, with unrated products last and ties by id as in the column arrays
+def sql_order(sort):
+    direction = " DESC" if sort.startswith('-') else ""
+    sort = sort.lstrip('-')
+    if sort == 'id':
+        return "p.id" + direction
+    if sort == 'rating':
+        return f"r.rating_count IS NULL, r.rating_sum * 1.0 / r.rating_count{direction}, p.id"
+    return f"{SQL_KEYS[sort]}{direction}, p.id"
+
+
+def catalogue(count, rng):
+    products = [(i, seed.product_name(rng), rng.randint(1, 1000), rng.choice(seed.CATEGORIES), round(rng.uniform(1, 500), 2),
+                 '', None, rng.randint(0, 5), None) for i in range(1, count + 1)]
+    ratings = [(i, rng.randint(1, 5) * n, n) for i, n in ((i, rng.randint(0, 8)) for i in range(1, count + 1)) if n]
+    return products, ratings
+
+
+def sql_query(conn, filters, options, limit):
+    clauses, args = [], []
+    if "category" in filters:
+        clauses.append("p.category = ?")
+        args.append(filters["category"])
+    if "price" in filters:
+        low, high = facets.price_range(filters["price"])
+        clauses.append("COALESCE(p.price, 0) >= ? AND COALESCE(p.price, 0) < ?")
+        args += [low, high]
+    if "in_stock" in filters:
+        clauses.append("(COALESCE(p.quantity, 0) > 0 AND p.buyer_id IS NULL) = ?")
+        args.append(filters["in_stock"])
+    if "min_price" in options:
+        clauses.append("COALESCE(p.price, 0) >= ? AND COALESCE(p.price, 0) <= ?")
+        args += [options["min_price"], options["max_price"]]
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    total = conn.execute(f"SELECT COUNT(*) FROM products p{where}", args).fetchone()[0]
+    rows = conn.execute(f'''SELECT p.*, r.rating_sum * 1.0 / r.rating_count, COALESCE(r.rating_count, 0)
+                            FROM products p LEFT JOIN ratings r ON r.product_id = p.id{where}
+                            ORDER BY {sql_order(options['sort'])} LIMIT ? OFFSET ?''', args + [limit, options.get("offset", 0)]).fetchall()
+    return total, rows
+
+
+def time_call(func, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Browse queries: NumPy column arrays vs SQLite as the catalogue grows")
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="products in the catalogue")
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', default='columnar_results.json')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    results = []
+    for count in (int(size) for size in args.sizes.split(',')):
+        products, ratings = catalogue(count, rng)
+        conn = sqlite3.connect(':memory:')
+        conn.execute('''CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT, owner_id INTEGER, category TEXT, price REAL,
+                        description TEXT, image TEXT, quantity INTEGER, buyer_id INTEGER)''')
+        conn.execute("CREATE INDEX products_category ON products (category)")
+        conn.execute("CREATE TABLE ratings (product_id INTEGER PRIMARY KEY, rating_sum INTEGER, rating_count INTEGER)")
+        conn.executemany("INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", products)
+        conn.executemany("INSERT INTO ratings VALUES (?, ?, ?)", ratings)
+        conn.commit()
+        start = time.perf_counter()
+        columns = catalogue_columns.ColumnarCatalogue()
+        columns.rebuild(products, ratings)
+        build_ms = (time.perf_counter() - start) * 1000
+        for filters, options in QUERIES:
+            sort = options["sort"]
+            query = lambda: columns.query(filters, sort.lstrip('-'), sort.startswith('-'), args.limit, options.get("offset", 0),
+                                          options.get("min_price"), options.get("max_price"))
+            total, page = query()
+            sql_total, sql_rows = sql_query(conn, filters, options, args.limit)
+            row = {
+                "products": count,
+                "filters": filters,
+                "options": options,
+                "matches": total,
+                "same_result": total == sql_total and [entry[0][0] for entry in page] == [sql_row[0] for sql_row in sql_rows],
+                "columnar_ms": round(time_call(query, args.repeats), 3),
+                "sql_ms": round(time_call(lambda: sql_query(conn, filters, options, args.limit), args.repeats), 3)
+            }
+            results.append(row)
+            print(f"{count:>8} products  {str(filters):<42} {str(options):<58} columnar {row['columnar_ms']:>8.2f} ms  "
+                  f"SQL {row['sql_ms']:>9.2f} ms{'' if row['same_result'] else '  (results differ)'}")
+        results.append({"products": count, "build_ms": round(build_ms, 1)})
+        print(f"{count:>8} products  column arrays built in {build_ms:.0f} ms")
+        conn.close()
+    write_report(args.output, 'columnar', vars(args), results)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
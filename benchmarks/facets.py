@@ -0,0 +1,75 @@
+import time
+import random
+import sqlite3
+import argparse
+import statistics
+
+import facets
+from benchmarks import seed
+from benchmarks.harness import write_report
+
+FILTER_SETS = [{}, {"category": "books"}, {"category": "books", "price": "50-100", "in_stock": True}]
+
+
+def product_rows(count, rng):
+    return [(i, rng.choice(seed.CATEGORIES), round(rng.uniform(1, 600), 2), rng.random() < 0.8) for i in range(1, count + 1)]
+
+
+def time_call(func, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples)
+
+
+# The same counts straight from SQL: one GROUP BY per dimension, each under the other dimensions' filters
+def sql_counts(conn, filters):
+    bucket = "CASE " + " ".join(f"WHEN price < {edge} THEN '{label}'" for edge, label in zip(facets.PRICE_EDGES, facets.PRICE_BUCKETS)) \
+             + f" ELSE '{facets.PRICE_BUCKETS[-1]}' END"
+    columns = {"category": "category", "price": bucket, "in_stock": "in_stock"}
+    conditions = {"category": ("category = ?", filters.get("category")), "price": (f"{bucket} = ?", filters.get("price")),
+                  "in_stock": ("in_stock = ?", filters.get("in_stock"))}
+    results = {}
+    for dimension, column in columns.items():
+        clauses = [(sql, value) for other, (sql, value) in conditions.items() if other != dimension and other in filters]
+        where = " WHERE " + " AND ".join(sql for sql, _ in clauses) if clauses else ""
+        results[dimension] = conn.execute(f"SELECT {column}, COUNT(*) FROM products{where} GROUP BY 1",
+                                          [value for _, value in clauses]).fetchall()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Facet query time as the catalogue grows: in-memory counts vs SQL GROUP BY")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="products in the catalogue")
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--output', default='facets_results.json')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    results = []
+    for count in (int(size) for size in args.sizes.split(',')):
+        rows = product_rows(count, rng)
+        counts = facets.FacetCounts()
+        counts.rebuild(rows)
+        conn = sqlite3.connect(':memory:')
+        conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, category TEXT, price REAL, in_stock INTEGER)")
+        conn.execute("CREATE INDEX products_category ON products (category)")
+        conn.executemany("INSERT INTO products VALUES (?, ?, ?, ?)", rows)
+        for filters in FILTER_SETS:
+            row = {
+                "products": count,
+                "filters": filters,
+                "facet_us": round(time_call(lambda: counts.counts(filters), args.repeats), 1),
+                "sql_us": round(time_call(lambda: sql_counts(conn, filters), max(args.repeats // 10, 3)), 1)
+            }
+            results.append(row)
+            print(f"{count:>8} products  {str(filters):<60} facets {row['facet_us']:>8.1f} us  SQL {row['sql_us']:>11.1f} us")
+        conn.close()
+    write_report(args.output, 'facets', vars(args), results)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import os
+import sys
+import math
+import json
+import time
+import socket
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+# Run server.py in a subprocess against a given database file
+class ServerProcess:
+    def __init__(self, db_path, port=None, env=None, quiet=True):
+        self.db_path = os.path.abspath(db_path)
+        self.port = port or free_port()
+        self.env = dict(os.environ, AUBOUTIQUE_DB=self.db_path, AUBOUTIQUE_PORT=str(self.port), **(env or {}))
+        self.quiet = quiet
+        self.process = None
+
+    def start(self, timeout=10):
+        output = subprocess.DEVNULL if self.quiet else None
+        self.process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, 'server.py')],
+                                        cwd=os.path.dirname(self.db_path), env=self.env,
+                                        stdout=output, stderr=output)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('localhost', self.port), timeout=0.2).close()
+                return self
+            except OSError:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"server.py exited with code {self.process.returncode}")
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError(f"server.py did not start listening on port {self.port}")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# Nearest-rank percentile over an already sorted list
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def summarize_latencies(latencies_ms):
+    values = sorted(round(ms, 3) for ms in latencies_ms)
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 3) if values else None,
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+        "max_ms": values[-1] if values else None
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Write a machine-readable report tagged with the commit it was measured on
+def write_report(path, benchmark, config, results):
+    report = {
+        "benchmark": benchmark,
+        "commit": git_revision(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": sys.version.split()[0],
+        "config": config,
+        "results": results
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return report
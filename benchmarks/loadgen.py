@@ -0,0 +1,232 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+
+from client import AUBoutique
+from benchmarks import seed
+from benchmarks.harness import ServerProcess, summarize_latencies, write_report
+
+DEFAULT_MIX = {'browse': 40, 'search': 25, 'rate': 15, 'buy': 10, 'chat': 10}
+
+
+# How each route answers when it did its job. The server reports most failures as a 200 with
+# {"message": <exception text>}, so any other answer is an error. Buying a product that sold out and
+# looking up or messaging a user who is offline are normal under load and count as declined instead.
+SUCCESS = {
+    '/login': lambda r: "user_id" in r,
+    '/products': lambda r: isinstance(r, list),
+    '/search_product': lambda r: isinstance(r, list),
+    '/search_user_products': lambda r: isinstance(r, list),
+    '/get_average_rating': lambda r: "average_rating" in r,
+    '/rate_product': lambda r: message(r) == "Rating submitted successfully",
+    '/buy_product': lambda r: message(r) == "Product purchase successful",
+    '/get_user_connection_info': lambda r: "ip_address" in r,
+    '/send_message': lambda r: message(r) == "Message sent successfully."
+}
+DECLINED = {
+    '/buy_product': "Product not available or sold out",
+    '/get_user_connection_info': "User is not online",
+    '/send_message': "Receiver not online."
+}
+
+
+def message(response):
+    return response.get("message") if isinstance(response, dict) else None
+
+
+def outcome(route, response):
+    """'ok', 'declined' or 'error' for a decoded response to `route`."""
+    if isinstance(response, dict) and "error" in response:
+        return 'error'
+    if route not in SUCCESS or SUCCESS[route](response):
+        return 'ok'
+    if route in DECLINED and message(response) == DECLINED[route]:
+        return 'declined'
+    return 'error'
+
+
+# Collects per-request and per-workflow timings and outcomes from every simulated client
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = defaultdict(list)
+        self.workflows = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.declined = defaultdict(int)
+
+    def record_request(self, route, elapsed_ms, result):
+        with self.lock:
+            self.routes[route].append(elapsed_ms)
+            if result == 'error':
+                self.errors[route] += 1
+            elif result == 'declined':
+                self.declined[route] += 1
+
+    def record_workflow(self, name, elapsed_ms):
+        with self.lock:
+            self.workflows[name].append(elapsed_ms)
+
+
+class TimedAUBoutique(AUBoutique):
+    def __init__(self, recorder, host, port):
+        super().__init__(host, port)
+        self.recorder = recorder
+
+    def timed(self, send, method, path, body, read_only):
+        route = path.partition('?')[0]
+        start = time.perf_counter()
+        try:
+            response = send(method, path, body, read_only)
+        except OSError as e:
+            self.recorder.record_request(route, (time.perf_counter() - start) * 1000, 'error')
+            return {"error": str(e)}
+        self.recorder.record_request(route, (time.perf_counter() - start) * 1000, outcome(route, response))
+        return response
+
+    def send_request(self, method, path, body=None, read_only=False):
+        return self.timed(super().send_request, method, path, body, read_only)
+
+    def send_conditional_request(self, method, path, body=None, read_only=False):
+        return self.timed(super().send_conditional_request, method, path, body, read_only)
+
+
+# Marketplace workflows, each a short sequence of protocol calls
+def browse(client, rng, config):
+    products = client.list_products()
+    if isinstance(products, list) and products:
+        for product in rng.sample(products, min(3, len(products))):
+            client.view_average_rating(product['id'])
+
+
+def search(client, rng, config):
+    results = client.search_product(rng.choice(seed.WORDS))
+    if isinstance(results, list) and results:
+        client.view_average_rating(rng.choice(results)['id'])
+    if rng.random() < 0.3:
+        client.search_user_products(f"user{rng.randint(1, config['users'])}")
+
+
+def rate(client, rng, config):
+    product_id = rng.randint(1, config['products'])
+    client.rate_product(product_id, rng.randint(1, 5))
+    client.view_average_rating(product_id)
+
+
+def buy(client, rng, config):
+    client.buy_product(rng.randint(1, config['products']))
+
+
+def chat(client, rng, config):
+    receiver = f"user{rng.randint(1, config['users'])}"
+    client.get_connection_info(receiver)
+    client.send_request('POST', '/send_message', {
+        "sender_id": client.user_id,
+        "sender_username": client.username,
+        "receiver_username": receiver,
+        "message": "Is this still available?"
+    })
+
+
+WORKFLOWS = {'browse': browse, 'search': search, 'rate': rate, 'buy': buy, 'chat': chat}
+
+
+def simulated_client(index, recorder, config, deadline):
+    rng = random.Random(config['seed'] * 1000 + index)
+    client = TimedAUBoutique(recorder, config['host'], config['port'])
+    username = f"user{index % config['users'] + 1}"
+    client.login_user(username, seed.PASSWORD, 20000 + index)
+    names = list(config['mix'])
+    weights = [config['mix'][name] for name in names]
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        WORKFLOWS[name](client, rng, config)
+        recorder.record_workflow(name, (time.perf_counter() - start) * 1000)
+
+
+def run_load(config):
+    """Drive a running server with `config['clients']` concurrent simulated users and summarize the results."""
+    recorder = Recorder()
+    start = time.monotonic()
+    deadline = start + config['duration']
+    threads = [threading.Thread(target=simulated_client, args=(i, recorder, config, deadline), daemon=True)
+               for i in range(config['clients'])]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+
+    all_latencies = [ms for values in recorder.routes.values() for ms in values]
+    total_errors = sum(recorder.errors.values())
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "requests": len(all_latencies),
+        "errors": total_errors,
+        "error_rate": total_errors / len(all_latencies) if all_latencies else 0.0,
+        "declined": sum(recorder.declined.values()),
+        "throughput_rps": round(len(all_latencies) / elapsed, 2),
+        "latency": summarize_latencies(all_latencies),
+        "routes": {route: dict(summarize_latencies(values), errors=recorder.errors[route], declined=recorder.declined[route])
+                   for route, values in sorted(recorder.routes.items())},
+        "workflows": {name: summarize_latencies(values) for name, values in sorted(recorder.workflows.items())}
+    }
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in WORKFLOWS:
+            raise argparse.ArgumentTypeError(f"unknown workflow {name!r}")
+        mix[name] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the AUBoutique server with simulated clients")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=None,
+                        help="target an already running server instead of spawning one")
+    parser.add_argument('--db', default=None, help="database to seed (default: a temporary file)")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--ratings', type=int, default=5000)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="workflow weights, e.g. browse=40,search=25,rate=15,buy=10,chat=10")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='loadgen_results.json')
+    args = parser.parse_args()
+
+    config = {
+        "host": args.host, "port": args.port, "users": args.users, "products": args.products,
+        "ratings": args.ratings, "messages": args.messages, "clients": args.clients,
+        "duration": args.duration, "mix": args.mix, "seed": args.seed
+    }
+    if args.port is not None:
+        results = run_load(config)
+    else:
+        workdir = tempfile.mkdtemp(prefix='auboutique-bench-')
+        db_path = args.db or os.path.join(workdir, 'bench.db')
+        seed.seed_database(db_path, args.users, args.products, args.ratings, args.messages, args.seed)
+        with ServerProcess(db_path) as server_process:
+            config['port'] = server_process.port
+            results = run_load(config)
+
+    write_report(args.output, 'loadgen', config, results)
+    latency = results['latency']
+    print(f"{results['requests']} requests in {results['elapsed_s']}s: {results['throughput_rps']} req/s, "
+          f"p50 {latency['p50_ms']:.2f} ms, p95 {latency['p95_ms']:.2f} ms, p99 {latency['p99_ms']:.2f} ms, "
+          f"error rate {results['error_rate']:.2%}, {results['declined']} declined")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+from client import ConnectionPool, build_request
+from benchmarks import seed
+from benchmarks.harness import ServerProcess, summarize_latencies, write_report
+
+
+# One catalogue search per request; no If-None-Match, so every request reaches the database
+def search_payload(rng):
+    return build_request('POST', '/search_product', 'localhost', {"search_term": rng.choice(seed.WORDS)})
+
+
+# Closed-loop run to estimate how many requests per second the server completes
+def calibrate(port, threads=8, duration=2.0):
+    pool = ConnectionPool('localhost', port, max_idle=threads)
+    deadline = time.monotonic() + duration
+    counts = [0] * threads
+
+    def worker(index):
+        rng = random.Random(index)
+        while time.monotonic() < deadline:
+            pool.request(search_payload(rng))
+            counts[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    pool.close()
+    return sum(counts) / duration
+
+
+# Open-loop load: request i is due at start + i / rate whether or not earlier ones finished.
+# Latency is measured from the due time, so time spent waiting for a free worker counts too.
+def offered_load(port, rate, duration, workers, slo_ms, timeout):
+    pool = ConnectionPool('localhost', port, max_idle=workers, timeout=timeout)
+    total = int(rate * duration)
+    lock = threading.Lock()
+    state = {"next": 0}
+    ok, shed, errors, late = [], 0, 0, 0
+    start = time.monotonic() + 0.1
+
+    def worker(index):
+        nonlocal shed, errors, late
+        rng = random.Random(index)
+        while True:
+            with lock:
+                i = state["next"]
+                state["next"] += 1
+            if i >= total:
+                return
+            due = start + i / rate
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                status, _, _ = pool.request(search_payload(rng))
+            except OSError:
+                status = None
+            elapsed_ms = (time.monotonic() - due) * 1000
+            with lock:
+                if status == 200:
+                    ok.append(elapsed_ms)
+                    if elapsed_ms > slo_ms:
+                        late += 1
+                elif status in (429, 503):
+                    shed += 1
+                else:
+                    errors += 1
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+    pool.close()
+    return {
+        "offered_rps": round(rate, 1),
+        "completed": len(ok),
+        "goodput_rps": round((len(ok) - late) / elapsed, 1),
+        "shed": shed,
+        "errors": errors,
+        "over_slo": late,
+        "latency": summarize_latencies(ok)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Goodput and latency past saturation, with and without admission control")
+    parser.add_argument('--db', default=None, help="database to seed (default: a temporary file)")
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--loads', default='0.5,1,1.5,2,3', help="offered load as multiples of measured capacity")
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--workers', type=int, default=64, help="client threads issuing requests")
+    parser.add_argument('--slo-ms', type=float, default=500.0, help="responses slower than this do not count as goodput")
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--output', default='overload_results.json')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='auboutique-overload-')
+    db_path = args.db or os.path.join(workdir, 'bench.db')
+    seed.seed_database(db_path, products=args.products)
+    modes = {
+        "admission": {},
+        # Effectively unbounded: every request is admitted and queues inside the server
+        "no_admission": {"AUBOUTIQUE_MAX_IN_FLIGHT": "1000000"}
+    }
+    results = {}
+    capacity = None
+    for mode, env in modes.items():
+        with ServerProcess(db_path, env=env) as server_process:
+            # Both modes are offered the same request rates, based on the first server's capacity
+            if capacity is None:
+                capacity = calibrate(server_process.port)
+                print(f"Measured capacity {capacity:.0f} req/s")
+            print(mode)
+            rows = []
+            for factor in (float(load) for load in args.loads.split(',')):
+                row = dict(offered_load(server_process.port, capacity * factor, args.duration, args.workers,
+                                        args.slo_ms, args.timeout), load=factor)
+                rows.append(row)
+                latency = row['latency']
+                print(f"  {factor:>4}x  offered {row['offered_rps']:>7} rps  goodput {row['goodput_rps']:>7} rps  "
+                      f"shed {row['shed']:>6}  errors {row['errors']:>4}  p50 {latency['p50_ms']} ms  p99 {latency['p99_ms']} ms")
+            results[mode] = rows
+    results["capacity_rps"] = round(capacity, 1)
+    write_report(args.output, 'overload', vars(args), results)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+
+from client import AUBoutique, ConnectionPool
+from async_client import AsyncAUBoutique, AsyncConnectionPool
+from benchmarks import seed
+from benchmarks.harness import ServerProcess, summarize_latencies, write_report
+
+# Data needed to render the Django products page: the catalogue, the ratings of the
+# products shown, and the viewer's own listings.
+
+
+def render_sync(boutique, shown, username):
+    products = boutique.list_products()
+    ratings = [boutique.view_average_rating(product['id']) for product in products[:shown]]
+    own = boutique.search_user_products(username)
+    return products, ratings, own
+
+
+async def render_async(boutique, shown, username):
+    products, own = await boutique.gather(boutique.list_products(), boutique.search_user_products(username))
+    ratings = await boutique.with_average_ratings(products[:shown])
+    return products, ratings, own
+
+
+def bench_sync(port, pages, shown):
+    boutique = AUBoutique(port=port, pool=ConnectionPool('localhost', port))
+    latencies = []
+    for i in range(pages):
+        start = time.perf_counter()
+        render_sync(boutique, shown, f"user{i % 10 + 1}")
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+async def bench_async(port, pages, shown):
+    boutique = AsyncAUBoutique(port=port, pool=AsyncConnectionPool('localhost', port))
+    latencies = []
+    for i in range(pages):
+        start = time.perf_counter()
+        await render_async(boutique, shown, f"user{i % 10 + 1}")
+        latencies.append((time.perf_counter() - start) * 1000)
+    await boutique.pool.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare page-render latency of the sync and asyncio clients")
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--shown', type=int, default=25, help="products per page whose ratings are fetched")
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--output', default='page_render_results.json')
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='auboutique-bench-'), 'bench.db')
+    seed.seed_database(db_path, users=50, products=args.products, ratings=args.products * 3, messages=0)
+    with ServerProcess(db_path) as server_process:
+        sync_latencies = bench_sync(server_process.port, args.pages, args.shown)
+        async_latencies = asyncio.run(bench_async(server_process.port, args.pages, args.shown))
+
+    results = {"sync": summarize_latencies(sync_latencies), "async": summarize_latencies(async_latencies)}
+    write_report(args.output, 'page_render', vars(args), results)
+    for name, summary in results.items():
+        print(f"{name:>5}: p50 {summary['p50_ms']:.2f} ms, p95 {summary['p95_ms']:.2f} ms, p99 {summary['p99_ms']:.2f} ms")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import os
+import random
+import hashlib
+import argparse
+
+import server
+import storage
+
+PASSWORD = 'password'
+CATEGORIES = ['books', 'electronics', 'clothing', 'crafts', 'collectibles', 'furniture', 'sports', 'music']
+WORDS = ['vintage', 'used', 'calculus', 'physics', 'handmade', 'wooden', 'lamp', 'jacket', 'guitar', 'poster',
+         'laptop', 'chair', 'mug', 'notebook', 'scarf', 'camera', 'racket', 'ceramic', 'textbook', 'stamp']
+
+
+def seeded_password():
+    # The client hashes before sending and the server hashes again on storage
+    client_hash = hashlib.sha256(PASSWORD.encode('utf-8')).hexdigest()
+    return server.hash_password(client_hash)
+
+
+def product_name(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(3))
+
+
+def seed_database(db_path, users=100, products=1000, ratings=5000, messages=2000, seed=42):
+    """Create a fresh database at `db_path` filled with deterministic synthetic data."""
+    rng = random.Random(seed)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    store = storage.SQLiteStorage(db_path)
+    store.setup()
+
+    conn = store.connect()
+    c = conn.cursor()
+    password = seeded_password()
+    c.executemany("INSERT INTO users (id, first_name, last_name, email, username, password) VALUES (?, ?, ?, ?, ?, ?)",
+                  [(i, f"First{i}", f"Last{i}", f"user{i}@mail.aub.edu", f"user{i}", password)
+                   for i in range(1, users + 1)])
+    c.executemany("INSERT INTO products (id, name, owner_id, category, price, description, image, quantity) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                  [(i, product_name(rng), rng.randint(1, users), rng.choice(CATEGORIES),
+                    round(rng.uniform(1, 500), 2), f"Description of product {i}. " * 3,
+                    f"https://images.example.com/products/{i}.jpg", rng.randint(1, 20))
+                   for i in range(1, products + 1)])
+    pairs = set()
+    ratings = min(ratings, users * products)
+    while len(pairs) < ratings:
+        pairs.add((rng.randint(1, products), rng.randint(1, users)))
+    c.executemany("INSERT INTO product_ratings (product_id, user_id, rating) VALUES (?, ?, ?)",
+                  [(product_id, user_id, rng.randint(1, 5)) for product_id, user_id in sorted(pairs)])
+    c.executemany("INSERT INTO messages (sender_id, receiver_id, message) VALUES (?, ?, ?)",
+                  [(rng.randint(1, users), rng.randint(1, users), f"Is item {rng.randint(1, products)} still available?")
+                   for _ in range(messages)])
+    conn.commit()
+    conn.close()
+    return {"users": users, "products": products, "ratings": ratings, "messages": messages, "seed": seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed an AUBoutique database with synthetic data")
+    parser.add_argument('--db', default='bench.db')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--ratings', type=int, default=5000)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    counts = seed_database(args.db, args.users, args.products, args.ratings, args.messages, args.seed)
+    print(f"Seeded {args.db}: {counts}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+from benchmarks.harness import REPO_ROOT, write_report
+
+# Runs in a fresh interpreter: import the GUI, build the main window and paint it once
+WINDOW_SNIPPET = '''
+import sys, json, time
+start = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+qt_app = QApplication(sys.argv)
+import app
+imported = time.perf_counter()
+window = app.MainWindow()
+window.show()
+qt_app.processEvents()
+shown = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "first_window_ms": (shown - start) * 1000,
+                  "pages_built": sorted(window.pages)}))
+'''
+
+
+def gui_env():
+    # Offscreen platform so the benchmark runs headless
+    return dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+
+
+def time_to_first_window(runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', WINDOW_SNIPPET], cwd=REPO_ROOT, env=gui_env(),
+                                capture_output=True, text=True, check=True)
+        wall_ms = (time.perf_counter() - start) * 1000
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        sample['process_wall_ms'] = wall_ms
+        samples.append(sample)
+    return {
+        "runs": runs,
+        "import_ms_median": statistics.median(s['import_ms'] for s in samples),
+        "first_window_ms_median": statistics.median(s['first_window_ms'] for s in samples),
+        "process_wall_ms_median": statistics.median(s['process_wall_ms'] for s in samples),
+        "pages_built_at_startup": samples[-1]['pages_built']
+    }
+
+
+def parse_importtime(stderr):
+    # Lines look like: "import time:   self [us] |  cumulative | imported package"
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        entries.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us)
+        })
+    return entries
+
+
+def import_breakdown(module, top):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=REPO_ROOT,
+                            env=gui_env(), capture_output=True, text=True, check=True)
+    entries = parse_importtime(result.stderr)
+    top_level = [e for e in entries if e['depth'] == 0]
+    return {
+        "module": module,
+        "total_ms": sum(e['cumulative_us'] for e in top_level) / 1000,
+        "top_level_by_cumulative": sorted(top_level, key=lambda e: e['cumulative_us'], reverse=True)[:top],
+        "by_self_time": sorted(entries, key=lambda e: e['self_us'], reverse=True)[:top]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure GUI import time and time-to-first-window")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--output', default='startup_results.json')
+    args = parser.parse_args()
+
+    results = {
+        "window": time_to_first_window(args.runs),
+        "imports": [import_breakdown(module, args.top) for module in ('app', 'client')]
+    }
+    write_report(args.output, 'startup', vars(args), results)
+    window = results['window']
+    print(f"import {window['import_ms_median']:.1f} ms, first window {window['first_window_ms_median']:.1f} ms "
+          f"(process wall {window['process_wall_ms_median']:.1f} ms)")
+    for breakdown in results['imports']:
+        print(f"\nimport {breakdown['module']}: {breakdown['total_ms']:.1f} ms")
+        for entry in breakdown['top_level_by_cumulative']:
+            print(f"  {entry['cumulative_us'] / 1000:8.2f} ms  {entry['module']}")
+    print(f"\nReport written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
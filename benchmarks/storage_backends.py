@@ -0,0 +1,99 @@
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import statistics
+
+import storage
+import message_store
+from benchmarks import seed
+from benchmarks.loadgen import DEFAULT_MIX, parse_mix, run_load
+from benchmarks.harness import ServerProcess, write_report
+
+# Where the time goes: the same load against the server on SQLite and on in-memory storage, plus
+# the storage calls behind each route timed in-process. Memory-backed latency is protocol overhead
+# (parsing, framing, JSON, threads); the difference to SQLite is storage cost.
+BACKENDS = ('sqlite', 'memory')
+
+
+def storage_calls(config, rng):
+    return {
+        '/products': lambda store: store.list_products(),
+        '/search_product': lambda store: store.search_products(rng.choice(seed.WORDS)),
+        '/get_average_rating': lambda store: store.average_rating(rng.randint(1, config['products'])),
+        '/rate_product': lambda store: store.rate_product(rng.randint(1, config['products']), rng.randint(1, config['users']), rng.randint(1, 5)),
+        '/search_user_products': lambda store: store.products_by_owner(rng.randint(1, config['users'])),
+        '/get_user_connection_info': lambda store: store.find_user(f"user{rng.randint(1, config['users'])}")
+    }
+
+
+def time_storage(store, config, repeats):
+    timings = {}
+    for route, call in storage_calls(config, random.Random(config['seed'])).items():
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            call(store)
+            samples.append((time.perf_counter() - start) * 1e6)
+        timings[route] = round(statistics.median(samples), 1)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server latency on SQLite vs in-memory storage, and storage call cost alone")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--ratings', type=int, default=5000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="workflow weights, e.g. browse=40,search=25,rate=15,buy=10,chat=10")
+    parser.add_argument('--repeats', type=int, default=200, help="in-process calls per storage operation")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='storage_backends_results.json')
+    args = parser.parse_args()
+
+    config = {"host": 'localhost', "users": args.users, "products": args.products, "ratings": args.ratings,
+              "messages": 0, "clients": args.clients, "duration": args.duration, "mix": args.mix, "seed": args.seed}
+    workdir = tempfile.mkdtemp(prefix='auboutique-storage-')
+    seeded = os.path.join(workdir, 'seeded.db')
+    seed.seed_database(seeded, args.users, args.products, args.ratings, 0, args.seed)
+    results = {}
+    for backend in BACKENDS:
+        root = os.path.join(workdir, backend)
+        os.makedirs(root)
+        db_path = os.path.join(root, 'bench.db')
+        shutil.copy(seeded, db_path)
+        with ServerProcess(db_path, env={'AUBOUTIQUE_STORAGE': backend}) as server_process:
+            config['port'] = server_process.port
+            load = run_load(config)
+        shutil.copy(seeded, db_path)
+        source = storage.SQLiteStorage(db_path, messages=message_store.MessageStore(os.path.join(root, 'messages')))
+        store = source if backend == 'sqlite' else storage.MemoryStorage(source)
+        store.setup()
+        results[backend] = {
+            "throughput_rps": load['throughput_rps'],
+            "error_rate": load['error_rate'],
+            "latency": load['latency'],
+            "routes": load['routes'],
+            "storage_us": time_storage(store, config, args.repeats)
+        }
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    write_report(args.output, 'storage_backends', dict(config, port=None), results)
+    for backend in BACKENDS:
+        print(f"{backend:>7}: {results[backend]['throughput_rps']} req/s, p50 {results[backend]['latency']['p50_ms']:.2f} ms")
+    print(f"{'route':<28}" + "".join(f"{backend + ' p50 ms':>16}{backend + ' store us':>18}" for backend in BACKENDS))
+    for route in storage_calls(config, random.Random()):
+        row = f"{route:<28}"
+        for backend in BACKENDS:
+            p50 = results[backend]['routes'].get(route, {}).get('p50_ms')
+            row += f"{p50 if p50 is not None else '-':>16}{results[backend]['storage_us'][route]:>18}"
+        print(row)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
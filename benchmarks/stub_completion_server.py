@@ -0,0 +1,95 @@
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the OpenAI chat completions API. Point the client at it with
+#     OPENAI_BASE_URL=http://localhost:8765/v1 OPENAI_API_KEY=stub
+# Replies echo the prompt word by word, streaming one word every `chunk_delay` seconds.
+
+
+class StubCompletionHandler(BaseHTTPRequestHandler):
+    chunk_delay = 0.02
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.endswith('/chat/completions'):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        self.server.request_count += 1
+        prompt = request['messages'][-1]['content']
+        words = f"You said: {prompt}".split(' ')
+        model = request.get('model', 'stub')
+        if request.get('stream'):
+            self.stream_reply(model, words)
+        else:
+            self.send_reply(model, ' '.join(words))
+
+    def send_reply(self, model, text):
+        time.sleep(self.chunk_delay * len(text.split(' ')))
+        body = json.dumps({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_reply(self, model, words):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for i, word in enumerate(words):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else ' ' + word}, "finish_reason": None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.chunk_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class StubCompletionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, chunk_delay=0.02):
+        handler = type('Handler', (StubCompletionHandler,), {"chunk_delay": chunk_delay})
+        super().__init__(('localhost', port), handler)
+        self.request_count = 0
+
+    @property
+    def base_url(self):
+        return f"http://localhost:{self.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the chat completions API")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--chunk-delay', type=float, default=0.02)
+    args = parser.parse_args()
+    server = StubCompletionServer(args.port, args.chunk_delay)
+    print(f"Stub completion server on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
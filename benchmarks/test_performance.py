@@ -0,0 +1,123 @@
+import os
+import time
+import random
+
+import pytest
+
+import server
+from client import AUBoutique
+from benchmarks import seed
+from benchmarks.loadgen import DEFAULT_MIX, run_load
+from benchmarks.harness import summarize_latencies, write_report
+
+# Performance regression suite: `python -m pytest benchmarks/test_performance.py`. An in-process
+# server.Server on a free port serves a freshly seeded database; each route is called REQUESTS
+# times in a row by one client (ETag revalidation off, so every call does the full work) and must
+# stay within its p95 latency and throughput budget, then a mixed multi-client load must stay
+# within the overall budget without errors. Client and server share one interpreter, so figures
+# include client-side cost and are only comparable on the same machine. AUBOUTIQUE_PERF_SCALE
+# loosens every budget on slower machines (2 = twice the latency, half the throughput). Measured
+# figures go to AUBOUTIQUE_PERF_REPORT, by default performance_results.json in pytest's temporary
+# directory.
+USERS = 50
+PRODUCTS = 2000
+RATINGS = 10000
+REQUESTS = 200
+SCALE = float(os.environ.get('AUBOUTIQUE_PERF_SCALE', 1))
+REPORT_PATH = os.environ.get('AUBOUTIQUE_PERF_REPORT')
+
+# route: (p95 ms, requests per second), about three times what a 1-CPU development machine measures
+BUDGETS = {
+    '/products': (150, 10),
+    '/browse': (10, 150),
+    '/search_product': (40, 40),
+    '/facets': (5, 300),
+    '/leaderboard': (5, 300),
+    '/get_average_rating': (5, 300),
+    '/similar_products': (5, 300),
+    '/seller_dashboard': (10, 150),
+    '/get_user_connection_info': (5, 300),
+    '/rate_product': (50, 30),
+    '/add_product': (25, 60)
+}
+MIXED_LOAD = {"clients": 4, "duration": 5.0, "p95_ms": 300, "rps": 50}
+
+RESULTS = {}
+
+
+def route_calls(rng):
+    return {
+        '/products': lambda c: c.list_products(),
+        '/browse': lambda c: c.browse_products(category=rng.choice(seed.CATEGORIES), sort='-rating', limit=20),
+        '/search_product': lambda c: c.search_product(rng.choice(seed.WORDS)),
+        '/facets': lambda c: c.facets(in_stock=True),
+        '/leaderboard': lambda c: c.leaderboard(category=rng.choice(seed.CATEGORIES)),
+        '/get_average_rating': lambda c: c.view_average_rating(rng.randint(1, PRODUCTS)),
+        '/similar_products': lambda c: c.similar_products(rng.randint(1, PRODUCTS)),
+        '/seller_dashboard': lambda c: c.seller_dashboard(),
+        '/get_user_connection_info': lambda c: c.send_request('POST', '/get_user_connection_info', {"username": f"user{rng.randint(1, USERS)}"}),
+        '/rate_product': lambda c: c.rate_product(rng.randint(1, PRODUCTS), rng.randint(1, 5)),
+        '/add_product': lambda c: c.add_product(seed.product_name(rng), rng.choice(seed.CATEGORIES), round(rng.uniform(1, 500), 2),
+                                                'Listed by the performance suite', None, 1)
+    }
+
+
+# What a successful response looks like for each route; server errors come back as {"message": ...}
+SUCCESS = {
+    '/products': lambda r: isinstance(r, list) and len(r) >= PRODUCTS,
+    '/browse': lambda r: isinstance(r, dict) and "products" in r and "total" in r,
+    '/search_product': lambda r: isinstance(r, list),
+    '/facets': lambda r: isinstance(r, dict) and "facets" in r,
+    '/leaderboard': lambda r: isinstance(r, dict) and "products" in r,
+    '/get_average_rating': lambda r: isinstance(r, dict) and "average_rating" in r,
+    '/similar_products': lambda r: isinstance(r, dict) and "similar" in r,
+    '/seller_dashboard': lambda r: isinstance(r, dict) and "units_sold" in r,
+    '/get_user_connection_info': lambda r: "ip_address" in r or r.get("message") == "User is not online",
+    '/rate_product': lambda r: r.get("message") == "Rating submitted successfully",
+    '/add_product': lambda r: r.get("message") == "Product added successfully"
+}
+
+
+@pytest.fixture(scope='module')
+def running_server(tmp_path_factory):
+    db_path = str(tmp_path_factory.mktemp('perf') / 'perf.db')
+    seed.seed_database(db_path, USERS, PRODUCTS, RATINGS, 0, 42)
+    with server.Server(db_path) as running:
+        yield running
+    write_report(REPORT_PATH or str(tmp_path_factory.getbasetemp() / 'performance_results.json'), 'performance_regression',
+                 {"users": USERS, "products": PRODUCTS, "ratings": RATINGS, "requests": REQUESTS, "scale": SCALE}, RESULTS)
+
+
+@pytest.fixture(scope='module')
+def session(running_server):
+    c = AUBoutique('localhost', running_server.port)
+    c.login_user('user1', seed.PASSWORD, 30001)
+    return c
+
+
+@pytest.mark.parametrize('route', sorted(BUDGETS))
+def test_route_budget(session, route):
+    call = route_calls(random.Random(route))[route]
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        session.validated.clear()
+        began = time.perf_counter()
+        response = call(session)
+        latencies.append((time.perf_counter() - began) * 1000)
+        assert SUCCESS[route](response), response
+    rps = REQUESTS / (time.perf_counter() - start)
+    summary = summarize_latencies(latencies)
+    RESULTS[route] = dict(summary, throughput_rps=round(rps, 1))
+    p95_budget, rps_budget = BUDGETS[route]
+    assert summary['p95_ms'] <= p95_budget * SCALE, f"{route} p95 {summary['p95_ms']} ms over {p95_budget * SCALE} ms"
+    assert rps >= rps_budget / SCALE, f"{route} {rps:.1f} req/s under {rps_budget / SCALE} req/s"
+
+
+def test_mixed_load_budget(running_server):
+    load = run_load({"host": 'localhost', "port": running_server.port, "users": USERS, "products": PRODUCTS,
+                     "clients": MIXED_LOAD['clients'], "duration": MIXED_LOAD['duration'], "mix": DEFAULT_MIX, "seed": 42})
+    RESULTS['mixed'] = {key: load[key] for key in ('requests', 'errors', 'throughput_rps', 'latency')}
+    assert load['errors'] == 0, load['routes']
+    assert load['latency']['p95_ms'] <= MIXED_LOAD['p95_ms'] * SCALE
+    assert load['throughput_rps'] >= MIXED_LOAD['rps'] / SCALE
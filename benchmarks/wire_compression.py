@@ -0,0 +1,71 @@
+import json
+import time
+import random
+import argparse
+import statistics
+
+import compression
+import server
+from benchmarks import seed
+from benchmarks.harness import write_report
+
+
+def listing_body(count, rng):
+    rows = [(i, seed.product_name(rng), rng.randint(1, 100), rng.choice(seed.CATEGORIES), round(rng.uniform(1, 500), 2),
+             f"Description of product {i}. " * 3, f"https://images.example.com/products/{i}.jpg", rng.randint(1, 20), None)
+            for i in range(1, count + 1)]
+    return json.dumps(server.serialize_products(rows)).encode('utf-8')
+
+
+def time_call(func, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return result, statistics.median(samples)
+
+
+def measure(body, encoding, level, repeats):
+    if encoding == 'gzip':
+        compression.GZIP_LEVEL = level
+    elif encoding == 'zstd':
+        compression.ZSTD_LEVEL = level
+    compressed, compress_us = time_call(lambda: compression.compress(body, encoding), repeats)
+    _, decompress_us = time_call(lambda: compression.decompress(compressed, encoding), repeats)
+    return {
+        "encoding": encoding,
+        "level": level,
+        "raw_bytes": len(body),
+        "wire_bytes": len(compressed),
+        "ratio": round(len(body) / len(compressed), 2),
+        "compress_us": round(compress_us, 1),
+        "decompress_us": round(decompress_us, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes on wire and CPU cost of response compression by payload size")
+    parser.add_argument('--sizes', default='10,100,1000,10000', help="products per listing")
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--output', default='compression_results.json')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    codecs = [('gzip', 1), ('gzip', 6), ('gzip', 9)]
+    if compression.zstandard is not None:
+        codecs += [('zstd', 1), ('zstd', 3), ('zstd', 9)]
+    results = []
+    for count in (int(size) for size in args.sizes.split(',')):
+        body = listing_body(count, rng)
+        for encoding, level in codecs:
+            row = dict(measure(body, encoding, level, args.repeats), products=count)
+            results.append(row)
+            print(f"{count:>6} products  {encoding:>4}-{level}  {row['raw_bytes']:>9} -> {row['wire_bytes']:>8} bytes "
+                  f"(x{row['ratio']:<6}) compress {row['compress_us']:>9.1f} us  decompress {row['decompress_us']:>8.1f} us")
+    write_report(args.output, 'compression', vars(args), results)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
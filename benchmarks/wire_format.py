@@ -0,0 +1,77 @@
+import json
+import time
+import random
+import argparse
+import statistics
+
+import server
+import wire_format
+from benchmarks import seed
+from benchmarks.harness import write_report
+
+
+def product_rows(count, rng):
+    return [(i, seed.product_name(rng), rng.randint(1, 100), rng.choice(seed.CATEGORIES), round(rng.uniform(1, 500), 2),
+             f"Description of product {i}. " * 3, f"https://images.example.com/products/{i}.jpg", rng.randint(1, 20), None)
+            for i in range(1, count + 1)]
+
+
+def encode(rows, fmt):
+    response = server.serialize_products(rows, fmt=fmt)
+    if isinstance(response, bytes):
+        return response, wire_format.BINARY_CONTENT_TYPE
+    return json.dumps(response).encode('utf-8'), 'application/json'
+
+
+def time_call(func, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return result, statistics.median(samples)
+
+
+# Decoding includes reading every price, so lazy row views pay for their field accesses
+def consume(products):
+    if isinstance(products, wire_format.ProductRows):
+        return sum(products.column('price'))
+    return sum(product['price'] for product in products)
+
+
+def measure(rows, fmt, repeats):
+    (payload, content_type), encode_us = time_call(lambda: encode(rows, fmt), repeats)
+    _, decode_us = time_call(lambda: consume(wire_format.decode(content_type, payload)), repeats)
+    return {
+        "format": fmt or 'rows',
+        "wire_bytes": len(payload),
+        "encode_us": round(encode_us, 1),
+        "decode_us": round(decode_us, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Payload size and encode/decode cost of the product result set formats")
+    parser.add_argument('--sizes', default='10,100,1000,10000', help="products per result set")
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--output', default='wire_format_results.json')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    results = []
+    for count in (int(size) for size in args.sizes.split(',')):
+        rows = product_rows(count, rng)
+        baseline = None
+        for fmt in (None, 'columnar', 'binary'):
+            row = dict(measure(rows, fmt, args.repeats), products=count)
+            baseline = baseline or row['wire_bytes']
+            row['size_vs_rows'] = round(row['wire_bytes'] / baseline, 3)
+            results.append(row)
+            print(f"{count:>6} products  {row['format']:>8}  {row['wire_bytes']:>9} bytes ({row['size_vs_rows']:>5})  "
+                  f"encode {row['encode_us']:>9.1f} us  decode {row['decode_us']:>9.1f} us")
+    write_report(args.output, 'wire_format', vars(args), results)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
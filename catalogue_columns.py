@@ -0,0 +1,181 @@
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import facets
+
+# Read-optimized copy of the catalogue for browsing: one NumPy array per filterable or sortable
+# column (id, owner_id, price, quantity, in stock, category code, rating sum and count), plus the
+# full row tuples. A query filters with boolean masks over whole columns and orders only the page
+# it returns (argpartition, then a sort of those rows), so no per-row Python runs until the page is
+# built. rebuild() loads it at startup; add, sell and rate keep it current after each write.
+SORTS = ('id', 'price', 'rating', 'rating_count')
+
+
+def rating_key(rating_sum, rating_count, descending):
+    average = rating_sum / max(rating_count, 1)
+    # Unrated products go last in either direction
+    return (rating_count == 0, -average if descending else average)
+
+
+class ColumnarCatalogue:
+    def __init__(self, capacity=1024):
+        self.lock = threading.Lock()
+        self.reset(capacity)
+
+    def reset(self, capacity):
+        self.size = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.owners = np.zeros(capacity, dtype=np.int64)
+        self.prices = np.zeros(capacity, dtype=np.float64)
+        self.quantities = np.zeros(capacity, dtype=np.int64)
+        self.in_stock = np.zeros(capacity, dtype=bool)
+        self.categories = np.zeros(capacity, dtype=np.int32)
+        self.rating_sums = np.zeros(capacity, dtype=np.int64)
+        self.rating_counts = np.zeros(capacity, dtype=np.int64)
+        self.rows = []
+        self.positions = {}
+        # Category name <-> code; code 0 is "no category"
+        self.category_codes = {None: 0}
+
+    def columns(self):
+        return ('ids', 'owners', 'prices', 'quantities', 'in_stock', 'categories', 'rating_sums', 'rating_counts')
+
+    def category_code(self, category):
+        return self.category_codes.setdefault(category, len(self.category_codes))
+
+    def rebuild(self, products, ratings):
+        """Load from product rows (products column order) and (product_id, rating sum, rating count) rows."""
+        with self.lock:
+            self.reset(max(len(products), 1024))
+            for row in products:
+                self.append(row)
+            for product_id, rating_sum, rating_count in ratings:
+                position = self.positions.get(product_id)
+                if position is not None:
+                    self.rating_sums[position] = rating_sum
+                    self.rating_counts[position] = rating_count
+
+    def append(self, row):
+        if self.size == len(self.ids):
+            for name in self.columns():
+                column = getattr(self, name)
+                grown = np.zeros(2 * len(column), dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                setattr(self, name, grown)
+        position = self.size
+        self.size += 1
+        self.rows.append(row)
+        self.positions[row[0]] = position
+        self.set_row(position, row)
+
+    def set_row(self, position, row):
+        product_id, _, owner_id, category, price, _, _, quantity, buyer_id = row
+        self.rows[position] = row
+        self.ids[position] = product_id
+        self.owners[position] = owner_id or 0
+        self.prices[position] = float(price or 0)
+        self.quantities[position] = quantity or 0
+        self.in_stock[position] = (quantity or 0) > 0 and buyer_id is None
+        self.categories[position] = self.category_code(category)
+
+    def add(self, row):
+        with self.lock:
+            if row[0] in self.positions:
+                self.set_row(self.positions[row[0]], row)
+            else:
+                self.append(row)
+
+    # A unit was sold: the row now has `quantity` left and, once sold out, its buyer
+    def sell(self, product_id, quantity, buyer_id):
+        with self.lock:
+            position = self.positions.get(product_id)
+            if position is not None:
+                self.set_row(position, self.rows[position][:7] + (quantity, buyer_id if quantity == 0 else None))
+
+    def rate(self, product_id, previous, rating):
+        with self.lock:
+            position = self.positions.get(product_id)
+            if position is not None:
+                self.rating_sums[position] += rating - (previous or 0)
+                self.rating_counts[position] += previous is None
+
+    def query(self, filters=None, sort='id', descending=False, limit=50, offset=0, min_price=None, max_price=None):
+        """(number of matches, [(row, average rating, rating count), ...] for one page) for facet filters
+        plus an optional price range, ordered by `sort` with ties broken by id."""
+        filters = filters or {}
+        if sort not in SORTS:
+            raise ValueError(f"Unknown sort {sort}")
+        with self.lock:
+            n = self.size
+            mask = np.ones(n, dtype=bool)
+            if 'category' in filters:
+                code = self.category_codes.get(filters['category'])
+                mask &= self.categories[:n] == code if code is not None else False
+            prices = self.prices[:n]
+            if 'price' in filters:
+                low, high = facets.price_range(filters['price'])
+                mask &= prices >= low
+                if high is not None:
+                    mask &= prices < high
+            if min_price is not None:
+                mask &= prices >= float(min_price)
+            if max_price is not None:
+                mask &= prices <= float(max_price)
+            if 'in_stock' in filters:
+                mask &= self.in_stock[:n] == filters['in_stock']
+            matches = np.flatnonzero(mask)
+            total = len(matches)
+
+            ids = self.ids[matches]
+            if sort == 'id':
+                key = ids
+            elif sort == 'price':
+                key = self.prices[matches]
+            elif sort == 'rating_count':
+                key = self.rating_counts[matches].astype(np.float64)
+            else:
+                counts = self.rating_counts[matches]
+                key = np.divide(self.rating_sums[matches], counts, out=np.zeros(total), where=counts > 0)
+            key = key.astype(np.float64)
+            if descending:
+                key = -key
+            if sort == 'rating':
+                key[counts == 0] = np.inf
+            # Only the rows up to the end of the page need ordering
+            end = min(offset + limit, total)
+            if end < total:
+                # Everything tied with the page's last key is kept so ties are broken by id
+                cutoff = np.partition(key, end - 1)[end - 1]
+                candidates = np.flatnonzero(key <= cutoff)
+            else:
+                candidates = np.arange(total)
+            ordered = candidates[np.lexsort((ids[candidates], key[candidates]))][offset:end]
+            page = matches[ordered]
+            return total, [(self.rows[position], self.rating_sums[position] / self.rating_counts[position] if self.rating_counts[position] else None,
+                            int(self.rating_counts[position])) for position in page.tolist()]
+
+
+# The same ordering and paging over rows already filtered by facet, for servers without NumPy
+def query_rows(products, ratings, filters=None, sort='id', descending=False, limit=50, offset=0, min_price=None, max_price=None):
+    if sort not in SORTS:
+        raise ValueError(f"Unknown sort {sort}")
+    totals = {product_id: (rating_sum, rating_count) for product_id, rating_sum, rating_count in ratings}
+    rows = [row for row in products
+            if (min_price is None or (row[4] or 0) >= float(min_price)) and (max_price is None or (row[4] or 0) <= float(max_price))]
+    sign = -1 if descending else 1
+    keys = {
+        'id': lambda row: sign * row[0],
+        'price': lambda row: (sign * float(row[4] or 0), row[0]),
+        'rating_count': lambda row: (sign * totals.get(row[0], (0, 0))[1], row[0]),
+        'rating': lambda row: (rating_key(*totals.get(row[0], (0, 0)), descending), row[0])
+    }
+    rows.sort(key=keys[sort])
+    page = []
+    for row in rows[offset:offset + limit]:
+        rating_sum, rating_count = totals.get(row[0], (0, 0))
+        page.append((row, rating_sum / rating_count if rating_count else None, rating_count))
+    return len(rows), page
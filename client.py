@@ -2,12 +2,230 @@ import socket
 import json
 import hashlib
 import threading
-import requests
+import urllib.parse
+from collections import OrderedDict
+import currency
+import compression
+import wire_format
+import image_store
+
+# Serialize one request; the body (if any) is sent as JSON, or as-is when already bytes, with its byte length
+def build_request(method, path, host, body=None, extra_headers=None):
+    content_type = 'application/octet-stream' if isinstance(body, bytes) else 'application/json'
+    headers = (f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: {content_type}\r\n"
+               f"Accept-Encoding: {compression.accept_encoding_header()}\r\n")
+    for name, value in (extra_headers or {}).items():
+        headers += f"{name}: {value}\r\n"
+    if body:
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        headers += f"Content-Length: {len(body)}\r\n\r\n"
+    else:
+        body = b''
+        headers += "\r\n"
+    return headers.encode('utf-8') + body
+
+
+# Returns (status code, lower-cased header dict)
+def parse_headers(head):
+    lines = head.decode('utf-8').split('\r\n')
+    status_parts = lines[0].split(' ', 2)
+    status = int(status_parts[1]) if len(status_parts) > 1 and status_parts[1].isdigit() else 200
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, headers
+
+
+MAX_PEER_MESSAGE_BYTES = 64 * 1024
+
+
+def facet_params(category=None, price=None, in_stock=None):
+    params = {}
+    if category:
+        params["category"] = category
+    if price:
+        params["price"] = price
+    if in_stock is not None:
+        params["in_stock"] = "true" if in_stock else "false"
+    return params
+
+
+# Load-shedding answers (429 rate limited, 503 overloaded) as an error dict carrying the
+# server's Retry-After hint in seconds; None for any other response
+def rejection(status, headers, body):
+    if status not in (429, 503):
+        return None
+    try:
+        message = json.loads(body).get("message")
+    except ValueError:
+        message = None
+    return {"error": message or "Server busy", "retry_after": int(headers.get('retry-after', 1))}
+
+
+# The connection was closed or reset before any byte of the response arrived
+class NoResponse(ConnectionError):
+    pass
+
+
+# Read the status line and headers, then exactly Content-Length bytes of body
+def read_response(s):
+    data = b''
+    while b'\r\n\r\n' not in data:
+        try:
+            chunk = s.recv(65536)
+        except ConnectionResetError as e:
+            if data:
+                raise
+            raise NoResponse("Connection reset by server") from e
+        if not chunk:
+            if not data:
+                raise NoResponse("Connection closed by server")
+            break
+        data += chunk
+    head, _, body = data.partition(b'\r\n\r\n')
+    status, headers = parse_headers(head)
+    length = int(headers.get('content-length', len(body)))
+    while len(body) < length:
+        chunk = s.recv(65536)
+        if not chunk:
+            break
+        body += chunk
+    return status, headers, compression.decode_body(headers, body[:length])
+
+
+def round_trip(conn, payload):
+    try:
+        conn.sendall(payload)
+    except (BrokenPipeError, ConnectionResetError) as e:
+        raise NoResponse(str(e)) from e
+    return read_response(conn)
+
+
+# Thread-safe pool of keep-alive connections to server.py, shared by many AUBoutique instances
+class ConnectionPool:
+    def __init__(self, host='localhost', port=8080, max_idle=16, timeout=30):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+        return socket.create_connection((self.host, self.port), timeout=self.timeout), False
+
+    def release(self, conn):
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    # A reused connection the server dropped while idle fails with a broken pipe or reset on send,
+    # or closes before any response byte; only then is the request sent again, on a fresh connection.
+    # After a timeout or a partial response the server may already have run it (a purchase, a
+    # rating), so those errors go to the caller.
+    def request(self, payload):
+        conn, reused = self.acquire()
+        try:
+            response = round_trip(conn, payload)
+        except NoResponse:
+            conn.close()
+            if not reused:
+                raise
+            conn = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            try:
+                response = round_trip(conn, payload)
+            except BaseException:
+                conn.close()
+                raise
+        except BaseException:
+            conn.close()
+            raise
+        self.release(conn)
+        return response
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+# Pools to read replicas from a "host:port,host:port" list (e.g. AUBOUTIQUE_REPLICAS)
+def replica_pools(spec, timeout=30):
+    pools = []
+    for address in filter(None, (spec or '').split(',')):
+        host, _, port = address.strip().rpartition(':')
+        pools.append(ConnectionPool(host or 'localhost', int(port), timeout=timeout))
+    return pools
+
+
+# Local copy of the catalogue kept current by applying /product_changes deltas
+class CatalogueReplica:
+    def __init__(self):
+        self.seq = 0
+        self.products = {}
+        self.snapshot = None
+
+    def apply(self, delta):
+        # The server could not continue from our position and is sending everything again
+        if delta.get("reset"):
+            self.products = {}
+            self.snapshot = None
+        for product in delta["changes"]:
+            self.products[product["id"]] = product
+        for product_id in delta["deleted"]:
+            self.products.pop(product_id, None)
+        if delta["changes"] or delta["deleted"]:
+            self.snapshot = None
+        self.seq = delta["seq"]
+
+    # Sorted product list; the same list object is returned until a delta changes something
+    def list(self):
+        if self.snapshot is None:
+            self.snapshot = [self.products[product_id] for product_id in sorted(self.products)]
+        return self.snapshot
+
 
 class AUBoutique:
-    def __init__(self, host='localhost', port=8080):
+    def __init__(self, host='localhost', port=8080, rates_cache=None, pool=None, result_format=None, image_cache=None,
+                 timeout=30, replicas=None, offline_cache=None):
         self.host = host
         self.port = port
+        self.pool = pool
+        self.timeout = timeout
+        # Read replica pools; read-only calls go to them round-robin. write_position is the primary's
+        # log position after this session's last write: a replica that has not applied it yet answers
+        # 409 and the read goes to the primary, so the session always sees its own writes.
+        # on_write_position(position), if set, is called when it advances (e.g. to keep it in a web session).
+        self.replicas = list(replicas or [])
+        self.next_replica = 0
+        self.write_position = 0
+        self.on_write_position = None
+        # None for the default list of product dicts; 'columnar' or 'binary' for the compact
+        # encodings, which decode to a wire_format.ProductRows sequence
+        self.result_format = result_format
+        # Last ETag-validated response per catalogue query
+        self.validated = OrderedDict()
+        self.max_validated = 32
+        self.replica = CatalogueReplica()
+        self.sync_lock = threading.Lock()
+        # Optional offline_cache.OfflineCache: the replica, validated responses and rates persist across
+        # runs, cached_products() returns the last catalogue without the network, and catalogue reads
+        # fall back to the stored response when the server cannot be reached
+        self.offline_cache = offline_cache
+        self.offline_loaded = False
+        self.rates_cache = rates_cache or (currency.RatesCache(store=offline_cache) if offline_cache
+                                           else currency.RatesCache(snapshot_path='rates_snapshot.json'))
+        self.image_cache = image_cache or image_store.ImageCache()
+        # Sent as X-Session-Id so the server rate-limits each session separately behind a shared frontend
+        self.session_id = None
         self.user_id = None
         self.username = None
         self.client_port = None
@@ -22,12 +240,24 @@ class AUBoutique:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.bind(('0.0.0.0', self.client_port))
             s.listen()
+            # accept() wakes up every second so stop_listening() can end the loop
+            s.settimeout(1.0)
             while self.messaging_active:
-                conn, _ = s.accept()
+                try:
+                    conn, _ = s.accept()
+                except socket.timeout:
+                    continue
                 with conn:
                     try:
-                        data = conn.recv(1024).decode('utf-8')
-                        message_data = json.loads(data)
+                        # The sender closes after one message; a peer that stalls is dropped after `timeout`
+                        conn.settimeout(self.timeout)
+                        data = b''
+                        while len(data) < MAX_PEER_MESSAGE_BYTES:
+                            chunk = conn.recv(65536)
+                            if not chunk:
+                                break
+                            data += chunk
+                        message_data = json.loads(data.decode('utf-8'))
                         # Call the ChatPage method to update the UI
                         chat_page.display_received_message(
                             message_data['from_username'],
@@ -48,24 +278,101 @@ class AUBoutique:
         if self.listener_thread:
             self.listener_thread.join()
 
-    def send_request(self, method, path, body=None):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((self.host, self.port))
-            headers = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
-            if body:
-                body = json.dumps(body)
-                headers += f"Content-Length: {len(body)}\r\n\r\n{body}"
-            else:
-                headers += "\r\n"
-            
-            s.sendall(headers.encode('utf-8'))
-            response = s.recv(4096).decode('utf-8')
-            parts = response.split('\r\n\r\n', 1)
-            json_part = parts[1] if len(parts) > 1 else parts[0]
-            try:
-                return json.loads(json_part)
-            except json.JSONDecodeError:
-                return {"error": "Failed to decode JSON from server response"}
+    def send_request(self, method, path, body=None, read_only=False):
+        status, headers, json_part = self.exchange(method, path, body, read_only=read_only)
+        rejected = rejection(status, headers, json_part)
+        if rejected:
+            return rejected
+        try:
+            return json.loads(json_part)
+        except json.JSONDecodeError:
+            return {"error": "Failed to decode JSON from server response"}
+
+    # Catalogue reads revalidate the last response with If-None-Match; on 304 the
+    # previously returned object itself is handed back, so callers can skip re-rendering
+    def send_conditional_request(self, method, path, body=None, read_only=False):
+        key = (method, path, json.dumps(body, sort_keys=True))
+        cached = self.validated.get(key)
+        if cached is None and self.offline_cache:
+            cached = self.stored_response(key)
+        extra_headers = {"If-None-Match": cached[0]} if cached else None
+        try:
+            status, headers, json_part = self.exchange(method, path, body, extra_headers, read_only)
+        except OSError:
+            if cached and self.offline_cache:
+                return cached[1]
+            raise
+        if status == 304 and cached:
+            self.validated.move_to_end(key)
+            return cached[1]
+        rejected = rejection(status, headers, json_part)
+        if rejected:
+            return rejected
+        try:
+            response = wire_format.decode(headers.get('content-type'), json_part)
+        except ValueError:
+            return {"error": "Failed to decode server response"}
+        if 'etag' in headers:
+            self.validated[key] = (headers['etag'], response)
+            self.validated.move_to_end(key)
+            while len(self.validated) > self.max_validated:
+                self.validated.popitem(last=False)
+            if self.offline_cache:
+                self.offline_cache.put_response(json.dumps([self.source()] + list(key)), headers['etag'],
+                                                headers.get('content-type'), json_part)
+        return response
+
+    # Server identity for the offline cache, which may hold data from several servers
+    def source(self):
+        return f"{self.host}:{self.port}"
+
+    def stored_response(self, key):
+        stored = self.offline_cache.get_response(json.dumps([self.source()] + list(key)))
+        if not stored:
+            return None
+        etag, content_type, body = stored
+        try:
+            cached = (etag, wire_format.decode(content_type, body))
+        except ValueError:
+            return None
+        self.validated[key] = cached
+        return cached
+
+    # Send one request and return (status, response headers, raw body)
+    def exchange(self, method, path, body=None, extra_headers=None, read_only=False):
+        if self.session_id:
+            extra_headers = dict(extra_headers or {}, **{"X-Session-Id": self.session_id})
+        if read_only and self.replicas:
+            response = self.replica_exchange(method, path, body, extra_headers)
+            if response:
+                return response
+        payload = build_request(method, path, self.host, body, extra_headers)
+        if self.pool is not None:
+            response = self.pool.request(payload)
+        else:
+            with socket.create_connection((self.host, self.port), timeout=self.timeout) as s:
+                s.sendall(payload)
+                response = read_response(s)
+        self.track_position(response[1])
+        return response
+
+    # A read on the next replica, or None when it is unreachable or behind this session's writes
+    def replica_exchange(self, method, path, body, extra_headers):
+        pool = self.replicas[self.next_replica % len(self.replicas)]
+        self.next_replica += 1
+        extra_headers = dict(extra_headers or {}, **{"X-Min-Position": self.write_position})
+        try:
+            response = pool.request(build_request(method, path, pool.host, body, extra_headers))
+        except OSError:
+            return None
+        return None if response[0] in (409, 503) else response
+
+    def track_position(self, headers):
+        position = int(headers.get('x-replication-position', 0))
+        if position > self.write_position:
+            self.write_position = position
+            if self.on_write_position:
+                self.on_write_position(position)
 
     def register_user(self, first_name, last_name, email, username, password):
         data = {
@@ -120,23 +427,109 @@ class AUBoutique:
         response = self.send_request('POST', '/add_product', data)
         return response
 
-    def list_products(self):
-        response = self.send_request('GET', '/products')
+    # Optional facet filters: category, price (a bucket label such as "10-25") and in_stock.
+    # Products come in id order; pass the last id seen as `after` with a `limit` to page through them
+    def list_products(self, currency=None, category=None, price=None, in_stock=None, after=None, limit=None):
+        path = '/products'
+        params = facet_params(category, price, in_stock)
+        if currency:
+            params["currency"] = currency
+        if after is not None:
+            params["after"] = after
+        if limit is not None:
+            params["limit"] = limit
+        if self.result_format:
+            params["format"] = self.result_format
+        if params:
+            path += '?' + urllib.parse.urlencode(params)
+        response = self.send_conditional_request('GET', path, read_only=True)
         return response
 
+    # Bring the local replica up to date, transferring only products changed since the last sync.
+    # Rows carry "average_rating" and "rating_count" alongside the usual product fields.
+    def sync_products(self, batch_size=1000):
+        with self.sync_lock:
+            self.load_offline_catalogue()
+            while True:
+                since = self.replica.seq
+                delta = self.send_request('POST', '/product_changes', {"since": since, "limit": batch_size})
+                if "changes" not in delta:
+                    return {"error": delta.get("message", "Failed to sync products")}
+                self.replica.apply(delta)
+                if self.offline_cache:
+                    self.offline_cache.save_catalogue(self.source(), 0 if delta.get("reset") else since, delta["seq"],
+                                                      delta["changes"], delta["deleted"])
+                if not delta["more"]:
+                    return self.replica.list()
+
+    # The catalogue as last synced, possibly in an earlier run, without contacting the server
+    def cached_products(self):
+        with self.sync_lock:
+            self.load_offline_catalogue()
+            return self.replica.list()
+
+    def load_offline_catalogue(self):
+        if self.offline_cache and not self.offline_loaded:
+            self.replica.seq, self.replica.products = self.offline_cache.load_catalogue(self.source())
+            self.replica.snapshot = None
+            self.offline_loaded = True
+
+    # Upload image bytes to the server's image store; the returned "image" URL goes in add_product
+    def upload_image(self, data):
+        _, _, body = self.exchange('POST', '/upload_image', data)
+        try:
+            response = json.loads(body)
+        except json.JSONDecodeError:
+            return {"error": "Failed to decode JSON from server response"}
+        if "image" not in response:
+            return {"error": response.get("message", "Failed to upload image")}
+        return response
+
+    # The image if it is in the local cache, without contacting the server
+    def cached_image(self, url, size=None):
+        name = image_store.store_image_name(url)
+        return self.image_cache.get(image_store.ImageCache.key(name, size)) if name else None
+
+    # Bytes of a store image (size='thumb' for the thumbnail), read from the local disk cache when
+    # possible; None for images hosted elsewhere or missing on the server
+    def fetch_image(self, url, size=None):
+        name = image_store.store_image_name(url)
+        if name is None:
+            return None
+        key = image_store.ImageCache.key(name, size)
+        data = self.image_cache.get(key)
+        if data is None:
+            status, _, data = self.exchange('GET', f"/images/{name}" + (f"?size={size}" if size else ''))
+            if status != 200:
+                return None
+            self.image_cache.put(key, data)
+        return data
+
     def buy_product(self, product_id):
         data = {"buyer_id": self.user_id, "product_id": product_id}
         response = self.send_request('POST', '/buy_product', data)
         return response
 
-    def search_product(self, search_term):
+    def search_product(self, search_term, currency=None, after=None, limit=None):
         data = {"search_term": search_term}
-        response = self.send_request('POST', '/search_product', data)
+        if currency:
+            data["currency"] = currency
+        if after is not None:
+            data["after"] = after
+        if limit is not None:
+            data["limit"] = limit
+        if self.result_format:
+            data["format"] = self.result_format
+        response = self.send_conditional_request('POST', '/search_product', data, read_only=True)
         return response
 
-    def search_user_products(self, username):
+    def search_user_products(self, username, currency=None):
         data = {"username": username}
-        response = self.send_request('POST', '/search_user_products', data)
+        if currency:
+            data["currency"] = currency
+        if self.result_format:
+            data["format"] = self.result_format
+        response = self.send_conditional_request('POST', '/search_user_products', data, read_only=True)
         return response
 
     def rate_product(self, product_id, rating):
@@ -144,9 +537,49 @@ class AUBoutique:
         response = self.send_request('POST', '/rate_product', data)
         return response
 
+    # Sales and rating totals, active listings and daily buckets for a seller (default: the logged-in user)
+    def seller_dashboard(self, username=None, days=30):
+        data = {"username": username or self.username, "days": days}
+        response = self.send_request('POST', '/seller_dashboard', data, read_only=True)
+        return response
+
+    # One page of products under facet filters and a price range, sorted by id, price, rating or
+    # rating_count ("-" prefix for descending); returns {"total": matches, "products": [...]} with
+    # each product's "average_rating" and "rating_count"
+    def browse_products(self, category=None, price=None, in_stock=None, min_price=None, max_price=None, sort='id',
+                        limit=50, offset=0, currency=None):
+        params = dict(facet_params(category, price, in_stock), sort=sort, limit=limit, offset=offset)
+        if min_price is not None:
+            params["min_price"] = min_price
+        if max_price is not None:
+            params["max_price"] = max_price
+        if currency:
+            params["currency"] = currency
+        response = self.send_conditional_request('GET', '/browse?' + urllib.parse.urlencode(params), read_only=True)
+        return response
+
+    # Product counts per category, price bucket and stock state under the given filters
+    def facets(self, category=None, price=None, in_stock=None):
+        response = self.send_request('GET', '/facets?' + urllib.parse.urlencode(facet_params(category, price, in_stock)), read_only=True)
+        return response
+
+    # Top products overall or in one category; board is top_rated, most_rated or best_selling
+    def leaderboard(self, board='top_rated', category=None, limit=10):
+        params = {"board": board, "limit": limit}
+        if category:
+            params["category"] = category
+        response = self.send_request('GET', '/leaderboard?' + urllib.parse.urlencode(params), read_only=True)
+        return response
+
+    # Products rated alike by the same users, best first: {"similar": [{"id": ..., "score": ...}], "ready": ...}
+    def similar_products(self, product_id, limit=10):
+        data = {"product_id": product_id, "limit": limit}
+        response = self.send_request('POST', '/similar_products', data, read_only=True)
+        return response
+
     def view_average_rating(self, product_id):
         data = {"product_id": product_id}
-        response = self.send_request('POST', '/get_average_rating', data)
+        response = self.send_request('POST', '/get_average_rating', data, read_only=True)
         return response
 
     def get_connection_info(self, username):
@@ -159,24 +592,31 @@ class AUBoutique:
     def p2p_chat(self, receiver_username, message):
         ip, port = self.get_connection_info(receiver_username)
         if ip and port:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                try:
-                    s.connect((ip, port))
+            try:
+                with socket.create_connection((ip, port), timeout=self.timeout) as s:
                     s.sendall(json.dumps({
                         "from_username": self.username,
                         "message": message
                     }).encode('utf-8'))
-                    return {"message": "Message sent successfully"}
-                except Exception as e:
-                    return {"error": f"Failed to send message: {e}"}
+                return {"message": "Message sent successfully"}
+            except Exception as e:
+                return {"error": f"Failed to send message: {e}"}
         return {"error": "Could not retrieve user connection info"}
 
+    # Messages exchanged with another user, newest first; pass the oldest timestamp as `before` for older pages
+    def conversation_history(self, with_username, limit=50, before=None):
+        data = {"user_id": self.user_id, "with_username": with_username, "limit": limit}
+        if before:
+            data["before"] = before
+        response = self.send_request('POST', '/conversation', data)
+        return response
+
+    # Last known rates without contacting the provider; None if there are none
+    def cached_currency_rates(self, base_currency):
+        return self.rates_cache.cached(base_currency)
+
     def get_currency_rates(self, base_currency):
         try:
-            url = f"https://api.exchangerate-api.com/v4/latest/{base_currency}"
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-            return data.get('rates', {})
-        except requests.exceptions.RequestException as e:
+            return self.rates_cache.get_rates(base_currency)
+        except currency.RatesUnavailable as e:
             return {"error": str(e)}
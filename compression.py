@@ -0,0 +1,84 @@
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies smaller than this are sent as-is; compressing them costs more than it saves
+MIN_COMPRESS_BYTES = int(os.environ.get('AUBOUTIQUE_COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('AUBOUTIQUE_GZIP_LEVEL', 6))
+ZSTD_LEVEL = int(os.environ.get('AUBOUTIQUE_ZSTD_LEVEL', 3))
+
+
+def supported_encodings():
+    return ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+
+
+# Value for the client's Accept-Encoding header
+def accept_encoding_header():
+    return ', '.join(supported_encodings())
+
+
+def choose_encoding(accept_encoding):
+    """Pick the best encoding we support from an Accept-Encoding header, or None."""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        token, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if token:
+            accepted[token.strip().lower()] = quality
+    for encoding in supported_encodings():
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compressor(encoding):
+    if encoding == 'gzip':
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise ValueError(f"Unsupported encoding {encoding}")
+
+
+def decompressor(encoding):
+    if encoding == 'gzip':
+        return zlib.decompressobj(31)
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Unsupported encoding {encoding}")
+
+
+# Compress an iterable of byte chunks incrementally, so bodies can be streamed
+def iter_compress(chunks, encoding):
+    compress_obj = compressor(encoding)
+    for chunk in chunks:
+        data = compress_obj.compress(chunk)
+        if data:
+            yield data
+    yield compress_obj.flush()
+
+
+def compress(body, encoding):
+    return b''.join(iter_compress([body], encoding))
+
+
+def decompress(body, encoding):
+    decompress_obj = decompressor(encoding)
+    return decompress_obj.decompress(body) + decompress_obj.flush()
+
+
+# Undo the Content-Encoding of a response body
+def decode_body(headers, body):
+    encoding = headers.get('content-encoding')
+    if not encoding or encoding == 'identity' or not body:
+        return body
+    return decompress(body, encoding)
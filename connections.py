@@ -0,0 +1,86 @@
+import socket
+import threading
+from collections import defaultdict
+
+# Every open client connection is registered here so the server can cap how many it holds,
+# reap idle or stalled ones through socket deadlines, and drain them on shutdown.
+
+
+# Raised when a connection misses a deadline; `reason` names the counter it is reaped under
+class Reaped(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class ConnectionManager:
+    def __init__(self, max_connections=1024, max_per_ip=256):
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.connections = {}
+        self.per_ip = defaultdict(int)
+        self.draining = False
+        self.condition = threading.Condition()
+        self.counters = defaultdict(int)
+
+    # Track a newly accepted connection; False when a cap is reached and it should be refused
+    def register(self, conn, addr):
+        ip = addr[0]
+        with self.condition:
+            if self.draining:
+                self.counters['rejected_draining'] += 1
+                return False
+            if len(self.connections) >= self.max_connections:
+                self.counters['rejected_global'] += 1
+                return False
+            if self.per_ip[ip] >= self.max_per_ip:
+                self.counters['rejected_per_ip'] += 1
+                return False
+            self.connections[conn] = [ip, 'idle']
+            self.per_ip[ip] += 1
+            self.counters['accepted'] += 1
+            return True
+
+    def unregister(self, conn, reason='closed'):
+        with self.condition:
+            entry = self.connections.pop(conn, None)
+            if entry is None:
+                return
+            self.per_ip[entry[0]] -= 1
+            if not self.per_ip[entry[0]]:
+                del self.per_ip[entry[0]]
+            self.counters[reason] += 1
+            self.condition.notify_all()
+
+    # 'idle' while waiting for the next request on a keep-alive connection, 'busy' while serving one
+    def mark(self, conn, state):
+        with self.condition:
+            if conn in self.connections:
+                self.connections[conn][1] = state
+
+    @staticmethod
+    def shutdown(conn, how):
+        try:
+            conn.shutdown(how)
+        except OSError:
+            pass
+
+    def drain(self, timeout=5.0):
+        """Stop admitting connections, close idle ones, and give busy ones `timeout` seconds to finish."""
+        with self.condition:
+            self.draining = True
+            for conn, (_, state) in list(self.connections.items()):
+                if state == 'idle':
+                    # Wakes the handler's blocked recv() with EOF
+                    self.shutdown(conn, socket.SHUT_RD)
+            finished = self.condition.wait_for(lambda: not self.connections, timeout)
+            if not finished:
+                self.counters['drain_forced'] += len(self.connections)
+                for conn in list(self.connections):
+                    self.shutdown(conn, socket.SHUT_RDWR)
+            return finished
+
+    def stats(self):
+        with self.condition:
+            return dict(self.counters, open=len(self.connections), draining=self.draining,
+                        idle=sum(1 for _, state in self.connections.values() if state == 'idle'))
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import threading
+
+RATES_TTL = float(os.environ.get('AUBOUTIQUE_RATES_TTL', 3600))
+
+# Fixed USD-based table used by the stub provider (offline development and benchmarks)
+STUB_USD_RATES = {
+    "USD": 1.0,
+    "EUR": 0.92,
+    "GBP": 0.79,
+    "LBP": 89500.0,
+    "AED": 3.6725,
+    "SAR": 3.75,
+    "CAD": 1.36,
+    "JPY": 150.0,
+    "CHF": 0.88,
+    "TRY": 32.5
+}
+
+
+class RatesUnavailable(Exception):
+    pass
+
+
+class ExchangeRateAPIProvider:
+    URL = "https://api.exchangerate-api.com/v4/latest/{base}"
+
+    def __init__(self, timeout=5):
+        self.timeout = timeout
+
+    def fetch(self, base_currency):
+        import requests
+        try:
+            response = requests.get(self.URL.format(base=base_currency), timeout=self.timeout)
+            response.raise_for_status()
+            return response.json().get('rates', {})
+        except requests.exceptions.RequestException as e:
+            raise RatesUnavailable(str(e))
+
+
+class StubRatesProvider:
+    def __init__(self, usd_rates=None):
+        self.usd_rates = usd_rates or STUB_USD_RATES
+
+    def fetch(self, base_currency):
+        if base_currency not in self.usd_rates:
+            raise RatesUnavailable(f"Unknown currency {base_currency}")
+        base = self.usd_rates[base_currency]
+        return {currency: rate / base for currency, rate in self.usd_rates.items()}
+
+
+def default_provider():
+    if os.environ.get('AUBOUTIQUE_RATES_PROVIDER') == 'stub':
+        return StubRatesProvider()
+    return ExchangeRateAPIProvider()
+
+
+# A provider fetch in progress; callers with no rates to fall back on wait for its outcome
+class PendingFetch:
+    def __init__(self):
+        self.done = threading.Event()
+        self.rates = None
+        self.error = None
+
+
+# Rates cached in memory for `ttl` seconds and snapshotted to disk (a JSON file, or a `store` with
+# load_rates/save_rates such as the client's offline cache); a stale snapshot is served when the
+# provider cannot be reached.
+class RatesCache:
+    def __init__(self, provider=None, ttl=RATES_TTL, snapshot_path=None, store=None):
+        self.provider = provider or default_provider()
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.store = store
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.fetching = {}
+        # The snapshot is read on first use, so constructing a cache (and a client) does no I/O
+        self.loaded = False
+
+    def ensure_loaded(self):
+        if self.loaded:
+            return
+        with self.lock:
+            if not self.loaded:
+                self.load_snapshot()
+                self.loaded = True
+
+    def load_snapshot(self):
+        if self.store is not None:
+            self.entries = self.store.load_rates()
+            return
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                self.entries = {base: (entry['fetched_at'], entry['rates']) for base, entry in json.load(f).items()}
+        except (OSError, ValueError, KeyError):
+            self.entries = {}
+
+    def save_snapshot(self):
+        if self.store is not None:
+            self.store.save_rates(self.entries)
+            return
+        if not self.snapshot_path:
+            return
+        snapshot = {base: {"fetched_at": fetched_at, "rates": rates} for base, (fetched_at, rates) in self.entries.items()}
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    # Last known rates however old, without contacting the provider; None if there are none
+    def cached(self, base_currency='USD'):
+        self.ensure_loaded()
+        entry = self.entries.get(base_currency)
+        return entry[1] if entry else None
+
+    # When the rates for `base_currency` were fetched (a snapshot keeps the original time); None if never
+    def fetched_at(self, base_currency='USD'):
+        self.ensure_loaded()
+        entry = self.entries.get(base_currency)
+        return entry[0] if entry else None
+
+    # The provider is called outside the lock, one fetch per base currency at a time. While expired
+    # rates are being refreshed, other callers get the expired rates at once; only when there are
+    # no rates at all do they wait for the fetch in progress.
+    def get_rates(self, base_currency='USD'):
+        entry = self.entries.get(base_currency)
+        if entry and time.time() - entry[0] < self.ttl:
+            return entry[1]
+        if not self.loaded:
+            self.ensure_loaded()
+            return self.get_rates(base_currency)
+        with self.lock:
+            fetch = self.fetching.get(base_currency)
+            leader = fetch is None
+            if leader:
+                fetch = self.fetching[base_currency] = PendingFetch()
+        if leader:
+            try:
+                return self.refresh(base_currency, fetch)
+            except RatesUnavailable:
+                if entry:
+                    return entry[1]
+                raise
+        if entry:
+            return entry[1]
+        fetch.done.wait()
+        if fetch.error is not None:
+            raise fetch.error
+        return fetch.rates
+
+    def refresh(self, base_currency, fetch):
+        try:
+            fetch.rates = self.provider.fetch(base_currency)
+            with self.lock:
+                self.entries[base_currency] = (time.time(), fetch.rates)
+                try:
+                    self.save_snapshot()
+                except OSError as e:
+                    print(f"Failed to write rates snapshot: {e}")
+            return fetch.rates
+        except Exception as e:
+            fetch.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.fetching[base_currency]
+            fetch.done.set()
+
+    def get_rate(self, from_currency, to_currency):
+        if from_currency == to_currency:
+            return 1.0
+        rates = self.get_rates(from_currency)
+        if to_currency not in rates:
+            raise RatesUnavailable(f"Unknown currency {to_currency}")
+        return rates[to_currency]
+
+
+# Convert a whole column of prices at once. NumPy is imported on first use so that
+# importing the client (and starting the GUI) does not pay for it.
+# A product without a price keeps None, which NumPy would otherwise turn into NaN (invalid JSON).
+def convert_prices(prices, rate):
+    try:
+        import numpy as np
+    except ImportError:
+        return [round(price * rate, 2) if price is not None else None for price in prices]
+    column = np.asarray(prices, dtype=np.float64)
+    converted = np.round(column * rate, 2).tolist()
+    missing = np.isnan(column)
+    if missing.any():
+        converted = [None if unpriced else price for price, unpriced in zip(converted, missing.tolist())]
+    return converted
@@ -0,0 +1,88 @@
+import bisect
+import threading
+from collections import Counter
+
+# Facet counts for catalogue navigation. Products are counted per (category, price bucket, in stock)
+# cell. The number of cells depends on how many categories exist, not on how many products, so
+# answering a facet query costs the same at any catalogue size. add_product and buy_product
+# keep the cells current.
+DIMENSIONS = ('category', 'price', 'in_stock')
+PRICE_EDGES = [10, 25, 50, 100, 250, 500]
+PRICE_BUCKETS = [f"{low}-{high}" for low, high in zip([0] + PRICE_EDGES, PRICE_EDGES)] + [f"{PRICE_EDGES[-1]}+"]
+
+
+def price_bucket(price):
+    return PRICE_BUCKETS[bisect.bisect_right(PRICE_EDGES, float(price or 0))]
+
+
+# Lower/upper price bounds of a bucket label, for filtering product queries (upper is None for the last)
+def price_range(bucket):
+    index = PRICE_BUCKETS.index(bucket)
+    bounds = [0] + PRICE_EDGES + [None]
+    return bounds[index], bounds[index + 1]
+
+
+# Facet filters from query parameters; unknown values raise ValueError
+def parse_filters(params):
+    filters = {}
+    if params.get('category'):
+        filters['category'] = params['category']
+    if params.get('price'):
+        if params['price'] not in PRICE_BUCKETS:
+            raise ValueError(f"Unknown price bucket {params['price']}")
+        filters['price'] = params['price']
+    if params.get('in_stock'):
+        filters['in_stock'] = params['in_stock'].lower() in ('1', 'true', 'yes')
+    return filters
+
+
+class FacetCounts:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cells = Counter()
+        self.products = {}
+
+    def rebuild(self, rows):
+        """Load from (id, category, price, in stock) rows."""
+        cells, products = Counter(), {}
+        for product_id, category, price, in_stock in rows:
+            key = (category, price_bucket(price), bool(in_stock))
+            products[product_id] = key
+            cells[key] += 1
+        with self.lock:
+            self.cells, self.products = cells, products
+
+    def add(self, product_id, category, price, in_stock):
+        key = (category, price_bucket(price), bool(in_stock))
+        with self.lock:
+            self.products[product_id] = key
+            self.cells[key] += 1
+
+    def set_in_stock(self, product_id, in_stock):
+        with self.lock:
+            key = self.products.get(product_id)
+            if key is None or key[2] == bool(in_stock):
+                return
+            self.cells[key] -= 1
+            if not self.cells[key]:
+                del self.cells[key]
+            key = key[:2] + (bool(in_stock),)
+            self.products[product_id] = key
+            self.cells[key] += 1
+
+    def counts(self, filters):
+        """(matching products, per-dimension counts). A dimension's counts apply every filter except
+        its own, so each value shows how many products selecting it instead would give."""
+        with self.lock:
+            cells = list(self.cells.items())
+        total = 0
+        facets = {dimension: Counter() for dimension in DIMENSIONS}
+        for key, count in cells:
+            mismatched = [i for i, dimension in enumerate(DIMENSIONS) if dimension in filters and key[i] != filters[dimension]]
+            if not mismatched:
+                total += count
+                for i, dimension in enumerate(DIMENSIONS):
+                    facets[dimension][key[i]] += count
+            elif len(mismatched) == 1:
+                facets[DIMENSIONS[mismatched[0]]][key[mismatched[0]]] += count
+        return total, {dimension: dict(values) for dimension, values in facets.items()}
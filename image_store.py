@@ -0,0 +1,172 @@
+import io
+import os
+import re
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Product images are stored content-addressed: the file name is the SHA-256 of the bytes,
+# so identical uploads share one file and a URL never changes meaning. That makes every
+# image response cacheable forever.
+IMAGE_ROOT = os.environ.get('AUBOUTIQUE_IMAGE_ROOT', 'images')
+MAX_IMAGE_BYTES = int(os.environ.get('AUBOUTIQUE_MAX_IMAGE_BYTES', 5 * 1024 * 1024))
+THUMBNAIL_SIZE = (256, 256)
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+CONTENT_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'gif': 'image/gif', 'webp': 'image/webp'}
+NAME_PATTERN = re.compile(r'^[0-9a-f]{64}\.(png|jpg|gif|webp)$')
+
+# A response whose body is sent straight from a file with socket.sendfile
+FileResponse = namedtuple('FileResponse', ['head', 'path'])
+
+
+class UnsupportedImage(ValueError):
+    pass
+
+
+# Image type from its magic bytes; uploads are never trusted by name or header
+def sniff(data):
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if data.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def write_atomic(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def thumbnail(data):
+    """Downscaled copy of an image in its own format, or None without Pillow."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image_format = image.format
+            image.thumbnail(THUMBNAIL_SIZE)
+            buffer = io.BytesIO()
+            image.save(buffer, format=image_format)
+            return buffer.getvalue()
+    except Exception:
+        return None
+
+
+class ImageStore:
+    def __init__(self, root=IMAGE_ROOT):
+        self.root = root
+
+    def path(self, name, size=None):
+        digest, _, ext = name.partition('.')
+        suffix = '.thumb' if size == 'thumb' else ''
+        return os.path.join(self.root, digest[:2], f"{digest}{suffix}.{ext}")
+
+    # Store an upload and return its content-addressed name; thumbnails are generated once, on first upload
+    def put(self, data):
+        ext = sniff(data)
+        if ext is None:
+            raise UnsupportedImage("Unsupported image type")
+        name = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+        path = self.path(name)
+        if not os.path.exists(path):
+            small = thumbnail(data)
+            if small is not None:
+                write_atomic(self.path(name, 'thumb'), small)
+            write_atomic(path, data)
+        return name
+
+    # (path, content type) for a stored image, or None; falls back to the original when no thumbnail exists
+    def locate(self, name, size=None):
+        if not NAME_PATTERN.match(name):
+            return None
+        content_type = CONTENT_TYPES[name.rsplit('.', 1)[1]]
+        if size == 'thumb' and os.path.exists(self.path(name, 'thumb')):
+            return self.path(name, 'thumb'), content_type
+        if os.path.exists(self.path(name)):
+            return self.path(name), content_type
+        return None
+
+
+# Content-addressed name from a store URL such as /images/<sha256>.png?size=thumb, or None
+def store_image_name(url):
+    if not url or not url.startswith('/images/'):
+        return None
+    name = url[len('/images/'):].split('?', 1)[0]
+    return name if NAME_PATTERN.match(name) else None
+
+
+# Client-side disk LRU of fetched images. Store URLs are immutable, so a hit is always
+# fresh and never revalidated. Recency is kept in file mtimes so it survives restarts.
+class ImageCache:
+    def __init__(self, root='image_cache', max_bytes=64 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries = None
+        self.total = 0
+        self.lock = threading.Lock()
+
+    # The directory is only scanned on first use, keeping client construction cheap
+    def load(self):
+        if self.entries is not None:
+            return
+        self.entries = OrderedDict()
+        os.makedirs(self.root, exist_ok=True)
+        files = [entry for entry in os.scandir(self.root) if entry.is_file() and not entry.name.startswith('.')]
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            self.entries[entry.name] = entry.stat().st_size
+            self.total += entry.stat().st_size
+
+    @staticmethod
+    def key(name, size=None):
+        return f"{size}-{name}" if size else name
+
+    def get(self, key):
+        with self.lock:
+            self.load()
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        path = os.path.join(self.root, key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            with self.lock:
+                self.total -= self.entries.pop(key, 0)
+            return None
+
+    def put(self, key, data):
+        with self.lock:
+            self.load()
+        write_atomic(os.path.join(self.root, key), data)
+        with self.lock:
+            self.total += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                evicted, size = self.entries.popitem(last=False)
+                self.total -= size
+                try:
+                    os.remove(os.path.join(self.root, evicted))
+                except OSError:
+                    pass
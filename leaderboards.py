@@ -0,0 +1,104 @@
+import bisect
+import threading
+from collections import defaultdict
+
+# In-memory "top products" boards, overall and per category, kept current by rate_product,
+# buy_product and add_product so a board is read without querying SQLite:
+#   top_rated     average rating, among products with at least `min_ratings` ratings
+#   most_rated    number of ratings
+#   best_selling  units sold
+BOARDS = ('top_rated', 'most_rated', 'best_selling')
+MIN_RATINGS = 3
+
+
+# Products ordered by descending score (ties by id); updates are O(log n) searches into a flat list
+class SortedScores:
+    def __init__(self):
+        self.keys = []
+        self.scores = {}
+
+    def discard(self, product_id):
+        score = self.scores.pop(product_id, None)
+        if score is not None:
+            del self.keys[bisect.bisect_left(self.keys, (-score, product_id))]
+
+    def set(self, product_id, score):
+        if self.scores.get(product_id) == score:
+            return
+        self.discard(product_id)
+        self.scores[product_id] = score
+        bisect.insort(self.keys, (-score, product_id))
+
+    def top(self, limit):
+        return [(product_id, -negative) for negative, product_id in self.keys[:limit]]
+
+
+class Leaderboards:
+    def __init__(self, min_ratings=MIN_RATINGS):
+        self.min_ratings = min_ratings
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.products = {}
+        self.rating_sums = defaultdict(int)
+        self.rating_counts = defaultdict(int)
+        self.units_sold = defaultdict(int)
+        # (board, category) -> SortedScores; category None is the board across all categories
+        self.boards = defaultdict(SortedScores)
+
+    def rebuild(self, products, ratings, sales):
+        """Load from (id, name, category), (product_id, rating sum, rating count) and (product_id, units) rows."""
+        with self.lock:
+            self.reset()
+            for product_id, name, category in products:
+                self.products[product_id] = (name, category)
+            for product_id, rating_sum, rating_count in ratings:
+                self.rating_sums[product_id] = rating_sum
+                self.rating_counts[product_id] = rating_count
+            for product_id, units in sales:
+                self.units_sold[product_id] = units
+            for product_id in set(self.rating_counts) | set(self.units_sold):
+                self.update(product_id)
+
+    def update(self, product_id):
+        category = self.products.get(product_id, (None, None))[1]
+        count = self.rating_counts[product_id]
+        scores = {
+            'top_rated': round(self.rating_sums[product_id] / count, 4) if count >= self.min_ratings else None,
+            'most_rated': count or None,
+            'best_selling': self.units_sold[product_id] or None
+        }
+        for board, score in scores.items():
+            for key in ((board, None), (board, category)) if category is not None else ((board, None),):
+                if score is None:
+                    self.boards[key].discard(product_id)
+                else:
+                    self.boards[key].set(product_id, score)
+
+    def add_product(self, product_id, name, category):
+        with self.lock:
+            self.products[product_id] = (name, category)
+
+    # `old_rating` is the user's previous rating of the product, or None for a first rating
+    def rate(self, product_id, old_rating, new_rating):
+        with self.lock:
+            if old_rating is None:
+                self.rating_counts[product_id] += 1
+            else:
+                self.rating_sums[product_id] -= old_rating
+            self.rating_sums[product_id] += new_rating
+            self.update(product_id)
+
+    def sell(self, product_id, units=1):
+        with self.lock:
+            self.units_sold[product_id] += units
+            self.update(product_id)
+
+    def top(self, board, category=None, limit=10):
+        if board not in BOARDS:
+            raise ValueError(f"Unknown board {board}")
+        with self.lock:
+            entries = self.boards[(board, category)].top(limit) if (board, category) in self.boards else []
+            return [{"id": product_id, "name": self.products.get(product_id, (None, None))[0], "score": score}
+                    for product_id, score in entries]
@@ -0,0 +1,167 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from collections import defaultdict
+
+# Chat messages live outside the catalogue database, in one SQLite file per calendar month
+# (messages/messages-YYYY-MM.db, UTC). Only the current month's partition takes writes, so chat
+# traffic never contends with catalogue writes, and every partition indexes messages by
+# conversation and time. Retention drops whole partitions (plus the expired part of the
+# oldest kept one). Months that are over are compacted once.
+MESSAGE_DIR = os.environ.get('AUBOUTIQUE_MESSAGE_DIR', 'messages')
+RETENTION_DAYS = int(os.environ.get('AUBOUTIQUE_MESSAGE_RETENTION_DAYS', 365))
+PARTITION_PATTERN = re.compile(r'^messages-(\d{4}-\d{2})\.db$')
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+COMPACTED = 1
+
+
+def conversation_key(user_a, user_b):
+    low, high = sorted((int(user_a), int(user_b)))
+    return f"{low}:{high}"
+
+
+# Millisecond resolution so paging with `before` doesn't skip messages sent in the same second;
+# second-resolution timestamps migrated from the catalogue database still sort correctly
+def utc_timestamp(seconds=None):
+    seconds = time.time() if seconds is None else seconds
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(seconds)) + f".{int(seconds * 1000) % 1000:03d}"
+
+
+class MessageStore:
+    def __init__(self, root=MESSAGE_DIR, retention_days=RETENTION_DAYS):
+        self.root = root
+        self.retention_days = retention_days
+        self.lock = threading.Lock()
+        self.initialized = set()
+        self.stopped = threading.Event()
+
+    def path(self, month):
+        return os.path.join(self.root, f"messages-{month}.db")
+
+    # Months with a partition file, newest first
+    def partitions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted((match.group(1) for match in map(PARTITION_PATTERN.match, os.listdir(self.root)) if match), reverse=True)
+
+    def connect(self, month):
+        path = self.path(month)
+        os.makedirs(self.root, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=10)
+        if path not in self.initialized:
+            with self.lock:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute('''CREATE TABLE IF NOT EXISTS messages (
+                                    id INTEGER PRIMARY KEY,
+                                    conversation TEXT,
+                                    sender_id INTEGER,
+                                    receiver_id INTEGER,
+                                    message TEXT,
+                                    timestamp TEXT
+                                )''')
+                conn.execute("CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation, timestamp)")
+                conn.commit()
+                self.initialized.add(path)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def append(self, sender_id, receiver_id, message, timestamp=None):
+        self.append_many([(sender_id, receiver_id, message, timestamp)])
+
+    # Append (sender_id, receiver_id, message, timestamp or None) rows, one transaction per partition
+    def append_many(self, rows):
+        by_month = defaultdict(list)
+        for sender_id, receiver_id, message, timestamp in rows:
+            timestamp = timestamp or utc_timestamp()
+            by_month[timestamp[:7]].append((conversation_key(sender_id, receiver_id), sender_id, receiver_id, message, timestamp))
+        for month, month_rows in by_month.items():
+            conn = self.connect(month)
+            try:
+                with conn:
+                    conn.executemany("INSERT INTO messages (conversation, sender_id, receiver_id, message, timestamp) VALUES (?, ?, ?, ?, ?)",
+                                     month_rows)
+            finally:
+                conn.close()
+
+    def history(self, user_a, user_b, before=None, after=None, limit=50):
+        """Messages between two users, newest first, with timestamps strictly between `after` and `before`."""
+        key = conversation_key(user_a, user_b)
+        messages = []
+        for month in self.partitions():
+            if before and month > before[:7]:
+                continue
+            if after and month < after[:7]:
+                break
+            conn = self.connect(month)
+            try:
+                rows = conn.execute('''SELECT sender_id, receiver_id, message, timestamp FROM messages
+                                       WHERE conversation = ? AND timestamp < COALESCE(?, '9999') AND timestamp > COALESCE(?, '')
+                                       ORDER BY timestamp DESC, id DESC LIMIT ?''',
+                                    (key, before, after, limit - len(messages))).fetchall()
+            finally:
+                conn.close()
+            messages.extend({"sender_id": sender_id, "receiver_id": receiver_id, "message": message, "timestamp": timestamp}
+                            for sender_id, receiver_id, message, timestamp in rows)
+            if len(messages) >= limit:
+                break
+        return messages
+
+    def drop(self, month):
+        path = self.path(month)
+        self.initialized.discard(path)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    # Closed months never change again: reclaim space, refresh planner statistics, drop the WAL
+    def compact(self, month):
+        conn = self.connect(month)
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("VACUUM")
+            conn.execute("ANALYZE")
+            conn.execute(f"PRAGMA user_version={COMPACTED}")
+        finally:
+            conn.close()
+
+    def maintain(self, now=None):
+        """Apply retention and compact finished months; returns what was done."""
+        now = time.time() if now is None else now
+        current = utc_timestamp(now)[:7]
+        cutoff = utc_timestamp(now - self.retention_days * 86400) if self.retention_days > 0 else None
+        summary = {"dropped": [], "expired": 0, "compacted": []}
+        with self.lock:
+            months = self.partitions()
+        for month in months:
+            if cutoff and month < cutoff[:7]:
+                self.drop(month)
+                summary["dropped"].append(month)
+                continue
+            conn = self.connect(month)
+            try:
+                expired = conn.execute("DELETE FROM messages WHERE timestamp < ?", (cutoff,)).rowcount if cutoff else 0
+                conn.commit()
+                compacted = conn.execute("PRAGMA user_version").fetchone()[0] == COMPACTED
+            finally:
+                conn.close()
+            summary["expired"] += expired
+            if month < current and (expired or not compacted):
+                self.compact(month)
+                summary["compacted"].append(month)
+        return summary
+
+    def start_maintenance(self, interval=3600):
+        def run():
+            while not self.stopped.is_set():
+                try:
+                    self.maintain()
+                except Exception as e:
+                    print(f"Error maintaining message store: {e}")
+                self.stopped.wait(interval)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stop_maintenance(self):
+        self.stopped.set()
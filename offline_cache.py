@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Client-side cache that survives restarts, in one SQLite file: the delta-synced catalogue (each
+# product with its rating aggregate) and its sync position per server, the last ETag-validated
+# response per catalogue query, and currency rates. The GUI renders what it holds at startup and
+# revalidates in the background. Cached responses and catalogues are evicted least recently used
+# first once the file's contents exceed max_bytes or there are more than max_responses responses;
+# an entry that alone exceeds the budget is not kept.
+CACHE_PATH = os.environ.get('AUBOUTIQUE_CLIENT_CACHE', 'client_cache.db')
+MAX_BYTES = int(os.environ.get('AUBOUTIQUE_CLIENT_CACHE_BYTES', 32 * 1024 * 1024))
+MAX_RESPONSES = 256
+
+
+# Positions are stored as JSON: a sharded server's position is a string of per-shard seqs ("3.0"),
+# which the column's integer affinity would otherwise turn into a number
+def sync_position(value):
+    return json.loads(str(value))
+
+
+class OfflineCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES, max_responses=MAX_RESPONSES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_responses = max_responses
+        self.lock = threading.Lock()
+        self.conn = None
+
+    # The file is opened on first use, keeping client construction cheap
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS catalogue (source TEXT, id INTEGER, data TEXT, PRIMARY KEY (source, id))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS sync_state (source TEXT PRIMARY KEY, seq INTEGER, used REAL DEFAULT 0)")
+            if 'used' not in [row[1] for row in self.conn.execute("PRAGMA table_info(sync_state)")]:
+                self.conn.execute("ALTER TABLE sync_state ADD COLUMN used REAL DEFAULT 0")
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                     key TEXT PRIMARY KEY,
+                                     etag TEXT,
+                                     content_type TEXT,
+                                     body BLOB,
+                                     size INTEGER,
+                                     used REAL
+                                 )''')
+            self.conn.execute("CREATE TABLE IF NOT EXISTS rates (base TEXT PRIMARY KEY, fetched_at REAL, rates TEXT)")
+            self.conn.commit()
+        return self.conn
+
+    # Catalogue
+
+    def load_catalogue(self, source):
+        """(sync position, {product id: product dict}) last saved for a server ("host:port")."""
+        with self.lock:
+            conn = self.connect()
+            row = conn.execute("SELECT seq FROM sync_state WHERE source = ?", (source,)).fetchone()
+            if not row:
+                return 0, {}
+            products = {product_id: json.loads(data)
+                        for product_id, data in conn.execute("SELECT id, data FROM catalogue WHERE source = ?", (source,))}
+            conn.execute("UPDATE sync_state SET used = ? WHERE source = ?", (time.time(), source))
+            conn.commit()
+            return sync_position(row[0]), products
+
+    def save_catalogue(self, source, since, seq, changes, deleted):
+        """Apply one /product_changes delta (changes after `since`, up to `seq`) to the stored catalogue.
+        A delta is only stored on top of the position it starts from: after the catalogue was evicted
+        nothing is kept until the client syncs again from 0."""
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                if since:
+                    row = conn.execute("SELECT seq FROM sync_state WHERE source = ?", (source,)).fetchone()
+                    if not row or sync_position(row[0]) != since:
+                        return
+                else:
+                    # A sync from 0 replaces whatever was stored for this server
+                    conn.execute("DELETE FROM catalogue WHERE source = ?", (source,))
+                conn.executemany("INSERT OR REPLACE INTO catalogue (source, id, data) VALUES (?, ?, ?)",
+                                 [(source, product["id"], json.dumps(product)) for product in changes])
+                conn.executemany("DELETE FROM catalogue WHERE source = ? AND id = ?", [(source, product_id) for product_id in deleted])
+                conn.execute("INSERT OR REPLACE INTO sync_state (source, seq, used) VALUES (?, ?, ?)", (source, json.dumps(seq), time.time()))
+            self.evict()
+
+    # Validated responses
+
+    def get_response(self, key):
+        """(etag, content type, body) stored for a request key, or None."""
+        with self.lock:
+            conn = self.connect()
+            row = conn.execute("SELECT etag, content_type, body FROM responses WHERE key = ?", (key,)).fetchone()
+            if row:
+                conn.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+            return row
+
+    def put_response(self, key, etag, content_type, body):
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO responses (key, etag, content_type, body, size, used) VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, etag, content_type, body, len(body), time.time()))
+            self.evict()
+
+    # Currency rates, in the form currency.RatesCache keeps them: {base: (fetched_at, rates)}
+
+    def load_rates(self):
+        with self.lock:
+            return {base: (fetched_at, json.loads(rates))
+                    for base, fetched_at, rates in self.connect().execute("SELECT base, fetched_at, rates FROM rates")}
+
+    def save_rates(self, entries):
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO rates (base, fetched_at, rates) VALUES (?, ?, ?)",
+                                 [(base, fetched_at, json.dumps(rates)) for base, (fetched_at, rates) in entries.items()])
+
+    # Size limits
+
+    def sizes(self, conn):
+        catalogue = conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0), COUNT(*) FROM catalogue").fetchone()
+        responses = conn.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM responses").fetchone()
+        rates = conn.execute("SELECT COALESCE(SUM(LENGTH(rates)), 0) FROM rates").fetchone()[0]
+        return catalogue, responses, rates
+
+    # Called with the lock held. Cached responses and each server's catalogue are evicted least recently
+    # used first until the file fits max_bytes and holds at most max_responses responses; anything
+    # that alone exceeds the budget goes first, so one oversized entry cannot flush all the others.
+    # A catalogue goes as a whole, since a partial one would be wrong after the next delta, and
+    # save_catalogue() stores nothing more for that server until a sync from 0 starts it again.
+    def evict(self):
+        conn = self.connect()
+        (catalogue_bytes, _), (response_bytes, responses), rate_bytes = self.sizes(conn)
+        excess_bytes = catalogue_bytes + response_bytes + rate_bytes - self.max_bytes
+        excess_count = responses - self.max_responses
+        if excess_bytes > 0 or excess_count > 0:
+            budget = self.max_bytes - rate_bytes
+            entries = [('catalogue', source, size, used) for source, size, used in conn.execute(
+                '''SELECT s.source, COALESCE(SUM(LENGTH(c.data)), 0), s.used
+                   FROM sync_state s LEFT JOIN catalogue c ON c.source = s.source GROUP BY s.source''')]
+            entries += [('response', key, size, used) for key, size, used in conn.execute("SELECT key, size, used FROM responses")]
+            entries.sort(key=lambda entry: (entry[2] <= budget, entry[3]))
+            for kind, key, size, _ in entries:
+                if size <= budget:
+                    if excess_bytes <= 0 and excess_count <= 0:
+                        break
+                    if excess_bytes <= 0 and kind == 'catalogue':
+                        # Only responses count towards max_responses
+                        continue
+                if kind == 'catalogue':
+                    conn.execute("DELETE FROM catalogue WHERE source = ?", (key,))
+                    conn.execute("DELETE FROM sync_state WHERE source = ?", (key,))
+                else:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    excess_count -= 1
+                excess_bytes -= size
+        conn.commit()
+
+    def stats(self):
+        with self.lock:
+            (catalogue_bytes, products), (response_bytes, responses), rate_bytes = self.sizes(self.connect())
+            return {"bytes": catalogue_bytes + response_bytes + rate_bytes, "max_bytes": self.max_bytes,
+                    "products": products, "responses": responses, "max_responses": self.max_responses}
+
+    def clear(self):
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                for table in ('catalogue', 'sync_state', 'responses', 'rates'):
+                    conn.execute(f"DELETE FROM {table}")
+            conn.execute("VACUUM")
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
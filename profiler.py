@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import itertools
+import threading
+from collections import Counter
+
+# Slow-query logging is opt-in: set AUBOUTIQUE_SLOW_QUERY_MS to a threshold in milliseconds
+SLOW_QUERY_THRESHOLD_MS = os.environ.get('AUBOUTIQUE_SLOW_QUERY_MS')
+SLOW_QUERY_THRESHOLD_MS = float(SLOW_QUERY_THRESHOLD_MS) if SLOW_QUERY_THRESHOLD_MS else None
+SLOW_QUERY_LOG = os.environ.get('AUBOUTIQUE_SLOW_QUERY_LOG', 'slow_queries.log')
+PROFILE_DIR = os.environ.get('AUBOUTIQUE_PROFILE_DIR', 'profiles')
+
+_slow_log_lock = threading.Lock()
+_profile_lock = threading.Lock()
+# Numbers profile files, so two started within the same millisecond get different names
+_profile_numbers = itertools.count(1)
+
+
+# Sampling profiler producing flamegraph-compatible collapsed stacks
+class StackSampler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+
+    @staticmethod
+    def frame_label(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def collapse(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(self.frame_label(frame))
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def take_sample(self, skip_ident):
+        for ident, frame in sys._current_frames().items():
+            if ident == skip_ident:
+                continue
+            self.samples[self.collapse(frame)] += 1
+        self.sample_count += 1
+
+    def run(self, duration):
+        me = threading.get_ident()
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            self.take_sample(me)
+            time.sleep(self.interval)
+
+    def write(self, output_path):
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def sample_to_file(duration, interval, output_path):
+    sampler = StackSampler(interval)
+    sampler.run(duration)
+    sampler.write(output_path)
+    print(f"Profile written to {output_path} ({sampler.sample_count} samples)")
+    return output_path
+
+
+def profile_to_file(duration, interval, output_path):
+    """Sample every thread for `duration` seconds and write collapsed stacks to `output_path`."""
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        return sample_to_file(duration, interval, output_path)
+    finally:
+        _profile_lock.release()
+
+
+def _sample_then_release(duration, interval, output_path):
+    try:
+        sample_to_file(duration, interval, output_path)
+    finally:
+        _profile_lock.release()
+
+
+def start_profile(duration=10.0, interval=0.005, output_path=None):
+    """Start a background profiling window. Returns the output path, or None if one is already running."""
+    # The lock is taken here and released by the sampling thread, so of two concurrent calls only one starts
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        if output_path is None:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            now = time.time()
+            stamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03d}-{next(_profile_numbers)}"
+            output_path = os.path.join(PROFILE_DIR, f"profile-{stamp}.collapsed")
+        threading.Thread(target=_sample_then_release, args=(duration, interval, output_path),
+                         name='stack-sampler', daemon=True).start()
+    except BaseException:
+        _profile_lock.release()
+        raise
+    return output_path
+
+
+# SQLite slow-query log
+def log_slow_query(connection, sql, parameters, elapsed_ms, batch=None):
+    try:
+        plan = sqlite3.Cursor(connection).execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+        plan = [row[-1] for row in plan]
+    except sqlite3.Error:
+        plan = []
+    entry = {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "elapsed_ms": round(elapsed_ms, 3),
+        "sql": ' '.join(sql.split()),
+        "parameters": [repr(p) for p in parameters] if isinstance(parameters, (list, tuple)) else repr(parameters),
+        "plan": plan
+    }
+    if batch is not None:
+        # executemany: the parameters and plan are those of the first row
+        entry["batch"] = batch
+    with _slow_log_lock:
+        with open(SLOW_QUERY_LOG, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+
+
+class SlowQueryCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        result = super().execute(sql, parameters)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms >= SLOW_QUERY_THRESHOLD_MS:
+            log_slow_query(self.connection, sql, parameters, elapsed_ms)
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        rows = list(seq_of_parameters)
+        start = time.perf_counter()
+        result = super().executemany(sql, rows)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms >= SLOW_QUERY_THRESHOLD_MS:
+            log_slow_query(self.connection, sql, rows[0] if rows else (), elapsed_ms, len(rows))
+        return result
+
+
+# conn.execute() and executemany() are shortcuts that bypass cursor(), so they are timed too
+class SlowQueryConnection(sqlite3.Connection):
+    def cursor(self, factory=SlowQueryCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect(db_name):
+    if SLOW_QUERY_THRESHOLD_MS is None:
+        return sqlite3.connect(db_name)
+    return sqlite3.connect(db_name, factory=SlowQueryConnection)
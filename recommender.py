@@ -0,0 +1,174 @@
+import math
+import time
+import queue
+import threading
+from collections import defaultdict
+
+# "Similar products" from product_ratings by item-item collaborative filtering. Two products are
+# similar when the same users rate them alike: the adjusted cosine of their ratings, each rating
+# centred on its user's mean, over at least MIN_COMMON shared raters. The top K neighbours of every
+# product are precomputed, so a lookup is a dict access.
+TOP_K = 20
+MIN_COMMON = 2
+
+
+class SimilarityIndex:
+    def __init__(self, k=TOP_K, min_common=MIN_COMMON):
+        self.k = k
+        self.min_common = min_common
+        # product -> {user: rating} and user -> {product: rating}
+        self.item_ratings = defaultdict(dict)
+        self.user_ratings = defaultdict(dict)
+        # product -> [(similar product, score), ...], best first; lists are replaced, never mutated
+        self.neighbors = {}
+        self.ready = False
+        self.updates = queue.Queue()
+        self.worker = None
+        self.stopped = threading.Event()
+
+    def similar(self, product_id, limit=None):
+        return self.neighbors.get(product_id, [])[:limit or self.k]
+
+    # Full rebuild from (user_id, product_id, rating) rows, vectorized with NumPy
+    def rebuild(self, rows):
+        import numpy as np
+
+        item_ratings, user_ratings = defaultdict(dict), defaultdict(dict)
+        for user_id, product_id, rating in rows:
+            item_ratings[product_id][user_id] = rating
+            user_ratings[user_id][product_id] = rating
+        if not rows:
+            self.item_ratings, self.user_ratings, self.neighbors = item_ratings, user_ratings, {}
+            return
+
+        data = np.array(rows, dtype=np.float64)
+        item_ids, items = np.unique(data[:, 1].astype(np.int64), return_inverse=True)
+        _, users = np.unique(data[:, 0].astype(np.int64), return_inverse=True)
+        n_items, n_users = len(item_ids), users.max() + 1
+        user_counts = np.bincount(users, minlength=n_users)
+        centred = data[:, 2] - (np.bincount(users, weights=data[:, 2], minlength=n_users) / user_counts)[users]
+        norms = np.sqrt(np.bincount(items, weights=centred ** 2, minlength=n_items))
+
+        # Ratings grouped by user (CSR) and by item (CSC)
+        by_user = np.argsort(users, kind='stable')
+        user_ptr = np.concatenate(([0], np.cumsum(user_counts)))
+        user_items, user_values = items[by_user], centred[by_user]
+        by_item = np.argsort(items, kind='stable')
+        item_ptr = np.concatenate(([0], np.cumsum(np.bincount(items, minlength=n_items))))
+        item_users, item_values = users[by_item], centred[by_item]
+
+        neighbors = {}
+        for i in range(n_items):
+            raters = item_users[item_ptr[i]:item_ptr[i + 1]]
+            weights = item_values[item_ptr[i]:item_ptr[i + 1]]
+            # Positions of every rating by this item's raters, gathered without a Python loop
+            starts, lengths = user_ptr[raters], user_counts[raters]
+            offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            positions = np.arange(lengths.sum()) + offsets
+            co_items = user_items[positions]
+            dots = np.bincount(co_items, weights=user_values[positions] * np.repeat(weights, lengths), minlength=n_items)
+            common = np.bincount(co_items, minlength=n_items)
+            denominator = norms * norms[i]
+            scores = np.divide(dots, denominator, out=np.zeros(n_items), where=denominator > 0)
+            scores[(common < self.min_common) | (scores <= 0)] = 0
+            scores[i] = 0
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > self.k:
+                candidates = candidates[np.argpartition(-scores[candidates], self.k)[:self.k]]
+            candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+            if len(candidates):
+                neighbors[int(item_ids[i])] = [(int(item_ids[j]), round(float(scores[j]), 4)) for j in candidates]
+        self.item_ratings, self.user_ratings, self.neighbors = item_ratings, user_ratings, neighbors
+
+    def user_mean(self, user_id):
+        ratings = self.user_ratings[user_id]
+        return sum(ratings.values()) / len(ratings)
+
+    def norm(self, product_id, means):
+        return math.sqrt(sum((rating - means[user]) ** 2 for user, rating in self.item_ratings[product_id].items()))
+
+    # Top-K neighbours of one product, computed from its raters' other ratings
+    def top_k_for(self, product_id):
+        raters = self.item_ratings[product_id]
+        means = {user: self.user_mean(user) for user in raters}
+        dots, common = defaultdict(float), defaultdict(int)
+        for user, rating in raters.items():
+            for other, other_rating in self.user_ratings[user].items():
+                if other != product_id:
+                    dots[other] += (rating - means[user]) * (other_rating - means[user])
+                    common[other] += 1
+        norm = self.norm(product_id, means)
+        scores = []
+        for other, dot in dots.items():
+            if common[other] < self.min_common or dot <= 0:
+                continue
+            for user in self.item_ratings[other]:
+                if user not in means:
+                    means[user] = self.user_mean(user)
+            denominator = norm * self.norm(other, means)
+            if denominator > 0:
+                scores.append((other, round(dot / denominator, 4)))
+        scores.sort(key=lambda pair: -pair[1])
+        return scores[:self.k]
+
+    def similarity(self, product_id, other):
+        common = self.item_ratings[product_id].keys() & self.item_ratings[other].keys()
+        if len(common) < self.min_common:
+            return 0
+        means = {user: self.user_mean(user) for user in self.item_ratings[product_id].keys() | self.item_ratings[other].keys()}
+        dot = sum((self.item_ratings[product_id][user] - means[user]) * (self.item_ratings[other][user] - means[user])
+                  for user in common)
+        denominator = self.norm(product_id, means) * self.norm(other, means)
+        return round(dot / denominator, 4) if dot > 0 and denominator > 0 else 0
+
+    # Apply one rating write: the rated product's neighbours are recomputed, and its score is refreshed
+    # in the lists of the other products this user rated. Other lists catch up at the next rebuild.
+    def apply(self, user_id, product_id, rating):
+        self.item_ratings[product_id][user_id] = rating
+        self.user_ratings[user_id][product_id] = rating
+        top = self.top_k_for(product_id)
+        if top:
+            self.neighbors[product_id] = top
+        else:
+            self.neighbors.pop(product_id, None)
+        scores = dict(top)
+        for other in self.user_ratings[user_id]:
+            if other == product_id:
+                continue
+            current = [pair for pair in self.neighbors.get(other, []) if pair[0] != product_id]
+            score = scores.get(other) or self.similarity(product_id, other)
+            if score > 0:
+                current.append((product_id, score))
+                current.sort(key=lambda pair: -pair[1])
+            if current:
+                self.neighbors[other] = current[:self.k]
+            else:
+                self.neighbors.pop(other, None)
+
+    # Called on rate_product; the work happens on the background worker, off the request path
+    def record(self, user_id, product_id, rating):
+        self.updates.put((user_id, product_id, rating))
+
+    def start(self, load_rows, rebuild_interval=600):
+        """Build the index in the background, apply recorded ratings as they arrive, and rebuild
+        from `load_rows()` every `rebuild_interval` seconds."""
+        def run():
+            while not self.stopped.is_set():
+                try:
+                    self.rebuild(load_rows())
+                    self.ready = True
+                except Exception as e:
+                    print(f"Error rebuilding similarity index: {e}")
+                deadline = time.monotonic() + rebuild_interval
+                while time.monotonic() < deadline and not self.stopped.is_set():
+                    try:
+                        self.apply(*self.updates.get(timeout=1.0))
+                    except queue.Empty:
+                        pass
+
+        self.worker = threading.Thread(target=run, daemon=True)
+        self.worker.start()
+
+    # The worker exits within a second
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import client
+
+# Primary/replica log shipping. On the primary, triggers append every row written to the base
+# tables to replication_log in the same transaction, numbered by a log sequence number (LSN).
+# A replica starts from a snapshot of the primary's database, then pulls log entries after its
+# position and replays them as row operations. The position is stored in the same transaction
+# as the rows it covers. Derived tables (seller rollups, product_changes) are not shipped: the
+# replica's own triggers maintain them from the replayed rows, as they do on the primary.
+REPLICATED_TABLES = ('users', 'products', 'product_ratings', 'purchases')
+LOG_KEEP = 100000
+
+
+class LogGone(Exception):
+    pass
+
+
+def install_log(conn, tables=REPLICATED_TABLES):
+    conn.execute('''CREATE TABLE IF NOT EXISTS replication_log (
+                        lsn INTEGER PRIMARY KEY AUTOINCREMENT,
+                        tbl TEXT,
+                        op TEXT,
+                        row_id INTEGER,
+                        data TEXT
+                    )''')
+    for table in tables:
+        # Recreated on every start so the logged columns follow the current schema
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        for op, event, row in (('insert', 'INSERT', 'NEW'), ('update', 'UPDATE', 'NEW'), ('delete', 'DELETE', 'OLD')):
+            data = "json_object(" + ", ".join(f"'{column}', NEW.{column}" for column in columns) + ")" if row == 'NEW' else "NULL"
+            conn.execute(f"DROP TRIGGER IF EXISTS replicate_{table}_{op}")
+            conn.execute(f'''CREATE TRIGGER replicate_{table}_{op} AFTER {event} ON {table}
+                             BEGIN INSERT INTO replication_log (tbl, op, row_id, data) VALUES ('{table}', '{op}', {row}.rowid, {data}); END''')
+
+
+# Drop the logging triggers (replicas, and primaries with replication turned off)
+def remove_log(conn):
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'replicate\\_%' ESCAPE '\\'").fetchall():
+        conn.execute(f"DROP TRIGGER {name}")
+
+
+# LSN of the newest entry ever logged (kept by AUTOINCREMENT even after truncation)
+def log_position(conn):
+    try:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'replication_log'").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+def read_log(conn, after, limit):
+    """(current position, entries after `after`); raises LogGone when some were already truncated."""
+    current = log_position(conn)
+    first = conn.execute("SELECT MIN(lsn) FROM replication_log").fetchone()[0]
+    if after < current and (first is None or after < first - 1):
+        raise LogGone(f"Log entries after {after} were truncated")
+    rows = conn.execute("SELECT lsn, tbl, op, row_id, data FROM replication_log WHERE lsn > ? ORDER BY lsn LIMIT ?",
+                        (after, limit)).fetchall()
+    return current, [[lsn, table, op, row_id, json.loads(data) if data else None] for lsn, table, op, row_id, data in rows]
+
+
+def truncate_log(conn, up_to):
+    conn.execute("DELETE FROM replication_log WHERE lsn <= ?", (up_to,))
+    conn.commit()
+
+
+# Consistent copy of the whole database file, read in one step under a shared lock
+def snapshot(db_path):
+    copy_path = f"{db_path}.snapshot-{threading.get_ident()}"
+    source, copy = sqlite3.connect(db_path), sqlite3.connect(copy_path)
+    try:
+        source.backup(copy)
+    finally:
+        source.close()
+        copy.close()
+    try:
+        with open(copy_path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(copy_path)
+
+
+def applied_position(conn):
+    try:
+        row = conn.execute("SELECT position FROM replication_state").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+# Replace the database at `db_path` with snapshot bytes and record the snapshot's log position
+def restore(db_path, data):
+    copy_path = f"{db_path}.restore"
+    with open(copy_path, 'wb') as f:
+        f.write(data)
+    source, target = sqlite3.connect(copy_path), sqlite3.connect(db_path, timeout=30)
+    try:
+        source.backup(target)
+        remove_log(target)
+        position = log_position(target)
+        target.execute("DELETE FROM replication_log")
+        target.execute("DROP TABLE IF EXISTS replication_state")
+        target.execute("CREATE TABLE replication_state (position INTEGER)")
+        target.execute("INSERT INTO replication_state (position) VALUES (?)", (position,))
+        target.commit()
+    finally:
+        source.close()
+        target.close()
+        os.remove(copy_path)
+    return position
+
+
+def apply_entries(conn, entries):
+    for lsn, table, op, row_id, data in entries:
+        if table not in REPLICATED_TABLES:
+            raise ValueError(f"Unexpected table {table} in replication log")
+        if op == 'insert':
+            columns = ", ".join(f'"{column}"' for column in data)
+            conn.execute(f"INSERT INTO {table} ({columns}) VALUES ({', '.join('?' * len(data))})", list(data.values()))
+        elif op == 'update':
+            assignments = ", ".join(f'"{column}" = ?' for column in data)
+            conn.execute(f"UPDATE {table} SET {assignments} WHERE rowid = ?", list(data.values()) + [row_id])
+        else:
+            conn.execute(f"DELETE FROM {table} WHERE rowid = ?", (row_id,))
+    conn.execute("UPDATE replication_state SET position = ?", (entries[-1][0],))
+
+
+# Applied positions reported by replicas as they pull, for truncation and monitoring
+class ReplicaTracker:
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self.positions = {}
+
+    def report(self, replica_id, position):
+        self.positions[replica_id] = (position, time.monotonic())
+
+    def live(self):
+        now = time.monotonic()
+        return {replica_id: position for replica_id, (position, seen) in list(self.positions.items()) if now - seen <= self.max_age}
+
+
+class Replica:
+    def __init__(self, primary, db_path, token, replica_id, poll_interval=0.05, batch_size=1000):
+        host, _, port = primary.rpartition(':')
+        self.host = host or 'localhost'
+        self.pool = client.ConnectionPool(self.host, int(port), max_idle=1)
+        self.db_path = db_path
+        self.token = token
+        self.replica_id = replica_id
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.position = 0
+        self.primary_position = 0
+        self.changed = threading.Condition()
+        # Called with the applied entries, or with None after a snapshot replaced the database
+        self.on_apply = None
+        self.stopped = threading.Event()
+
+    def request(self, path, body):
+        status, _, data = self.pool.request(client.build_request('POST', path, self.host, body))
+        return status, data
+
+    def bootstrap(self):
+        status, data = self.request('/replication/snapshot', {"token": self.token})
+        if status != 200:
+            raise RuntimeError(f"Snapshot from primary failed with status {status}")
+        self.set_position(restore(self.db_path, data))
+        print(f"Replica restored from snapshot at position {self.position}")
+
+    # Resume from the stored position, or copy the primary first
+    def prepare(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            position = applied_position(conn)
+        finally:
+            conn.close()
+        if position is None:
+            self.bootstrap()
+        else:
+            self.set_position(position)
+
+    def set_position(self, position):
+        with self.changed:
+            self.position = position
+            self.changed.notify_all()
+
+    def wait_for(self, position, timeout):
+        with self.changed:
+            return self.changed.wait_for(lambda: self.position >= position, timeout)
+
+    # Apply one batch; True when more entries may be waiting
+    def pull(self):
+        status, data = self.request('/replication/log', {"token": self.token, "after": self.position,
+                                                         "limit": self.batch_size, "replica": self.replica_id})
+        if status == 410:
+            self.bootstrap()
+            if self.on_apply:
+                self.on_apply(None)
+            return True
+        if status != 200:
+            raise RuntimeError(f"Log pull from primary failed with status {status}")
+        response = json.loads(data)
+        self.primary_position = response["position"]
+        entries = response["entries"]
+        if not entries:
+            return False
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                apply_entries(conn, entries)
+        finally:
+            conn.close()
+        if self.on_apply:
+            self.on_apply(entries)
+        self.set_position(entries[-1][0])
+        return len(entries) == self.batch_size
+
+    def start(self):
+        def run():
+            while not self.stopped.is_set():
+                try:
+                    more = self.pull()
+                except Exception as e:
+                    print(f"Error pulling from primary: {e}")
+                    self.stopped.wait(1)
+                    continue
+                if not more:
+                    self.stopped.wait(self.poll_interval)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def stats(self):
+        return {"role": "replica", "replica_id": self.replica_id, "position": self.position,
+                "primary_position": self.primary_position, "lag": max(self.primary_position - self.position, 0)}
@@ -1,75 +1,288 @@
 import socket
-import sqlite3
 import threading
 import json
 import hashlib
+import time
+import os
+import signal
+import urllib.parse
+import profiler
+import compression
+import wire_format
+import image_store
+import admission
+import connections
+import recommender
+import leaderboards
+import facets
+import catalogue_columns
+import replication
+import storage
+import message_store
+import currency as currency_rates
 
-DB_NAME = 'auboutique.db'
+DB_NAME = os.environ.get('AUBOUTIQUE_DB', 'auboutique.db')
+ADMIN_TOKEN = os.environ.get('AUBOUTIQUE_ADMIN_TOKEN')
+# Prices are stored in USD; other currencies are converted on request
+BASE_CURRENCY = 'USD'
+RATES = currency_rates.RatesCache(snapshot_path=os.environ.get('AUBOUTIQUE_RATES_SNAPSHOT', 'rates_snapshot.json'))
+IMAGES = image_store.ImageStore()
+
+# Admission control: at most MAX_IN_FLIGHT requests are processed at once and a short queue waits
+# behind them; anything beyond is answered 503 immediately. Optional token buckets limit each client
+# IP and each session (X-Session-Id header) to a sustained rate; 0 disables them.
+# Past a few requests per core, extra concurrency only adds GIL and SQLite lock contention.
+MAX_IN_FLIGHT = int(os.environ.get('AUBOUTIQUE_MAX_IN_FLIGHT', 4 * (os.cpu_count() or 1)))
+REQUEST_LIMITER = admission.ConcurrencyLimiter(max_concurrent=MAX_IN_FLIGHT,
+                                               max_queue=int(os.environ.get('AUBOUTIQUE_MAX_QUEUE', 2 * MAX_IN_FLIGHT)),
+                                               timeout=float(os.environ.get('AUBOUTIQUE_QUEUE_TIMEOUT', 0.1)))
+IP_LIMITER = admission.RateLimiter(float(os.environ.get('AUBOUTIQUE_IP_RATE', 0)), float(os.environ.get('AUBOUTIQUE_IP_BURST', 100)))
+SESSION_LIMITER = admission.RateLimiter(float(os.environ.get('AUBOUTIQUE_SESSION_RATE', 0)),
+                                        float(os.environ.get('AUBOUTIQUE_SESSION_BURST', 40)))
+OVERLOAD_RETRY_AFTER = 1
+
+# Connection lifecycle: caps on open connections (overall and per client IP), how long a keep-alive
+# connection may sit idle, how long a started request may take to arrive and how long a response
+# may take to send. Shutdown (SIGTERM/SIGINT) drains connections for up to DRAIN_TIMEOUT seconds.
+CONNECTIONS = connections.ConnectionManager(max_connections=int(os.environ.get('AUBOUTIQUE_MAX_CONNECTIONS', 1024)),
+                                            max_per_ip=int(os.environ.get('AUBOUTIQUE_MAX_CONNECTIONS_PER_IP', 256)))
+IDLE_TIMEOUT = float(os.environ.get('AUBOUTIQUE_IDLE_TIMEOUT', 60))
+READ_TIMEOUT = float(os.environ.get('AUBOUTIQUE_READ_TIMEOUT', 10))
+WRITE_TIMEOUT = float(os.environ.get('AUBOUTIQUE_WRITE_TIMEOUT', 30))
+DRAIN_TIMEOUT = float(os.environ.get('AUBOUTIQUE_DRAIN_TIMEOUT', 5))
+# Requests are refused before they are buffered when the headers or the declared Content-Length
+# exceed these; the largest legitimate body is an image upload
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = int(os.environ.get('AUBOUTIQUE_MAX_BODY_BYTES', image_store.MAX_IMAGE_BYTES + 64 * 1024))
+
+# Item-item "similar products" index, built in the background and updated as ratings arrive
+RECOMMENDER = recommender.SimilarityIndex(k=int(os.environ.get('AUBOUTIQUE_SIMILAR_K', recommender.TOP_K)))
+SIMILAR_REBUILD_INTERVAL = float(os.environ.get('AUBOUTIQUE_SIMILAR_REBUILD_INTERVAL', 600))
+# Category / price bucket / in-stock counts for faceted navigation
+FACETS = facets.FacetCounts()
+# Top-rated, most-rated and best-selling boards, rebuilt at startup and updated on every write
+LEADERBOARDS = leaderboards.Leaderboards(min_ratings=int(os.environ.get('AUBOUTIQUE_LEADERBOARD_MIN_RATINGS', leaderboards.MIN_RATINGS)))
+# NumPy column arrays of the catalogue for /browse filters and sorts, updated on every write.
+# AUBOUTIQUE_COLUMNAR=0 (or no NumPy) answers /browse by sorting rows from storage instead.
+COLUMNS = (catalogue_columns.ColumnarCatalogue()
+           if catalogue_columns.np is not None and os.environ.get('AUBOUTIQUE_COLUMNAR', '1') == '1' else None)
+
+# Users, catalogue and messages. AUBOUTIQUE_STORAGE=sqlite keeps them in DB_NAME, with products,
+# ratings and purchases split across AUBOUTIQUE_SHARDS files by owner (1 = all in DB_NAME) and chat
+# messages partitioned by month in their own files; =memory keeps everything in process memory,
+# loaded from DB_NAME at startup, to measure the server without storage cost
+STORE = storage.open_storage(os.environ.get('AUBOUTIQUE_STORAGE', 'sqlite'), DB_NAME, int(os.environ.get('AUBOUTIQUE_SHARDS', 1)))
+MESSAGE_MAINTENANCE_INTERVAL = float(os.environ.get('AUBOUTIQUE_MESSAGE_MAINTENANCE_INTERVAL', 3600))
+
+# Read replicas. AUBOUTIQUE_REPLICATION=1 makes this server a primary that logs row changes for
+# replicas; AUBOUTIQUE_REPLICA_OF=host:port makes it a read-only replica of that primary. Both
+# sides need the same AUBOUTIQUE_ADMIN_TOKEN. A read carrying X-Min-Position waits up to
+# REPLICA_WAIT seconds for the replica to reach that position, then answers 409 so the client
+# falls back to the primary.
+REPLICATION = os.environ.get('AUBOUTIQUE_REPLICATION', '0') == '1'
+REPLICA_OF = os.environ.get('AUBOUTIQUE_REPLICA_OF')
+REPLICA_WAIT = float(os.environ.get('AUBOUTIQUE_REPLICA_WAIT', 0.5))
+REPLICATION_LOG_KEEP = int(os.environ.get('AUBOUTIQUE_REPLICATION_LOG_KEEP', replication.LOG_KEEP))
+REPLICAS = replication.ReplicaTracker()
+REPLICA = None
+# Routes that never write, and so are served by replicas
+READ_ROUTES = {'/products', '/facets', '/browse', '/leaderboard', '/get_average_rating', '/similar_products', '/seller_dashboard',
+               '/search_product', '/search_user_products', '/get_user_connection_info',
+               '/admin/profile', '/admin/connections', '/admin/replication'}
+
+# Catalogue version: bumped on every product or rating write and used to build ETags.
+# The epoch keeps ETags from a previous server run from matching after a restart.
+CATALOGUE_EPOCH = format(int(time.time() * 1000), 'x')
+catalogue_version = 0
+catalogue_lock = threading.Lock()
 
 # Function to hash passwords
 def hash_password(password):
     return hashlib.sha256(password.encode('utf-8')).hexdigest()
 
-def setup_database():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    first_name TEXT,
-                    last_name TEXT,
-                    email TEXT,
-                    username TEXT UNIQUE,
-                    password TEXT,
-                    online INTEGER DEFAULT 0,
-                    port INTEGER DEFAULT NULL,
-                    ip_address TEXT DEFAULT NULL
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS products (
-                    id INTEGER PRIMARY KEY,
-                    name TEXT,
-                    owner_id INTEGER,
-                    category TEXT,
-                    price REAL,
-                    description TEXT,
-                    image TEXT,
-                    quantity INTEGER DEFAULT 1,
-                    buyer_id INTEGER DEFAULT NULL,
-                    FOREIGN KEY (owner_id) REFERENCES users (id),
-                    FOREIGN KEY (buyer_id) REFERENCES users (id)
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY,
-                    sender_id INTEGER,
-                    receiver_id INTEGER,
-                    message TEXT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (sender_id) REFERENCES users (id),
-                    FOREIGN KEY (receiver_id) REFERENCES users (id)
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS product_ratings (
-                    id INTEGER PRIMARY KEY,
-                    product_id INTEGER,
-                    user_id INTEGER,
-                    rating INTEGER CHECK (rating >= 1 AND rating <= 5),
-                    FOREIGN KEY (product_id) REFERENCES products (id),
-                    FOREIGN KEY (user_id) REFERENCES users (id),
-                    UNIQUE(product_id, user_id)
-                )''')
-    conn.commit()
-    conn.close()
-
-
+# Open a database connection (with slow-query logging when enabled)
+def connect_db():
+    return profiler.connect(DB_NAME)
 
 # Client handler function
 def handle_client(conn, addr):
+    reason = 'closed'
     with conn:
         print(f"Connected by {addr}")
-        while True:
-            request = conn.recv(1024).decode('utf-8')
-            if not request:
-                break
-            response = process_request(request)
-            conn.sendall(response.encode('utf-8'))
+        try:
+            buffer = b''
+            while not CONNECTIONS.draining:
+                CONNECTIONS.mark(conn, 'idle')
+                request, buffer = read_request(conn, buffer, IDLE_TIMEOUT, READ_TIMEOUT)
+                if not request:
+                    break
+                CONNECTIONS.mark(conn, 'busy')
+                conn.settimeout(WRITE_TIMEOUT)
+                serve_request(conn, addr, request)
+        except connections.Reaped as e:
+            reason = e.reason
+        except RequestRejected as e:
+            # The rest of the request is never read, so the connection cannot be reused
+            reason = 'rejected_request'
+            try:
+                conn.sendall(frame_response(f'HTTP/1.1 {e.status}\r\nContent-Type: application/json\r\n\r\n' + json.dumps({"message": str(e)})))
+            except OSError:
+                pass
+        except socket.timeout:
+            reason = 'reaped_write'
+        except OSError:
+            reason = 'reset'
+        finally:
+            CONNECTIONS.unregister(conn, reason)
+
+def serve_request(conn, addr, request):
+    head, _, body = request.partition(b'\r\n\r\n')
+    head = head.decode('utf-8')
+    request_headers = parse_headers(head)
+    rejection = admit(addr[0], request_headers)
+    if rejection:
+        conn.sendall(frame_response(rejection))
+        return
+    try:
+        request_line = head.split('\r\n', 1)[0].split(' ')
+        method, path = request_line[0], request_line[1].partition('?')[0] if len(request_line) > 1 else ''
+        write = method == 'POST' and path not in READ_ROUTES
+        min_position = request_headers.get('x-min-position', '0')
+        if not min_position.isdigit():
+            response = bad_request("X-Min-Position must be a non-negative integer")
+        elif REPLICA and write:
+            response = 'HTTP/1.1 403 Forbidden\r\nContent-Type: application/json\r\n\r\n{"message": "Read-only replica"}'
+        elif REPLICA and not REPLICA.wait_for(int(min_position), REPLICA_WAIT):
+            response = 'HTTP/1.1 409 Conflict\r\nContent-Type: application/json\r\n\r\n{"message": "Replica has not caught up"}'
+        # Image uploads are raw bytes, not JSON, so they are routed before decoding
+        elif method == 'POST' and path == '/upload_image':
+            response = upload_image(body)
+        else:
+            response = process_request(request.decode('utf-8'))
+        if isinstance(response, image_store.FileResponse):
+            send_file(conn, response)
+        else:
+            conn.sendall(frame_response(response, request_headers.get('accept-encoding'), replication_header(write)))
+    finally:
+        REQUEST_LIMITER.release()
+
+# Position a response reflects: the log position after a write on the primary (for read-your-writes),
+# and the applied position on a replica
+def replication_header(write):
+    if REPLICA:
+        return f"X-Replication-Position: {REPLICA.position}"
+    if REPLICATION and write:
+        conn = connect_db()
+        try:
+            return f"X-Replication-Position: {replication.log_position(conn)}"
+        finally:
+            conn.close()
+    return None
+
+def bad_request(message):
+    return 'HTTP/1.1 400 Bad Request\r\nContent-Type: application/json\r\n\r\n' + json.dumps({"message": message})
+
+def rejected(status, message, seconds):
+    return (f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\nRetry-After: {admission.retry_after(seconds)}\r\n\r\n'
+            + json.dumps({"message": message}))
+
+# Rate limits first, then an in-flight slot; returns a 429/503 rejection, or None once a slot is held
+def admit(ip, request_headers):
+    wait = IP_LIMITER.check(ip)
+    session = request_headers.get('x-session-id')
+    if not wait and session:
+        wait = SESSION_LIMITER.check(session)
+    if wait:
+        return rejected('429 Too Many Requests', "Rate limit exceeded", wait)
+    try:
+        REQUEST_LIMITER.acquire()
+    except admission.Overloaded as e:
+        return rejected('503 Service Unavailable', str(e), OVERLOAD_RETRY_AFTER)
+    return None
+
+# recv() with the connection's current deadline: `idle_timeout` between requests, and the
+# absolute `deadline` once a request has started arriving
+def recv_chunk(conn, deadline, idle_timeout):
+    if deadline is None:
+        conn.settimeout(idle_timeout)
+    else:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise connections.Reaped('reaped_read')
+        conn.settimeout(remaining)
+    try:
+        return conn.recv(65536)
+    except socket.timeout:
+        raise connections.Reaped('reaped_idle' if deadline is None else 'reaped_read')
+
+# Read one full request (headers plus Content-Length body); returns (request, leftover bytes).
+# A request must arrive in full within `read_timeout` of its first byte, so slow senders cannot pin a thread.
+class RequestRejected(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def read_request(conn, buffer, idle_timeout=None, read_timeout=None):
+    deadline = time.monotonic() + read_timeout if buffer and read_timeout else None
+    while b'\r\n\r\n' not in buffer:
+        if len(buffer) > MAX_HEADER_BYTES:
+            raise RequestRejected('431 Request Header Fields Too Large', "Request headers too large")
+        chunk = recv_chunk(conn, deadline, idle_timeout)
+        if not chunk:
+            return None, b''
+        if deadline is None and read_timeout:
+            deadline = time.monotonic() + read_timeout
+        buffer += chunk
+    head, rest = buffer.split(b'\r\n\r\n', 1)
+    if len(head) > MAX_HEADER_BYTES:
+        raise RequestRejected('431 Request Header Fields Too Large', "Request headers too large")
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            if not value.strip().isdigit():
+                raise RequestRejected('400 Bad Request', "Invalid Content-Length")
+            length = int(value)
+    if length > MAX_BODY_BYTES:
+        raise RequestRejected('413 Payload Too Large', f"Request body over {MAX_BODY_BYTES} bytes")
+    while len(rest) < length:
+        chunk = recv_chunk(conn, deadline, idle_timeout)
+        if not chunk:
+            return None, b''
+        rest += chunk
+    return head + b'\r\n\r\n' + rest[:length], rest[length:]
+
+# Give every response a status line and Content-Length so clients can read it in full;
+# large bodies are compressed with the best encoding the client accepts
+def frame_response(response, accept_encoding=None, extra_header=None):
+    if isinstance(response, bytes):
+        head, body = response.split(b'\r\n\r\n', 1)
+        head = head.decode('utf-8')
+    else:
+        if not response.startswith('HTTP/'):
+            response = 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n' + response
+        head, body = response.split('\r\n\r\n', 1)
+        body = body.encode('utf-8')
+    if len(body) >= compression.MIN_COMPRESS_BYTES:
+        encoding = compression.choose_encoding(accept_encoding)
+        if encoding:
+            body = compression.compress(body, encoding)
+            head += f"\r\nContent-Encoding: {encoding}\r\nVary: Accept-Encoding"
+    if extra_header:
+        head += f"\r\n{extra_header}"
+    return f"{head}\r\nContent-Length: {len(body)}\r\n\r\n".encode('utf-8') + body
+
+# Stream a file body with sendfile(2), so image bytes go from the page cache to the socket without a copy
+def send_file(conn, response):
+    try:
+        f = open(response.path, 'rb')
+    except OSError:
+        conn.sendall(frame_response('HTTP/1.1 404 Not Found\r\nContent-Type: application/json\r\n\r\n{"message": "Image not found"}'))
+        return
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        conn.sendall(f"{response.head}\r\nContent-Length: {size}\r\n\r\n".encode('utf-8'))
+        conn.sendfile(f)
 
 # Process HTTP request
 def process_request(request):
@@ -77,10 +290,18 @@ def process_request(request):
         headers, body = request.split('\r\n\r\n', 1)
         method, path, _ = headers.split(' ', 2)
     except ValueError:
-        return 'HTTP/1.1 400 Bad Request\r\nContent-Type: application/json\r\n\r\n{"message": "Malformed request"}'
-    
+        return bad_request("Malformed request")
+    path, _, query = path.partition('?')
+    params = dict(urllib.parse.parse_qsl(query))
+    request_headers = parse_headers(headers)
+
     if method == 'POST':
-        data = json.loads(body)
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return bad_request("Request body is not valid JSON")
+        if not isinstance(data, dict):
+            return bad_request("Request body must be a JSON object")
         if path == '/register':
             return register_user(data)
         elif path == '/login':
@@ -89,6 +310,10 @@ def process_request(request):
             return rate_product(data)
         elif path == '/get_average_rating':
             return get_average_rating(data)
+        elif path == '/similar_products':
+            return similar_products(data)
+        elif path == '/seller_dashboard':
+            return seller_dashboard(data)
         elif path == '/logout':
             return logout_user(data['user_id'])
         elif path == '/add_product':
@@ -96,260 +321,447 @@ def process_request(request):
         elif path == '/buy_product':
             return buy_product(data)
         elif path == '/search_product':
-            return search_product(data['search_term'])
+            try:
+                after, limit = int_param(data, 'after'), page_limit(data)
+            except ValueError as e:
+                return bad_request(str(e))
+            return conditional(request_headers, (path, body, rates_version(data.get('currency'))), search_product, data['search_term'],
+                               data.get('currency'), data.get('format'), after, limit)
         elif path == '/search_user_products':
-            return search_user_products(data['username'])
+            return conditional(request_headers, (path, body, rates_version(data.get('currency'))), search_user_products, data['username'],
+                               data.get('currency'), data.get('format'))
         elif path == '/send_message':
             return send_message(data)
+        elif path == '/conversation':
+            return conversation_history(data)
         elif path == '/get_user_connection_info':
             return get_user_connection_info(data)
+        elif path == '/product_changes':
+            return product_changes(data)
+        elif path == '/admin/profile':
+            return start_profiling(data)
+        elif path == '/admin/connections':
+            return connection_stats(data)
+        elif path == '/admin/replication':
+            return replication_stats(data)
+        elif path == '/replication/log':
+            return replication_log(data)
+        elif path == '/replication/snapshot':
+            return replication_snapshot(data)
         else:
             return 'HTTP/1.1 404 Not Found\r\nContent-Type: application/json\r\n\r\n{"message": "Not found"}'
-    elif method == 'GET' and path == '/products':
-        return list_products()
+    elif method == 'GET' and path in ('/products', '/facets', '/browse'):
+        try:
+            filters = facets.parse_filters(params)
+            if params.get('sort', 'id').lstrip('-') not in catalogue_columns.SORTS:
+                raise ValueError(f"Unknown sort {params['sort']}")
+            after, limit, offset = int_param(params, 'after'), page_limit(params, 50 if path == '/browse' else None), int_param(params, 'offset', 0)
+            min_price, max_price = float_param(params, 'min_price'), float_param(params, 'max_price')
+        except ValueError as e:
+            return bad_request(str(e))
+        if path == '/facets':
+            return facet_counts(filters)
+        if path == '/browse':
+            return conditional(request_headers, (path, query, rates_version(params.get('currency'))), browse_products, params.get('currency'),
+                               filters, params.get('sort', 'id'), min_price, max_price, limit, offset)
+        return conditional(request_headers, (path, query, rates_version(params.get('currency'))), list_products, params.get('currency'),
+                           params.get('format'), filters, after, limit)
+    elif method == 'GET' and path == '/leaderboard':
+        return leaderboard(params)
+    elif method == 'GET' and path.startswith('/images/'):
+        return get_image(request_headers, path[len('/images/'):], params.get('size'))
     else:
         return 'HTTP/1.1 404 Not Found\r\nContent-Type: application/json\r\n\r\n{"message": "Not found"}'
 
-def list_products():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+def parse_headers(head):
+    request_headers = {}
+    for line in head.split('\r\n')[1:]:
+        name, _, value = line.partition(':')
+        request_headers[name.strip().lower()] = value.strip()
+    return request_headers
+
+def bump_catalogue_version():
+    global catalogue_version
+    with catalogue_lock:
+        catalogue_version += 1
+
+# ETag for a catalogue read: the catalogue version plus a digest of the route and its parameters
+def catalogue_etag(key):
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:12]
+    return f'"{CATALOGUE_EPOCH}-{catalogue_version}-{digest}"'
+
+# Converted prices change with the rates, so a listing in another currency is also keyed by when the
+# rates were fetched. Rates are looked up (and refreshed if expired) before the key is built, and never
+# go back to older ones, so the key is never newer than the rates the handler converts with; if none
+# can be had the handler answers with an error, which gets no ETag.
+def rates_version(currency):
+    if not currency or currency == BASE_CURRENCY:
+        return None
     try:
-        c.execute("SELECT * FROM products")
-        products = c.fetchall()
-        # Structure the response data as JSON
-        response = [
-            {
-                "id": product[0],
-                "name": product[1],
-                "owner_id": product[2],
-                "category": product[3],
-                "price": product[4],
-                "description": product[5],
-                "image": product[6],
-                "quantity": product[7],
-                "buyer_id": product[8]
-            } 
-            for product in products
-        ]
+        RATES.get_rates(BASE_CURRENCY)
+    except currency_rates.RatesUnavailable:
+        return None
+    return RATES.fetched_at(BASE_CURRENCY)
+
+# Answer If-None-Match with a body-less 304 while the catalogue is unchanged.
+# The ETag is computed before the query runs, so a concurrent write can only make it conservative.
+# The handler gets it as `etag` and sends it with a successful result only, never with an error.
+def conditional(request_headers, key, handler, *args):
+    etag = catalogue_etag(key)
+    if etag in [tag.strip() for tag in request_headers.get('if-none-match', '').split(',')]:
+        return f'HTTP/1.1 304 Not Modified\r\nETag: {etag}\r\n\r\n'
+    return handler(*args, etag=etag)
+
+# Store an uploaded image; the returned URL goes in a product's `image` field
+def upload_image(body):
+    if len(body) > image_store.MAX_IMAGE_BYTES:
+        return 'HTTP/1.1 413 Payload Too Large\r\nContent-Type: application/json\r\n\r\n{"message": "Image too large"}'
+    try:
+        name = IMAGES.put(body)
+        response = {"image": f"/images/{name}", "thumbnail": f"/images/{name}?size=thumb"}
+    except image_store.UnsupportedImage as e:
+        return 'HTTP/1.1 415 Unsupported Media Type\r\nContent-Type: application/json\r\n\r\n' + json.dumps({"message": str(e)})
     except Exception as e:
         response = {"message": str(e)}
-    finally:
-        conn.close()
-    
+    return json.dumps(response)
+
+# Image names are content hashes, so the name doubles as a strong ETag and responses never expire
+def get_image(request_headers, name, size=None):
+    located = IMAGES.locate(name, size)
+    if located is None:
+        return 'HTTP/1.1 404 Not Found\r\nContent-Type: application/json\r\n\r\n{"message": "Image not found"}'
+    path, content_type = located
+    etag = f'"{os.path.basename(path)}"'
+    cache_headers = f"ETag: {etag}\r\nCache-Control: {image_store.CACHE_CONTROL}"
+    if etag in [tag.strip() for tag in request_headers.get('if-none-match', '').split(',')]:
+        return f'HTTP/1.1 304 Not Modified\r\n{cache_headers}\r\n\r\n'
+    return image_store.FileResponse(f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\n{cache_headers}", path)
+
+# Build the JSON rows for a product result set, converting the price column in one pass
+# `fmt` selects an opt-in columnar encoding ('columnar' JSON or struct-packed 'binary') built
+# column-wise from the cursor rows without per-row dicts
+def serialize_products(products, currency=None, fmt=None):
+    if fmt in ('columnar', 'binary'):
+        data = wire_format.to_columns(products)
+        if currency and currency != BASE_CURRENCY:
+            data[4] = currency_rates.convert_prices(data[4], RATES.get_rate(BASE_CURRENCY, currency))
+        if fmt == 'binary':
+            return wire_format.encode_binary(wire_format.PRODUCT_COLUMNS, data)
+        return wire_format.encode_columnar(wire_format.PRODUCT_COLUMNS, data)
+    prices = [product[4] for product in products]
+    if currency and currency != BASE_CURRENCY:
+        prices = currency_rates.convert_prices(prices, RATES.get_rate(BASE_CURRENCY, currency))
+    return [
+        {
+            "id": product[0],
+            "name": product[1],
+            "owner_id": product[2],
+            "category": product[3],
+            "price": price,
+            "description": product[5],
+            "image": product[6],
+            "quantity": product[7],
+            "buyer_id": product[8]
+        }
+        for product, price in zip(products, prices)
+    ]
+
+def products_response(response, etag=None):
+    headers = f'ETag: {etag}\r\n' if etag else ''
+    if isinstance(response, bytes):
+        return f'HTTP/1.1 200 OK\r\nContent-Type: {wire_format.BINARY_CONTENT_TYPE}\r\n{headers}\r\n'.encode('utf-8') + response
+    return f'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n{headers}\r\n' + json.dumps(response)
+
+# Products in id order; for the next page pass the last id returned as `after`
+def list_products(currency=None, fmt=None, filters=None, after=None, limit=None, etag=None):
+    try:
+        products = STORE.list_products(filters, after, limit)
+        # Structure the response data as JSON
+        response = serialize_products(products, currency, fmt)
+    except Exception as e:
+        return products_response({"message": str(e)})
+
     # Return HTTP response with JSON data
-    return 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n' + json.dumps(response)
+    return products_response(response, etag)
+
+# Request parameters from a query string or JSON body; a bad value raises ValueError, answered with 400
+def int_param(params, name, default=None):
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        number = -1
+    if number < 0:
+        raise ValueError(f"{name} must be a non-negative integer")
+    return number
+
+def float_param(params, name):
+    value = params.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number") from None
+
+def page_limit(params, default=None):
+    limit = int_param(params, 'limit', default)
+    return min(limit, 10000) if limit is not None else None
+
 
+# Products changed since sync position `since` (0 for everything), with their current state and
+# rating aggregate. A position this server did not hand out (e.g. from before sharding) restarts
+# the sync from 0 with "reset": true, telling the client to drop its copy first.
+def product_changes(data):
+    try:
+        # At least one change per page, or a client paging on "more" would never advance
+        limit = max(page_limit(data, 1000), 1)
+    except ValueError as e:
+        return bad_request(str(e))
+    try:
+        since = data.get('since', 0)
+        reset = False
+        try:
+            changed, rows, more, position = STORE.product_changes(since, limit)
+        except storage.UnknownPosition:
+            changed, rows, more, position = STORE.product_changes(0, limit)
+            reset = True
+        ids = [row[0] for row in changed]
+        changes = serialize_products(rows)
+        for product, row in zip(changes, rows):
+            product["average_rating"] = row[9] or 0
+            product["rating_count"] = row[10]
+        found = {product["id"] for product in changes}
+        response = {
+            "seq": position,
+            "changes": changes,
+            "deleted": [product_id for product_id in ids if product_id not in found],
+            "more": more
+        }
+        if reset:
+            response["reset"] = True
+    except Exception as e:
+        response = {"message": str(e)}
+    return 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n' + json.dumps(response)
 
 def rate_product(data):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
     try:
         # Insert or update the rating
-        c.execute('''
-            INSERT INTO product_ratings (product_id, user_id, rating)
-            VALUES (?, ?, ?)
-            ON CONFLICT(product_id, user_id) DO UPDATE SET rating = excluded.rating
-        ''', (data['product_id'], data['user_id'], data['rating']))
-        conn.commit()
+        previous = STORE.rate_product(data['product_id'], data['user_id'], data['rating'])
+        bump_catalogue_version()
+        LEADERBOARDS.rate(int(data['product_id']), previous, int(data['rating']))
+        if COLUMNS is not None:
+            COLUMNS.rate(int(data['product_id']), previous, int(data['rating']))
+        RECOMMENDER.record(int(data['user_id']), int(data['product_id']), int(data['rating']))
         response = {"message": "Rating submitted successfully"}
     except Exception as e:
         response = {"message": str(e)}
-    finally:
-        conn.close()
     return 'HTTP/1.1 200 OK\r\n\r\n' + json.dumps(response)
     
+def load_leaderboards():
+    LEADERBOARDS.rebuild([(product[0], product[1], product[3]) for product in STORE.all_products()],
+                         STORE.rating_totals(), STORE.sales_totals())
+
+# Top products from the in-memory boards; ?board=top_rated|most_rated|best_selling&category=...&limit=...
+def leaderboard(params):
+    try:
+        response = {"board": params.get('board', 'top_rated'), "category": params.get('category'),
+                    "products": LEADERBOARDS.top(params.get('board', 'top_rated'), params.get('category'), int_param(params, 'limit', 10))}
+    except ValueError as e:
+        return bad_request(str(e))
+    return 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n' + json.dumps(response)
+
+def load_facets():
+    FACETS.rebuild([(product[0], product[3], product[4], int((product[7] or 0) > 0 and product[8] is None))
+                    for product in STORE.all_products()])
+
+def load_columns():
+    if COLUMNS is not None:
+        COLUMNS.rebuild(STORE.all_products(), STORE.rating_totals())
+
+# Filtered, sorted page of the catalogue with rating aggregates; `sort` is id, price, rating or
+# rating_count, prefixed with "-" for descending (ties by id), and `total` counts every match
+def browse_products(currency, filters, sort, min_price, max_price, limit, offset, etag=None):
+    try:
+        args = (filters, sort.lstrip('-'), sort.startswith('-'), limit, offset, min_price, max_price)
+        if COLUMNS is not None:
+            total, page = COLUMNS.query(*args)
+        else:
+            total, page = catalogue_columns.query_rows(STORE.list_products(filters), STORE.rating_totals(), *args)
+        products = serialize_products([row for row, _, _ in page], currency)
+        for product, (_, average_rating, rating_count) in zip(products, page):
+            product["average_rating"] = average_rating or 0
+            product["rating_count"] = rating_count
+        response = {"total": total, "products": products}
+    except Exception as e:
+        return products_response({"message": str(e)})
+    return products_response(response, etag)
+
+# Facet counts for the current filters, from the in-memory cells
+def facet_counts(filters):
+    total, counts = FACETS.counts(filters)
+    response = {"filters": filters, "total": total, "facets": counts}
+    return 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n' + json.dumps(response)
+
+# Seller dashboard: totals and recent daily buckets from the rollup tables only
+def seller_dashboard(data):
+    try:
+        owner_id = data.get('owner_id')
+        if owner_id is None:
+            user = STORE.find_user(data['username'])
+            owner_id = user.id if user else None
+        (units_sold, revenue, rating_count, rating_sum, active_listings), daily = STORE.seller_stats(owner_id, data.get('days', 30))
+        response = {
+            "owner_id": owner_id,
+            "units_sold": units_sold,
+            "revenue": round(revenue, 2),
+            "average_rating": round(rating_sum / rating_count, 2) if rating_count else None,
+            "rating_count": rating_count,
+            "active_listings": active_listings,
+            "daily": [{"day": day, "units_sold": units, "revenue": round(day_revenue, 2), "new_ratings": new_ratings}
+                      for day, units, day_revenue, new_ratings in daily]
+        }
+    except Exception as e:
+        response = {"message": str(e)}
+    return 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n' + json.dumps(response)
+
+def load_ratings():
+    return STORE.all_ratings()
+
+# Products most similar to one product, served from the precomputed index without touching the database
+def similar_products(data):
+    try:
+        similar = RECOMMENDER.similar(int(data['product_id']), int(data.get('limit', 10)))
+        response = {"product_id": int(data['product_id']), "ready": RECOMMENDER.ready,
+                    "similar": [{"id": product_id, "score": score} for product_id, score in similar]}
+    except Exception as e:
+        response = {"message": str(e)}
+    return 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n' + json.dumps(response)
+
 def get_average_rating(data):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
     try:
-        c.execute('''
-            SELECT AVG(rating) as average_rating FROM product_ratings WHERE product_id = ?
-        ''', (data['product_id'],))
-        avg_rating = c.fetchone()
-        response = {"average_rating": avg_rating[0] if avg_rating[0] else 0}
+        avg_rating = STORE.average_rating(data['product_id'])
+        response = {"average_rating": avg_rating if avg_rating else 0}
     except Exception as e:
         response = {"message": str(e)}
-    finally:
-        conn.close()
     return 'HTTP/1.1 200 OK\r\n\r\n' + json.dumps(response)
 
 
 # User registration
 def register_user(data):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
     try:
         hashed_password = hash_password(data['password'])
-        c.execute("INSERT INTO users (first_name, last_name, email, username, password) VALUES (?, ?, ?, ?, ?)",
-                  (data['first_name'], data['last_name'], data['email'], data['username'], hashed_password))
-        conn.commit()
+        STORE.create_user(data['first_name'], data['last_name'], data['email'], data['username'], hashed_password)
         return '{"message": "Registration successful. Please log in."}'
-    except sqlite3.IntegrityError:
+    except storage.DuplicateUser:
         return '{"message": "Username already exists"}'
-    finally:
-        conn.close()
 
 
 # User login
 def login_user(data):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
     hashed_password = hash_password(data['password'])
-    c.execute("SELECT id FROM users WHERE username = ? AND password = ?", (data['username'], hashed_password))
-    user = c.fetchone()
+    user_id = STORE.authenticate(data['username'], hashed_password)
     
-    if user:
+    if user_id:
         # Update online status, IP, and port
-        c.execute("UPDATE users SET online = 1, port = ?, ip_address = ? WHERE id = ?", 
-          (data['port'], data['ip_address'], user[0]))
-
-        conn.commit()
-        conn.close()
-        return json.dumps({"user_id": user[0], "message": "Login successful"})
+        STORE.set_online(user_id, data['port'], data['ip_address'])
+        return json.dumps({"user_id": user_id, "message": "Login successful"})
     
-    conn.close()
     return json.dumps({"message": "Invalid credentials"})
 
 def get_user_connection_info(data):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT ip_address, port FROM users WHERE username = ? AND online = 1", (data['username'],))
-    user_info = c.fetchone()
-    conn.close()
+    user = STORE.find_user(data['username'])
     
-    if user_info:
-        return json.dumps({"ip_address": user_info[0], "port": user_info[1]})
+    if user and user.online == 1:
+        return json.dumps({"ip_address": user.ip_address, "port": user.port})
     else:
         return '{"message": "User is not online"}'
 
 # User logout
 def logout_user(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("UPDATE users SET online = 0, port = NULL WHERE id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    STORE.set_offline(user_id)
     return '{"message": "Logout successful"}'
 
 # Add product
+# The owner picks the product's shard and its seller rollups, so a listing without one is refused
 def add_product(data):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO products (name, owner_id, category, price, description, image, quantity) VALUES (?, ?, ?, ?, ?, ?, ?)",
-              (data['name'], data['owner_id'], data['category'], data['price'], data['description'], data['image'], data['quantity']))
-    conn.commit()
-    conn.close()
+    try:
+        owner_id = int_param(data, 'owner_id')
+    except ValueError as e:
+        return bad_request(str(e))
+    if owner_id is None:
+        return bad_request("owner_id is required")
+    try:
+        product_id = STORE.add_product(owner_id, data['name'], data['category'], data['price'], data['description'],
+                                       data['image'], data['quantity'])
+        bump_catalogue_version()
+        LEADERBOARDS.add_product(product_id, data['name'], data['category'])
+        FACETS.add(product_id, data['category'], data['price'], int(data['quantity'] or 0) > 0)
+        if COLUMNS is not None:
+            COLUMNS.add(STORE.get_product(product_id))
+    except Exception as e:
+        return json.dumps({"message": str(e)})
     return '{"message": "Product added successfully"}'
 
 
 # Buy product
 def buy_product(data):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
     try:
-        # Check if product exists and has available quantity
-        c.execute("SELECT quantity FROM products WHERE id = ? AND buyer_id IS NULL", (data['product_id'],))
-        product = c.fetchone()
-        if product and product[0] > 0:
-            # Decrement quantity
-            new_quantity = product[0] - 1
+        # Decrement quantity if the product exists and is available
+        new_quantity = STORE.buy_product(data['product_id'], data['buyer_id'])
+        if new_quantity is not None:
+            bump_catalogue_version()
+            LEADERBOARDS.sell(int(data['product_id']))
             if new_quantity == 0:
-                # Mark as sold out by assigning a buyer_id
-                c.execute("UPDATE products SET buyer_id = ?, quantity = ? WHERE id = ?", (data['buyer_id'], new_quantity, data['product_id']))
-            else:
-                c.execute("UPDATE products SET quantity = ? WHERE id = ?", (new_quantity, data['product_id']))
-            conn.commit()
+                FACETS.set_in_stock(int(data['product_id']), False)
+            if COLUMNS is not None:
+                COLUMNS.sell(int(data['product_id']), new_quantity, int(data['buyer_id']))
             response = {"message": "Product purchase successful"}
         else:
             response = {"message": "Product not available or sold out"}
     except Exception as e:
         response = {"message": str(e)}
-    finally:
-        conn.close()
     return 'HTTP/1.1 200 OK\r\n\r\n' + json.dumps(response)
 
 # Search for products by name
-def search_product(search_term):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+def search_product(search_term, currency=None, fmt=None, after=None, limit=None, etag=None):
     try:
         # Search for products that match the search term
-        c.execute("SELECT * FROM products WHERE name LIKE ?", ('%' + search_term + '%',))
-        products = c.fetchall()
+        products = STORE.search_products(search_term, after, limit)
         
         # Structure the response data as JSON
-        response = [
-            {
-                "id": product[0],
-                "name": product[1],
-                "owner_id": product[2],
-                "category": product[3],
-                "price": product[4],
-                "description": product[5],
-                "image": product[6],
-                "quantity": product[7],
-                "buyer_id": product[8]
-            } 
-            for product in products
-        ]  
+        response = serialize_products(products, currency, fmt)
     except Exception as e:
         # Handle exceptions by returning an error message
-        response = {"message": str(e)}
-    finally:
-        # Ensure the database connection is closed
-        conn.close()
-    return 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n' + json.dumps(response)
+        return products_response({"message": str(e)})
+    return products_response(response, etag)
 
 # Search for all products by a specific user
-def search_user_products(username):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT id FROM users WHERE username = ?", (username,))
-    user = c.fetchone()
+def search_user_products(username, currency=None, fmt=None, etag=None):
+    user = STORE.find_user(username)
     if user:
         try:
-            c.execute("SELECT * FROM products WHERE owner_id = ?", (user[0],))
-            products = c.fetchall()
-            response = [
-                {
-                    "id": product[0],
-                    "name": product[1],
-                    "owner_id": product[2],
-                    "category": product[3],
-                    "price": product[4],
-                    "description": product[5],
-                    "image": product[6],
-                    "quantity": product[7],
-                    "buyer_id": product[8]
-                } 
-                for product in products
-            ]  
+            products = STORE.products_by_owner(user.id)
+            response = serialize_products(products, currency, fmt)
         except Exception as e:
             # Handle exceptions by returning an error message
-            response = {"message": str(e)}
-        finally:
-            # Ensure the database connection is closed
-            conn.close()
-        return 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n' + json.dumps(response)
+            return products_response({"message": str(e)})
+        return products_response(response, etag)
 
 
     else:
-        conn.close()
         return '{"error": "User not found"}'
 
 # Send a message to another user
 def send_message(data):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT id, online, port, username FROM users WHERE username = ?", (data['receiver_username'],))
-    receiver = c.fetchone()
-    
-    if receiver and receiver[1] == 1:  # Check if receiver is online
-        c.execute("INSERT INTO messages (sender_id, receiver_id, message) VALUES (?, ?, ?)",
-                  (data['sender_id'], receiver[0], data['message']))
-        conn.commit()
-        
-        receiver_port = receiver[2]
+    receiver = STORE.find_user(data['receiver_username'])
+
+    if receiver and receiver.online == 1:  # Check if receiver is online
+        STORE.append_message(data['sender_id'], receiver.id, data['message'])
+
+        receiver_port = receiver.port
         sender_username = data.get("sender_username", "Unknown")
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             try:
@@ -366,14 +778,250 @@ def send_message(data):
     else:
         return 'HTTP/1.1 200 OK\r\n\r\n{"message": "Receiver not online."}'
 
+# A conversation's history, newest first; page back with "before" set to the oldest timestamp seen
+def conversation_history(data):
+    try:
+        other = STORE.find_user(data['with_username'])
+        if other:
+            response = {"messages": STORE.conversation(data['user_id'], other.id, data.get('before'), data.get('after'),
+                                                       min(int(data.get('limit', 50)), 500))}
+        else:
+            response = {"message": "User not found"}
+    except Exception as e:
+        response = {"message": str(e)}
+    return 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n' + json.dumps(response)
+
+# Admin-triggered sampling profile of the live server
+def start_profiling(data):
+    if not ADMIN_TOKEN or data.get('token') != ADMIN_TOKEN:
+        return 'HTTP/1.1 403 Forbidden\r\nContent-Type: application/json\r\n\r\n{"message": "Forbidden"}'
+    output_path = profiler.start_profile(float(data.get('duration', 10)), float(data.get('interval_ms', 5)) / 1000)
+    if output_path is None:
+        return 'HTTP/1.1 409 Conflict\r\nContent-Type: application/json\r\n\r\n{"message": "A profile is already running"}'
+    return 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n' + json.dumps({"message": "Profiling started", "output": output_path})
+
+# Open/idle connection counts and how many connections were accepted, refused or reaped
+def connection_stats(data):
+    if not ADMIN_TOKEN or data.get('token') != ADMIN_TOKEN:
+        return 'HTTP/1.1 403 Forbidden\r\nContent-Type: application/json\r\n\r\n{"message": "Forbidden"}'
+    return 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n' + json.dumps(CONNECTIONS.stats())
+
+# Log entries after a replica's position; the position it sends is its applied position
+def replication_log(data):
+    if not ADMIN_TOKEN or data.get('token') != ADMIN_TOKEN:
+        return 'HTTP/1.1 403 Forbidden\r\nContent-Type: application/json\r\n\r\n{"message": "Forbidden"}'
+    if not REPLICATION:
+        return 'HTTP/1.1 404 Not Found\r\nContent-Type: application/json\r\n\r\n{"message": "Replication is not enabled"}'
+    after = int(data.get('after', 0))
+    REPLICAS.report(data.get('replica', 'unknown'), after)
+    conn = connect_db()
+    try:
+        position, entries = replication.read_log(conn, after, min(int(data.get('limit', 1000)), 10000))
+    except replication.LogGone as e:
+        return 'HTTP/1.1 410 Gone\r\nContent-Type: application/json\r\n\r\n' + json.dumps({"message": str(e)})
+    finally:
+        conn.close()
+    return 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n' + json.dumps({"position": position, "entries": entries})
+
+# The whole database as an SQLite file, for a replica to start from
+def replication_snapshot(data):
+    if not ADMIN_TOKEN or data.get('token') != ADMIN_TOKEN:
+        return 'HTTP/1.1 403 Forbidden\r\nContent-Type: application/json\r\n\r\n{"message": "Forbidden"}'
+    if not REPLICATION:
+        return 'HTTP/1.1 404 Not Found\r\nContent-Type: application/json\r\n\r\n{"message": "Replication is not enabled"}'
+    return b'HTTP/1.1 200 OK\r\nContent-Type: application/vnd.sqlite3\r\n\r\n' + replication.snapshot(DB_NAME)
+
+def replication_stats(data):
+    if not ADMIN_TOKEN or data.get('token') != ADMIN_TOKEN:
+        return 'HTTP/1.1 403 Forbidden\r\nContent-Type: application/json\r\n\r\n{"message": "Forbidden"}'
+    if REPLICA:
+        response = REPLICA.stats()
+    elif REPLICATION:
+        conn = connect_db()
+        try:
+            position = replication.log_position(conn)
+        finally:
+            conn.close()
+        response = {"role": "primary", "position": position,
+                    "replicas": {replica_id: {"position": applied, "lag": position - applied} for replica_id, applied in REPLICAS.live().items()}}
+    else:
+        response = {"role": "standalone"}
+    return 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n' + json.dumps(response)
+
+# Drop log entries every live replica has applied, keeping at most REPLICATION_LOG_KEEP; a replica
+# that falls further behind gets 410 and starts again from a snapshot
+def start_log_truncation(stopped, interval=10):
+    def run():
+        while not stopped.wait(interval):
+            conn = connect_db()
+            try:
+                position = replication.log_position(conn)
+                up_to = max(min(REPLICAS.live().values(), default=position), position - REPLICATION_LOG_KEEP)
+                replication.truncate_log(conn, up_to)
+            except Exception as e:
+                print(f"Error truncating replication log: {e}")
+            finally:
+                conn.close()
+
+    threading.Thread(target=run, daemon=True).start()
+
+# Keep a replica's in-memory indexes and ETags in step with the rows it replays
+def replica_applied(entries):
+    if entries is None:
+        bump_catalogue_version()
+        load_leaderboards()
+        load_facets()
+        load_columns()
+        return
+    tables = {entry[1] for entry in entries}
+    if tables & {'products', 'product_ratings', 'purchases'}:
+        bump_catalogue_version()
+        load_leaderboards()
+        load_columns()
+    if 'products' in tables:
+        load_facets()
+    for _, table, op, _, row in entries:
+        if table == 'product_ratings' and row:
+            RECOMMENDER.record(row['user_id'], row['product_id'], row['rating'])
+
+# Refuse a connection over the caps without spending a thread on it
+def refuse_connection(conn):
+    with conn:
+        try:
+            conn.setblocking(False)
+            conn.send(frame_response(rejected('503 Service Unavailable', "Too many connections", OVERLOAD_RETRY_AFTER)))
+        except OSError:
+            pass
+
+class ShuttingDown(Exception):
+    pass
+
+def request_shutdown(signum, frame):
+    raise ShuttingDown()
+
+# A server this process can start and stop: `python server.py` runs one in the foreground, tests and
+# benchmarks start one in a thread. Handlers share this module's state, so one Server runs per
+# process at a time. `db_path` replaces AUBOUTIQUE_DB and keeps chat partitions, shards and images
+# next to the database; port 0 listens on a free port, read back from `server.port` once open.
+class Server:
+    def __init__(self, db_path=None, host='localhost', port=0, storage_kind=None, shard_count=None):
+        self.db_path = db_path
+        self.host = host
+        self.port = port
+        self.storage_kind = storage_kind or os.environ.get('AUBOUTIQUE_STORAGE', 'sqlite')
+        self.shard_count = shard_count or int(os.environ.get('AUBOUTIQUE_SHARDS', 1))
+        self.socket = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    # Bind, set up storage and load the in-memory indexes; requests are accepted from serve_forever()
+    def open(self):
+        global DB_NAME, STORE, IMAGES, CONNECTIONS, RECOMMENDER, CATALOGUE_EPOCH
+        if self.db_path:
+            root = os.path.dirname(os.path.abspath(self.db_path))
+            DB_NAME = self.db_path
+            STORE = storage.open_storage(self.storage_kind, DB_NAME, self.shard_count,
+                                         message_store.MessageStore(os.path.join(root, 'messages')), os.path.join(root, 'shards'))
+            IMAGES = image_store.ImageStore(os.path.join(root, 'images'))
+        else:
+            STORE = storage.open_storage(self.storage_kind, DB_NAME, self.shard_count)
+        if not STORE.replicable and (REPLICATION or REPLICA_OF):
+            raise SystemExit("Replication works on unsharded SQLite storage only; unset AUBOUTIQUE_SHARDS, AUBOUTIQUE_STORAGE or replication")
+        # Fresh connection accounting, similarity index and ETag epoch, in case a server ran before
+        CONNECTIONS = connections.ConnectionManager(CONNECTIONS.max_connections, CONNECTIONS.max_per_ip)
+        RECOMMENDER = recommender.SimilarityIndex(RECOMMENDER.k, RECOMMENDER.min_common)
+        CATALOGUE_EPOCH = format(int(time.time() * 1000), 'x')
+        # A new event for each run; threads of a previous run keep the one that stopped them
+        self.stopped = threading.Event()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            # Connections of a previous run in TIME_WAIT must not keep a restart off its port
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind((self.host, self.port))
+            self.port = self.socket.getsockname()[1]
+            self.setup()
+        except BaseException:
+            self.socket.close()
+            raise
+        self.socket.listen()
+        # accept() wakes up twice a second so stop() can end the loop
+        self.socket.settimeout(0.5)
+        print(f"Server running on {self.host}:{self.port}")
+        return self
+
+    # Storage, the in-memory indexes and background workers, once the port is known
+    def setup(self):
+        global REPLICA
+        REPLICA = None
+        if REPLICA_OF:
+            REPLICA = replication.Replica(REPLICA_OF, DB_NAME, ADMIN_TOKEN, os.environ.get('AUBOUTIQUE_REPLICA_ID', f"{self.host}:{self.port}"),
+                                          float(os.environ.get('AUBOUTIQUE_REPLICA_POLL_INTERVAL', 0.05)))
+            REPLICA.prepare()
+        STORE.setup(REPLICATION)
+        STORE.start_maintenance(MESSAGE_MAINTENANCE_INTERVAL)
+        load_leaderboards()
+        load_facets()
+        load_columns()
+        RECOMMENDER.start(load_ratings, SIMILAR_REBUILD_INTERVAL)
+        if REPLICA:
+            REPLICA.on_apply = replica_applied
+            REPLICA.start()
+        elif REPLICATION:
+            start_log_truncation(self.stopped)
+
+    def serve_forever(self):
+        with self.socket:
+            while not self.stopped.is_set():
+                try:
+                    conn, addr = self.socket.accept()
+                except socket.timeout:
+                    continue
+                if not CONNECTIONS.register(conn, addr):
+                    refuse_connection(conn)
+                    continue
+                threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+
+    # Open and serve from a background thread
+    def start(self):
+        self.open()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    # Stop accepting, drain open connections and stop the background workers
+    def stop(self, drain_timeout=DRAIN_TIMEOUT):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        # Opened but never served, the listening socket is still open
+        if self.socket:
+            self.socket.close()
+        CONNECTIONS.drain(drain_timeout)
+        RECOMMENDER.stop()
+        STORE.stop_maintenance()
+        if REPLICA:
+            REPLICA.stop()
+        print(f"Connection stats: {CONNECTIONS.stats()}")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
 def start_server(host='localhost', port=8080):
-    setup_database()
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((host, port))
-        s.listen()
-        print(f"Server running on {host}:{port}")
-        while True:
-            conn, addr = s.accept()
-            threading.Thread(target=handle_client, args=(conn, addr)).start()
-
-start_server()
+    server = Server(host=host, port=port).open()
+    # `kill -USR1 <pid>` samples the server for 10 seconds
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.start_profile())
+    signal.signal(signal.SIGTERM, request_shutdown)
+    try:
+        server.serve_forever()
+    except (ShuttingDown, KeyboardInterrupt):
+        print("Shutting down, draining connections")
+    server.stop()
+
+if __name__ == '__main__':
+    start_server(os.environ.get('AUBOUTIQUE_HOST', 'localhost'), int(os.environ.get('AUBOUTIQUE_PORT', 8080)))
+
@@ -0,0 +1,61 @@
+import os
+import zlib
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+# Products, their ratings and purchases partitioned across SQLite files by a hash of owner_id,
+# so catalogue writes for different sellers take different write locks. A product id encodes its
+# shard (id % count == shard), so rating, buying or looking up a product opens one file; listings
+# and searches run on every shard in parallel and are merged by id. With one shard the "shard" is
+# the main database and nothing changes. The shard count is fixed once data has been written.
+SHARD_DIR = os.environ.get('AUBOUTIQUE_SHARD_DIR', 'shards')
+
+
+class ShardSet:
+    def __init__(self, count, main_db, connect, root=SHARD_DIR):
+        self.count = max(count, 1)
+        self.connect_db = connect
+        self.paths = [main_db] if self.count == 1 else [os.path.join(root, f"shard-{i}.db") for i in range(self.count)]
+        self.root = root
+        # SQLite releases the GIL while a query runs, so shards are searched concurrently
+        self.executor = ThreadPoolExecutor(max_workers=self.count) if self.count > 1 else None
+
+    def for_owner(self, owner_id):
+        return zlib.crc32(str(int(owner_id)).encode('utf-8')) % self.count
+
+    def for_product(self, product_id):
+        return int(product_id) % self.count
+
+    def connect(self, shard):
+        if self.count > 1:
+            os.makedirs(self.root, exist_ok=True)
+        return self.connect_db(self.paths[shard])
+
+    # SQL for the next product id in a shard, with its two arguments: ids step by the shard count
+    def next_id(self, shard):
+        return "(SELECT COALESCE(MAX(id), ?) + ? FROM products)", (shard, self.count)
+
+    def map(self, func):
+        """func(conn, shard) on every shard, concurrently; results in shard order."""
+        def run(shard):
+            conn = self.connect(shard)
+            try:
+                return func(conn, shard)
+            finally:
+                conn.close()
+
+        if self.executor is None:
+            return [run(0)]
+        return list(self.executor.map(run, range(self.count)))
+
+    def query_all(self, sql, args=()):
+        return [row for rows in self.map(lambda conn, shard: conn.execute(sql, args).fetchall()) for row in rows]
+
+    def merge(self, sql, args=(), limit=None):
+        """Rows of `sql` (which must end in ORDER BY id) from every shard, merged in id order.
+        With a limit each shard returns at most `limit` rows, which is all the merge can use."""
+        if limit is not None:
+            sql, args = sql + " LIMIT ?", list(args) + [limit]
+        results = self.map(lambda conn, shard: conn.execute(sql, args).fetchall())
+        return list(itertools.islice(heapq.merge(*results, key=lambda row: row[0]), limit))
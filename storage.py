@@ -0,0 +1,858 @@
+import os
+import time
+import sqlite3
+import string
+import bisect
+import heapq
+import itertools
+import threading
+from operator import itemgetter
+from collections import namedtuple, defaultdict
+
+import profiler
+import facets
+import shards
+import replication
+import message_store
+
+# Storage behind the server's handlers: users, products, ratings, purchases and messages.
+# SQLiteStorage is the production backend (optionally sharded, messages in the message store).
+# MemoryStorage keeps everything in Python objects, for measuring the protocol layer without
+# storage cost; it can start from a copy of an SQLite database. Both return the same values:
+# product rows are tuples in `products` column order (PRODUCT_FIELDS), users are User tuples.
+# tests/test_storage.py checks that the backends agree.
+PRODUCT_FIELDS = ('id', 'name', 'owner_id', 'category', 'price', 'description', 'image', 'quantity', 'buyer_id')
+User = namedtuple('User', 'id username online port ip_address')
+
+
+class DuplicateUser(Exception):
+    pass
+
+
+class StorageError(Exception):
+    pass
+
+
+# A delta-sync position this storage did not hand out (another shard layout, or not a position)
+class UnknownPosition(StorageError):
+    pass
+
+
+# Delta-sync positions: the last change seq seen, or with shards one seq per shard joined by dots
+def parse_position(since, count):
+    if not since:
+        return [0] * count
+    parts = str(since).split('.')
+    if len(parts) != count or not all(part.isdigit() for part in parts):
+        raise UnknownPosition(f"Unknown sync position {since}")
+    return [int(part) for part in parts]
+
+
+def format_position(positions):
+    return positions[0] if len(positions) == 1 else '.'.join(map(str, positions))
+
+
+# LIKE pattern matching `term` literally anywhere in a value
+def like_pattern(term):
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+# SQLite's LIKE ignores case for ASCII letters only; the memory backend folds case the same way
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def ascii_lower(text):
+    return text.translate(ASCII_LOWER)
+
+
+def since_day(days):
+    return time.strftime('%Y-%m-%d', time.gmtime(time.time() - int(days) * 86400))
+
+
+def create_catalogue_tables(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS products (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT,
+                    owner_id INTEGER,
+                    category TEXT,
+                    price REAL,
+                    description TEXT,
+                    image TEXT,
+                    quantity INTEGER DEFAULT 1,
+                    buyer_id INTEGER DEFAULT NULL,
+                    FOREIGN KEY (owner_id) REFERENCES users (id),
+                    FOREIGN KEY (buyer_id) REFERENCES users (id)
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS products_category ON products (category)")
+    c.execute('''CREATE TABLE IF NOT EXISTS product_ratings (
+                    id INTEGER PRIMARY KEY,
+                    product_id INTEGER,
+                    user_id INTEGER,
+                    rating INTEGER CHECK (rating >= 1 AND rating <= 5),
+                    FOREIGN KEY (product_id) REFERENCES products (id),
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    UNIQUE(product_id, user_id)
+                )''')
+    # One row per unit sold, for best-seller counts
+    c.execute('''CREATE TABLE IF NOT EXISTS purchases (
+                    id INTEGER PRIMARY KEY,
+                    product_id INTEGER,
+                    buyer_id INTEGER,
+                    price REAL,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (product_id) REFERENCES products (id),
+                    FOREIGN KEY (buyer_id) REFERENCES users (id)
+                )''')
+
+
+# Seller rollups and the product change log, maintained by triggers on the catalogue tables
+def setup_catalogue(c):
+    setup_seller_rollups(c)
+    # Change log for delta sync: every product insert/update/delete and rating write appends
+    # the product id with a monotonic sequence number
+    c.execute('''CREATE TABLE IF NOT EXISTS product_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    product_id INTEGER
+                )''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS products_insert_log AFTER INSERT ON products
+                 BEGIN INSERT INTO product_changes (product_id) VALUES (NEW.id); END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS products_update_log AFTER UPDATE ON products
+                 BEGIN INSERT INTO product_changes (product_id) VALUES (NEW.id); END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS products_delete_log AFTER DELETE ON products
+                 BEGIN INSERT INTO product_changes (product_id) VALUES (OLD.id); END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS ratings_insert_log AFTER INSERT ON product_ratings
+                 BEGIN INSERT INTO product_changes (product_id) VALUES (NEW.product_id); END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS ratings_update_log AFTER UPDATE ON product_ratings
+                 BEGIN INSERT INTO product_changes (product_id) VALUES (NEW.product_id); END''')
+    # Databases created before the change log existed: log every product once
+    c.execute('''INSERT INTO product_changes (product_id)
+                 SELECT id FROM products WHERE NOT EXISTS (SELECT 1 FROM product_changes)''')
+    # Only the latest change per product matters to a replica, so older entries are dropped
+    c.execute('''DELETE FROM product_changes
+                 WHERE seq NOT IN (SELECT MAX(seq) FROM product_changes GROUP BY product_id)''')
+
+
+# Per-seller rollups for the seller dashboard, maintained by triggers in the same transaction as
+# each purchase, rating and listing change: running totals in seller_stats and daily buckets
+# (UTC days) in seller_daily_stats
+def setup_seller_rollups(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS seller_stats (
+                    owner_id INTEGER PRIMARY KEY,
+                    units_sold INTEGER DEFAULT 0,
+                    revenue REAL DEFAULT 0,
+                    rating_count INTEGER DEFAULT 0,
+                    rating_sum INTEGER DEFAULT 0,
+                    active_listings INTEGER DEFAULT 0
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS seller_daily_stats (
+                    owner_id INTEGER,
+                    day TEXT,
+                    units_sold INTEGER DEFAULT 0,
+                    revenue REAL DEFAULT 0,
+                    new_ratings INTEGER DEFAULT 0,
+                    PRIMARY KEY (owner_id, day)
+                )''')
+    active = "(COALESCE({0}.quantity, 0) > 0 AND {0}.buyer_id IS NULL)"
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS seller_listing_insert AFTER INSERT ON products
+                  BEGIN
+                      INSERT INTO seller_stats (owner_id, active_listings) VALUES (NEW.owner_id, {active.format('NEW')})
+                      ON CONFLICT (owner_id) DO UPDATE SET active_listings = active_listings + excluded.active_listings;
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS seller_listing_update AFTER UPDATE ON products
+                  BEGIN
+                      UPDATE seller_stats SET active_listings = active_listings - {active.format('OLD')} WHERE owner_id = OLD.owner_id;
+                      INSERT INTO seller_stats (owner_id, active_listings) VALUES (NEW.owner_id, {active.format('NEW')})
+                      ON CONFLICT (owner_id) DO UPDATE SET active_listings = active_listings + excluded.active_listings;
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS seller_listing_delete AFTER DELETE ON products
+                  BEGIN
+                      UPDATE seller_stats SET active_listings = active_listings - {active.format('OLD')} WHERE owner_id = OLD.owner_id;
+                  END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS seller_purchase AFTER INSERT ON purchases
+                 BEGIN
+                     INSERT INTO seller_stats (owner_id, units_sold, revenue)
+                     SELECT owner_id, 1, COALESCE(NEW.price, 0) FROM products WHERE id = NEW.product_id
+                     ON CONFLICT (owner_id) DO UPDATE SET units_sold = units_sold + 1, revenue = revenue + excluded.revenue;
+                     INSERT INTO seller_daily_stats (owner_id, day, units_sold, revenue)
+                     SELECT owner_id, date(NEW.timestamp), 1, COALESCE(NEW.price, 0) FROM products WHERE id = NEW.product_id
+                     ON CONFLICT (owner_id, day) DO UPDATE SET units_sold = units_sold + 1, revenue = revenue + excluded.revenue;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS seller_rating_insert AFTER INSERT ON product_ratings
+                 BEGIN
+                     INSERT INTO seller_stats (owner_id, rating_count, rating_sum)
+                     SELECT owner_id, 1, NEW.rating FROM products WHERE id = NEW.product_id
+                     ON CONFLICT (owner_id) DO UPDATE SET rating_count = rating_count + 1, rating_sum = rating_sum + excluded.rating_sum;
+                     INSERT INTO seller_daily_stats (owner_id, day, new_ratings)
+                     SELECT owner_id, date('now'), 1 FROM products WHERE id = NEW.product_id
+                     ON CONFLICT (owner_id, day) DO UPDATE SET new_ratings = new_ratings + 1;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS seller_rating_update AFTER UPDATE ON product_ratings
+                 BEGIN
+                     UPDATE seller_stats SET rating_sum = rating_sum + NEW.rating - OLD.rating
+                     WHERE owner_id = (SELECT owner_id FROM products WHERE id = NEW.product_id);
+                 END''')
+    # Databases created before the rollups existed: compute the totals once from the raw tables
+    c.execute(f'''INSERT INTO seller_stats (owner_id, units_sold, revenue, rating_count, rating_sum, active_listings)
+                  SELECT p.owner_id,
+                         (SELECT COUNT(*) FROM purchases s JOIN products q ON q.id = s.product_id WHERE q.owner_id = p.owner_id),
+                         (SELECT COALESCE(SUM(s.price), 0) FROM purchases s JOIN products q ON q.id = s.product_id WHERE q.owner_id = p.owner_id),
+                         (SELECT COUNT(*) FROM product_ratings r JOIN products q ON q.id = r.product_id WHERE q.owner_id = p.owner_id),
+                         (SELECT COALESCE(SUM(r.rating), 0) FROM product_ratings r JOIN products q ON q.id = r.product_id WHERE q.owner_id = p.owner_id),
+                         SUM({active.format('p')})
+                  FROM products p
+                  WHERE NOT EXISTS (SELECT 1 FROM seller_stats)
+                  GROUP BY p.owner_id''')
+    c.execute('''INSERT INTO seller_daily_stats (owner_id, day, units_sold, revenue)
+                 SELECT q.owner_id, date(s.timestamp), COUNT(*), COALESCE(SUM(s.price), 0)
+                 FROM purchases s JOIN products q ON q.id = s.product_id
+                 WHERE NOT EXISTS (SELECT 1 FROM seller_daily_stats)
+                 GROUP BY q.owner_id, date(s.timestamp)''')
+
+
+IN_STOCK = "COALESCE(quantity, 0) > 0 AND buyer_id IS NULL"
+
+
+# WHERE clause and arguments for facet filters (see facets.parse_filters)
+def facet_clause(filters):
+    clauses, args = [], []
+    if 'category' in filters:
+        clauses.append("category = ?")
+        args.append(filters['category'])
+    if 'price' in filters:
+        low, high = facets.price_range(filters['price'])
+        clauses.append("COALESCE(price, 0) >= ?")
+        args.append(low)
+        if high is not None:
+            clauses.append("COALESCE(price, 0) < ?")
+            args.append(high)
+    if 'in_stock' in filters:
+        clauses.append(IN_STOCK if filters['in_stock'] else f"NOT ({IN_STOCK})")
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), args
+
+
+# Add the keyset pagination condition (id > after) to a WHERE clause
+def page_clause(where, args, after=None):
+    if after is None:
+        return where, args
+    return where + (" AND" if where else " WHERE") + " id > ?", args + [int(after)]
+
+
+class SQLiteStorage:
+    def __init__(self, db_path, shard_count=1, messages=None, shard_dir=shards.SHARD_DIR):
+        self.db_path = db_path
+        self.shards = shards.ShardSet(shard_count, db_path, profiler.connect, shard_dir)
+        self.messages = messages or message_store.MessageStore()
+        # Replication ships the main database file, so it needs the catalogue in it
+        self.replicable = self.shards.count == 1
+
+    def connect(self):
+        return profiler.connect(self.db_path)
+
+    def setup(self, replication_log=False):
+        conn = self.connect()
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS users (
+                        id INTEGER PRIMARY KEY,
+                        first_name TEXT,
+                        last_name TEXT,
+                        email TEXT,
+                        username TEXT UNIQUE,
+                        password TEXT,
+                        online INTEGER DEFAULT 0,
+                        port INTEGER DEFAULT NULL,
+                        ip_address TEXT DEFAULT NULL
+                    )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS messages (
+                        id INTEGER PRIMARY KEY,
+                        sender_id INTEGER,
+                        receiver_id INTEGER,
+                        message TEXT,
+                        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (sender_id) REFERENCES users (id),
+                        FOREIGN KEY (receiver_id) REFERENCES users (id)
+                    )''')
+        # Unsharded, the catalogue lives here; sharded, these tables are only read once to move old rows into the shards
+        create_catalogue_tables(c)
+        if self.shards.count == 1:
+            setup_catalogue(c)
+        if replication_log:
+            replication.install_log(c)
+        else:
+            replication.remove_log(c)
+        conn.commit()
+        conn.close()
+        if self.shards.count > 1:
+            moved = sum(self.shards.map(self.setup_shard))
+            if moved:
+                conn = self.connect()
+                for table in ('products', 'product_ratings', 'purchases', 'product_changes', 'seller_stats', 'seller_daily_stats'):
+                    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+                        conn.execute(f"DELETE FROM {table}")
+                conn.commit()
+                conn.close()
+                print(f"Moved {moved} products into {self.shards.count} shards")
+        self.migrate_messages()
+
+    def setup_shard(self, conn, shard):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, self.shards.count):
+            raise RuntimeError(f"Shard {shard} belongs to a set of {version} shards, not {self.shards.count}")
+        conn.execute(f"PRAGMA user_version = {self.shards.count}")
+        c = conn.cursor()
+        create_catalogue_tables(c)
+        moved = self.migrate_to_shard(conn, shard)
+        setup_catalogue(c)
+        conn.commit()
+        return moved
+
+    # Copy this shard's share of an unsharded catalogue from the main database, before the rollup
+    # triggers exist so the rollups are backfilled exactly as they would be unsharded. Ids are
+    # re-encoded as old id * count + shard.
+    def migrate_to_shard(self, conn, shard):
+        if conn.execute("SELECT 1 FROM products LIMIT 1").fetchone():
+            return 0
+        conn.create_function('shard_for_owner', 1, lambda owner_id: self.shards.for_owner(owner_id or 0))
+        conn.execute("ATTACH DATABASE ? AS unsharded", (self.db_path,))
+        count = self.shards.count
+        moved = conn.execute(f'''INSERT INTO products (id, name, owner_id, category, price, description, image, quantity, buyer_id)
+                                 SELECT id * {count} + ?, name, owner_id, category, price, description, image, quantity, buyer_id
+                                 FROM unsharded.products WHERE shard_for_owner(owner_id) = ?''', (shard, shard)).rowcount
+        conn.execute(f'''INSERT INTO product_ratings (product_id, user_id, rating)
+                         SELECT r.product_id * {count} + ?, r.user_id, r.rating
+                         FROM unsharded.product_ratings r JOIN unsharded.products p ON p.id = r.product_id
+                         WHERE shard_for_owner(p.owner_id) = ?''', (shard, shard))
+        conn.execute(f'''INSERT INTO purchases (product_id, buyer_id, price, timestamp)
+                         SELECT s.product_id * {count} + ?, s.buyer_id, s.price, s.timestamp
+                         FROM unsharded.purchases s JOIN unsharded.products p ON p.id = s.product_id
+                         WHERE shard_for_owner(p.owner_id) = ?''', (shard, shard))
+        conn.commit()
+        conn.execute("DETACH DATABASE unsharded")
+        return moved
+
+    # Messages written to the catalogue database before the message store existed are moved over once
+    def migrate_messages(self):
+        conn = self.connect()
+        try:
+            rows = conn.execute("SELECT sender_id, receiver_id, message, timestamp FROM messages ORDER BY id").fetchall()
+            if rows:
+                self.messages.append_many(rows)
+                conn.execute("DELETE FROM messages")
+                conn.commit()
+                print(f"Moved {len(rows)} messages to the message store")
+        finally:
+            conn.close()
+
+    def start_maintenance(self, interval):
+        self.messages.start_maintenance(interval)
+
+    def stop_maintenance(self):
+        self.messages.stop_maintenance()
+
+    # Users
+
+    def create_user(self, first_name, last_name, email, username, password):
+        conn = self.connect()
+        try:
+            c = conn.cursor()
+            c.execute("INSERT INTO users (first_name, last_name, email, username, password) VALUES (?, ?, ?, ?, ?)",
+                      (first_name, last_name, email, username, password))
+            conn.commit()
+            return c.lastrowid
+        except sqlite3.IntegrityError:
+            raise DuplicateUser(username)
+        finally:
+            conn.close()
+
+    def authenticate(self, username, password):
+        conn = self.connect()
+        try:
+            user = conn.execute("SELECT id FROM users WHERE username = ? AND password = ?", (username, password)).fetchone()
+            return user[0] if user else None
+        finally:
+            conn.close()
+
+    def set_online(self, user_id, port, ip_address):
+        conn = self.connect()
+        try:
+            conn.execute("UPDATE users SET online = 1, port = ?, ip_address = ? WHERE id = ?", (port, ip_address, user_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def set_offline(self, user_id):
+        conn = self.connect()
+        try:
+            conn.execute("UPDATE users SET online = 0, port = NULL WHERE id = ?", (user_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def find_user(self, username):
+        conn = self.connect()
+        try:
+            row = conn.execute("SELECT id, username, online, port, ip_address FROM users WHERE username = ?", (username,)).fetchone()
+            return User(*row) if row else None
+        finally:
+            conn.close()
+
+    # Products
+
+    def add_product(self, owner_id, name, category, price, description, image, quantity):
+        shard = self.shards.for_owner(owner_id)
+        next_id, id_args = self.shards.next_id(shard)
+        conn = self.shards.connect(shard)
+        try:
+            c = conn.cursor()
+            c.execute(f"INSERT INTO products (id, name, owner_id, category, price, description, image, quantity) VALUES ({next_id}, ?, ?, ?, ?, ?, ?, ?)",
+                      id_args + (name, owner_id, category, price, description, image, quantity))
+            conn.commit()
+            return c.lastrowid
+        finally:
+            conn.close()
+
+    def get_product(self, product_id):
+        conn = self.shards.connect(self.shards.for_product(product_id))
+        try:
+            return conn.execute("SELECT * FROM products WHERE id = ?", (product_id,)).fetchone()
+        finally:
+            conn.close()
+
+    # Products matching facet filters in id order; the next page starts after the last id returned
+    def list_products(self, filters=None, after=None, limit=None):
+        where, args = page_clause(*facet_clause(filters or {}), after)
+        return self.shards.merge("SELECT * FROM products" + where + " ORDER BY id", args, limit)
+
+    def search_products(self, term, after=None, limit=None):
+        where, args = page_clause(" WHERE name LIKE ? ESCAPE '\\'", [like_pattern(term)], after)
+        return self.shards.merge("SELECT * FROM products" + where + " ORDER BY id", args, limit)
+
+    def products_by_owner(self, owner_id):
+        # All of a seller's products are in one shard
+        conn = self.shards.connect(self.shards.for_owner(owner_id))
+        try:
+            return conn.execute("SELECT * FROM products WHERE owner_id = ? ORDER BY id", (owner_id,)).fetchall()
+        finally:
+            conn.close()
+
+    def all_products(self):
+        return sorted(self.shards.query_all("SELECT * FROM products"))
+
+    # Sell one unit; returns the quantity left, or None when the product is unavailable. The stock
+    # check is part of the UPDATE, so of two concurrent buyers of the last unit only one matches a
+    # row; the purchase row is written in the same transaction.
+    def buy_product(self, product_id, buyer_id):
+        conn = self.shards.connect(self.shards.for_product(product_id))
+        try:
+            c = conn.cursor()
+            # The last unit also marks the product sold out by assigning a buyer_id
+            c.execute('''UPDATE products SET quantity = quantity - 1, buyer_id = CASE WHEN quantity = 1 THEN ? END
+                         WHERE id = ? AND quantity > 0 AND buyer_id IS NULL''', (buyer_id, product_id))
+            if c.rowcount == 0:
+                conn.rollback()
+                return None
+            c.execute("INSERT INTO purchases (product_id, buyer_id, price) VALUES (?, ?, (SELECT price FROM products WHERE id = ?))",
+                      (product_id, buyer_id, product_id))
+            new_quantity = c.execute("SELECT quantity FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+            conn.commit()
+            return new_quantity
+        finally:
+            conn.close()
+
+    # Ratings and sales
+
+    # Insert or update a user's rating; returns their previous rating or None
+    def rate_product(self, product_id, user_id, rating):
+        conn = self.shards.connect(self.shards.for_product(product_id))
+        try:
+            c = conn.cursor()
+            c.execute("SELECT rating FROM product_ratings WHERE product_id = ? AND user_id = ?", (product_id, user_id))
+            previous = c.fetchone()
+            c.execute('''
+                INSERT INTO product_ratings (product_id, user_id, rating)
+                VALUES (?, ?, ?)
+                ON CONFLICT(product_id, user_id) DO UPDATE SET rating = excluded.rating
+            ''', (product_id, user_id, rating))
+            conn.commit()
+            return previous[0] if previous else None
+        except sqlite3.IntegrityError:
+            raise StorageError("Rating must be between 1 and 5")
+        finally:
+            conn.close()
+
+    def average_rating(self, product_id):
+        conn = self.shards.connect(self.shards.for_product(product_id))
+        try:
+            return conn.execute("SELECT AVG(rating) FROM product_ratings WHERE product_id = ?", (product_id,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def all_ratings(self):
+        return self.shards.query_all("SELECT user_id, product_id, rating FROM product_ratings")
+
+    # (product_id, rating sum, rating count) and (product_id, units sold); a product's ratings and
+    # purchases are in its own shard, so per-shard groups are complete
+    def rating_totals(self):
+        return self.shards.query_all("SELECT product_id, SUM(rating), COUNT(*) FROM product_ratings GROUP BY product_id")
+
+    def sales_totals(self):
+        return self.shards.query_all("SELECT product_id, COUNT(*) FROM purchases GROUP BY product_id")
+
+    # ((units sold, revenue, rating count, rating sum, active listings), [(day, units, revenue, new ratings), ...])
+    def seller_stats(self, owner_id, days=30):
+        # The seller's rollups are in the shard holding their products
+        conn = self.shards.connect(self.shards.for_owner(owner_id or 0))
+        try:
+            totals = conn.execute("SELECT units_sold, revenue, rating_count, rating_sum, active_listings FROM seller_stats WHERE owner_id = ?",
+                                  (owner_id,)).fetchone() or (0, 0, 0, 0, 0)
+            daily = conn.execute('''SELECT day, units_sold, revenue, new_ratings FROM seller_daily_stats
+                                    WHERE owner_id = ? AND day >= ? ORDER BY day''', (owner_id, since_day(days))).fetchall()
+            return tuple(totals), daily
+        finally:
+            conn.close()
+
+    def product_changes(self, since, limit):
+        """([(product_id, seq), ...] changed after position `since`, at most `limit`; their current rows
+        in id order with average rating and rating count appended; whether more changes follow; the
+        position to continue from). Each shard logs its own changes, so with shards a position holds
+        one seq per shard and a page takes a prefix of every shard's log."""
+        positions = parse_position(since, self.shards.count)
+        logs = self.shards.map(lambda conn, shard: conn.execute(
+            '''SELECT MAX(seq) AS last_seq, product_id FROM product_changes
+               WHERE seq > ? GROUP BY product_id ORDER BY last_seq LIMIT ?''', (positions[shard], limit + 1)).fetchall())
+        # Merging the logs by seq and cutting at `limit` leaves a prefix of each one
+        taken = list(itertools.islice(heapq.merge(*[[(seq, shard, product_id) for seq, product_id in log]
+                                                    for shard, log in enumerate(logs)]), limit + 1))
+        more = len(taken) > limit
+        changed = []
+        ids = [[] for _ in range(self.shards.count)]
+        for seq, shard, product_id in taken[:limit]:
+            positions[shard] = seq
+            changed.append((product_id, seq))
+            ids[shard].append(product_id)
+        rows = sorted(row for rows in self.shards.map(lambda conn, shard: self.changed_rows(conn, ids[shard])) for row in rows)
+        return changed, rows, more, format_position(positions)
+
+    @staticmethod
+    def changed_rows(conn, ids):
+        rows = []
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows.extend(conn.execute(f'''SELECT p.*, AVG(r.rating), COUNT(r.id) FROM products p
+                                         LEFT JOIN product_ratings r ON r.product_id = p.id
+                                         WHERE p.id IN ({','.join('?' * len(chunk))}) GROUP BY p.id''', chunk))
+        return rows
+
+    # Messages
+
+    def append_message(self, sender_id, receiver_id, message):
+        self.messages.append(sender_id, receiver_id, message)
+
+    def conversation(self, user_a, user_b, before=None, after=None, limit=50):
+        return self.messages.history(user_a, user_b, before, after, limit)
+
+
+class UserRecord:
+    __slots__ = ('id', 'first_name', 'last_name', 'email', 'username', 'password', 'online', 'port', 'ip_address')
+
+    def __init__(self, id, first_name, last_name, email, username, password, online=0, port=None, ip_address=None):
+        self.id, self.first_name, self.last_name, self.email, self.username = id, first_name, last_name, email, username
+        self.password, self.online, self.port, self.ip_address = password, online, port, ip_address
+
+
+class ProductRecord:
+    __slots__ = PRODUCT_FIELDS
+
+    def __init__(self, id, name, owner_id, category, price, description, image, quantity=1, buyer_id=None):
+        self.id, self.name, self.owner_id, self.category, self.price = id, name, owner_id, category, price
+        self.description, self.image, self.quantity, self.buyer_id = description, image, quantity, buyer_id
+
+    def row(self):
+        return (self.id, self.name, self.owner_id, self.category, self.price, self.description, self.image,
+                self.quantity, self.buyer_id)
+
+    def in_stock(self):
+        return (self.quantity or 0) > 0 and self.buyer_id is None
+
+
+# Column affinity as SQLite applies it: numeric text becomes a number, anything else is kept as is
+def affinity(value, kind):
+    try:
+        return kind(value) if value is not None else None
+    except (TypeError, ValueError):
+        return value
+
+
+class MemoryStorage:
+    def __init__(self, source=None):
+        self.lock = threading.Lock()
+        self.users = {}
+        self.usernames = {}
+        self.last_user_id = 0
+        # Products by id, plus sorted id lists overall, per category and per owner (ids only grow)
+        self.products = {}
+        self.product_ids = []
+        self.by_category = defaultdict(list)
+        self.by_owner = defaultdict(list)
+        # (product_id, user_id) -> rating, and per-product rating sum, rating count and units sold
+        self.ratings = {}
+        self.rating_sums = defaultdict(int)
+        self.rating_counts = defaultdict(int)
+        self.units_sold = defaultdict(int)
+        # owner_id -> [units sold, revenue, rating count, rating sum, active listings];
+        # (owner_id, day) -> [units sold, revenue, new ratings]
+        self.seller_totals = defaultdict(lambda: [0, 0.0, 0, 0, 0])
+        self.seller_days = defaultdict(lambda: [0, 0.0, 0])
+        # Change log for delta sync: (seq, product_id) in seq order and each product's latest seq
+        self.seq = 0
+        self.change_log = []
+        self.latest_change = {}
+        # conversation key -> [(timestamp, message dict), ...] in send order
+        self.conversations = defaultdict(list)
+        self.source = source
+        self.replicable = False
+
+    def setup(self, replication_log=False):
+        if replication_log:
+            raise StorageError("Replication needs SQLite storage")
+        if self.source is not None:
+            self.source.setup()
+            self.load(self.source)
+
+    def start_maintenance(self, interval):
+        pass
+
+    def stop_maintenance(self):
+        pass
+
+    # Copy users, the catalogue and seller rollups from an SQLiteStorage; messages are not copied
+    def load(self, source):
+        conn = source.connect()
+        try:
+            for row in conn.execute("SELECT id, first_name, last_name, email, username, password, online, port, ip_address FROM users ORDER BY id"):
+                user = UserRecord(*row)
+                self.users[user.id] = user
+                self.usernames[user.username] = user
+                self.last_user_id = max(self.last_user_id, user.id)
+        finally:
+            conn.close()
+        # Continue the source's change sequence so delta-sync clients do not see it go backwards
+        self.seq = max((seq or 0 for (seq,) in source.shards.query_all("SELECT MAX(seq) FROM product_changes")), default=0)
+        for row in source.all_products():
+            self.insert_product(ProductRecord(*row))
+        for product_id, user_id, rating in source.shards.query_all("SELECT product_id, user_id, rating FROM product_ratings ORDER BY id"):
+            self.ratings[(product_id, user_id)] = rating
+            self.rating_sums[product_id] += rating
+            self.rating_counts[product_id] += 1
+        for product_id, units in source.sales_totals():
+            self.units_sold[product_id] = units
+        for owner_id, *totals in source.shards.query_all("SELECT owner_id, units_sold, revenue, rating_count, rating_sum, active_listings FROM seller_stats"):
+            self.seller_totals[owner_id] = totals
+        for owner_id, day, *counts in source.shards.query_all("SELECT owner_id, day, units_sold, revenue, new_ratings FROM seller_daily_stats"):
+            self.seller_days[(owner_id, day)] = counts
+
+    def insert_product(self, product):
+        self.products[product.id] = product
+        self.product_ids.append(product.id)
+        self.by_category[product.category].append(product.id)
+        self.by_owner[product.owner_id].append(product.id)
+        self.log_change(product.id)
+
+    def log_change(self, product_id):
+        self.seq += 1
+        self.change_log.append((self.seq, product_id))
+        self.latest_change[product_id] = self.seq
+
+    # Users
+
+    def create_user(self, first_name, last_name, email, username, password):
+        with self.lock:
+            if username in self.usernames:
+                raise DuplicateUser(username)
+            self.last_user_id += 1
+            user = UserRecord(self.last_user_id, first_name, last_name, email, username, password)
+            self.users[user.id] = user
+            self.usernames[username] = user
+            return user.id
+
+    def authenticate(self, username, password):
+        user = self.usernames.get(username)
+        return user.id if user and user.password == password else None
+
+    def set_online(self, user_id, port, ip_address):
+        with self.lock:
+            user = self.users.get(affinity(user_id, int))
+            if user:
+                user.online, user.port, user.ip_address = 1, port, ip_address
+
+    def set_offline(self, user_id):
+        with self.lock:
+            user = self.users.get(affinity(user_id, int))
+            if user:
+                user.online, user.port = 0, None
+
+    def find_user(self, username):
+        user = self.usernames.get(username)
+        return User(user.id, user.username, user.online, user.port, user.ip_address) if user else None
+
+    # Products
+
+    def add_product(self, owner_id, name, category, price, description, image, quantity):
+        with self.lock:
+            # product_ids is sorted, so the last one is the largest
+            product = ProductRecord((self.product_ids[-1] if self.product_ids else 0) + 1, name, affinity(owner_id, int), category, affinity(price, float),
+                                    description, image, affinity(quantity, int))
+            self.insert_product(product)
+            if product.in_stock():
+                self.seller_totals[product.owner_id][4] += 1
+            return product.id
+
+    def get_product(self, product_id):
+        product = self.products.get(affinity(product_id, int))
+        return product.row() if product else None
+
+    def scan(self, ids, after, limit, match):
+        rows = []
+        for product_id in ids[bisect.bisect_right(ids, int(after)) if after is not None else 0:]:
+            product = self.products[product_id]
+            if match(product):
+                rows.append(product.row())
+                if limit is not None and len(rows) >= limit:
+                    break
+        return rows
+
+    def list_products(self, filters=None, after=None, limit=None):
+        filters = filters or {}
+        low, high = facets.price_range(filters['price']) if 'price' in filters else (None, None)
+
+        def match(product):
+            if 'category' in filters and product.category != filters['category']:
+                return False
+            if low is not None and not (low <= (product.price or 0) and (high is None or (product.price or 0) < high)):
+                return False
+            return 'in_stock' not in filters or product.in_stock() == filters['in_stock']
+
+        with self.lock:
+            ids = self.by_category.get(filters['category'], []) if 'category' in filters else self.product_ids
+            return self.scan(ids, after, limit, match)
+
+    def search_products(self, term, after=None, limit=None):
+        term = ascii_lower(term)
+        with self.lock:
+            return self.scan(self.product_ids, after, limit, lambda product: term in ascii_lower(product.name or ''))
+
+    def products_by_owner(self, owner_id):
+        with self.lock:
+            return [self.products[product_id].row() for product_id in self.by_owner.get(affinity(owner_id, int), [])]
+
+    def all_products(self):
+        with self.lock:
+            return [self.products[product_id].row() for product_id in self.product_ids]
+
+    def buy_product(self, product_id, buyer_id):
+        with self.lock:
+            product = self.products.get(affinity(product_id, int))
+            if not product or product.buyer_id is not None or not product.quantity or product.quantity <= 0:
+                return None
+            product.quantity -= 1
+            if product.quantity == 0:
+                # Mark as sold out by assigning a buyer_id
+                product.buyer_id = affinity(buyer_id, int)
+                self.seller_totals[product.owner_id][4] -= 1
+            self.units_sold[product.id] += 1
+            totals = self.seller_totals[product.owner_id]
+            totals[0] += 1
+            totals[1] += product.price or 0
+            day = self.seller_days[(product.owner_id, since_day(0))]
+            day[0] += 1
+            day[1] += product.price or 0
+            self.log_change(product.id)
+            return product.quantity
+
+    # Ratings and sales
+
+    def rate_product(self, product_id, user_id, rating):
+        product_id, user_id, rating = affinity(product_id, int), affinity(user_id, int), affinity(rating, int)
+        if not isinstance(rating, int) or not 1 <= rating <= 5:
+            raise StorageError("Rating must be between 1 and 5")
+        with self.lock:
+            previous = self.ratings.get((product_id, user_id))
+            self.ratings[(product_id, user_id)] = rating
+            self.rating_sums[product_id] += rating - (previous or 0)
+            product = self.products.get(product_id)
+            if previous is None:
+                self.rating_counts[product_id] += 1
+                if product:
+                    self.seller_days[(product.owner_id, since_day(0))][2] += 1
+            if product:
+                totals = self.seller_totals[product.owner_id]
+                totals[2] += previous is None
+                totals[3] += rating - (previous or 0)
+            self.log_change(product_id)
+            return previous
+
+    def average_rating(self, product_id):
+        product_id = affinity(product_id, int)
+        count = self.rating_counts.get(product_id)
+        return self.rating_sums[product_id] / count if count else None
+
+    def all_ratings(self):
+        with self.lock:
+            return [(user_id, product_id, rating) for (product_id, user_id), rating in self.ratings.items()]
+
+    def rating_totals(self):
+        with self.lock:
+            return [(product_id, self.rating_sums[product_id], count) for product_id, count in self.rating_counts.items() if count]
+
+    def sales_totals(self):
+        with self.lock:
+            return [(product_id, units) for product_id, units in self.units_sold.items() if units]
+
+    def seller_stats(self, owner_id, days=30):
+        owner_id = affinity(owner_id, int)
+        first_day = since_day(days)
+        with self.lock:
+            totals = tuple(self.seller_totals[owner_id]) if owner_id in self.seller_totals else (0, 0, 0, 0, 0)
+            daily = sorted((day, *counts) for (owner, day), counts in self.seller_days.items() if owner == owner_id and day >= first_day)
+            return totals, daily
+
+    def product_changes(self, since, limit):
+        since = parse_position(since, 1)[0]
+        with self.lock:
+            changed = []
+            for seq, product_id in self.change_log[bisect.bisect_right(self.change_log, (since, float('inf'))):]:
+                if self.latest_change[product_id] == seq:
+                    changed.append((product_id, seq))
+                    if len(changed) > limit:
+                        break
+            more = len(changed) > limit
+            changed = changed[:limit]
+            rows = []
+            for product_id in sorted(product_id for product_id, _ in changed):
+                product = self.products.get(product_id)
+                if product:
+                    count = self.rating_counts.get(product_id, 0)
+                    rows.append(product.row() + (self.rating_sums[product_id] / count if count else None, count))
+            return changed, rows, more, changed[-1][1] if changed else since
+
+    # Messages
+
+    def append_message(self, sender_id, receiver_id, message):
+        with self.lock:
+            self.conversations[message_store.conversation_key(sender_id, receiver_id)].append(
+                (message_store.utc_timestamp(), {"sender_id": int(sender_id), "receiver_id": int(receiver_id), "message": message}))
+
+    def conversation(self, user_a, user_b, before=None, after=None, limit=50):
+        with self.lock:
+            messages = self.conversations.get(message_store.conversation_key(user_a, user_b), [])
+            end = bisect.bisect_left(messages, before, key=itemgetter(0)) if before else len(messages)
+            start = bisect.bisect_right(messages, after, key=itemgetter(0)) if after else 0
+            return [dict(message, timestamp=timestamp) for timestamp, message in reversed(messages[max(start, end - limit):end])]
+
+
+def open_storage(kind, db_path, shard_count=1, messages=None, shard_dir=shards.SHARD_DIR):
+    """'sqlite' (default) or 'memory'; the memory backend starts from a copy of `db_path` when it exists."""
+    if kind == 'memory':
+        return MemoryStorage(SQLiteStorage(db_path, shard_count, messages, shard_dir) if os.path.exists(db_path) else None)
+    if kind != 'sqlite':
+        raise ValueError(f"Unknown storage backend {kind}")
+    return SQLiteStorage(db_path, shard_count, messages, shard_dir)
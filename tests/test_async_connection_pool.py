@@ -0,0 +1,68 @@
+import asyncio
+import threading
+
+import pytest
+
+import async_client
+from client import build_request
+from tests.test_connection_pool import FakeServer, answer_once_then_close, never_answer
+
+PAYLOAD = build_request('POST', '/buy_product', 'localhost', {"product_id": 1})
+
+
+def test_request_on_dropped_idle_stream_is_sent_again():
+    server = FakeServer(answer_once_then_close)
+    pool = async_client.AsyncConnectionPool('localhost', server.port)
+
+    async def run():
+        first = await pool.request(PAYLOAD)
+        await asyncio.sleep(0.05)
+        return first, await pool.request(PAYLOAD)
+
+    first, second = asyncio.run(run())
+    assert first[0] == second[0] == 200
+    assert server.requests == 2
+    server.close()
+
+
+def test_request_is_not_sent_again_after_a_timeout():
+    server = FakeServer(never_answer)
+    pool = async_client.AsyncConnectionPool('localhost', server.port, timeout=0.3)
+
+    async def run():
+        connections = pool.for_loop()
+        connections.idle.append(await pool.connect())
+        await pool.request(PAYLOAD)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run())
+    assert server.requests == 1
+    server.close()
+
+
+def test_each_event_loop_gets_its_own_connections():
+    server = FakeServer(never_answer)
+    pool = async_client.AsyncConnectionPool('localhost', server.port)
+    seen = []
+
+    async def run():
+        connections = pool.for_loop()
+        connections.idle.append(await pool.connect())
+        await asyncio.sleep(0.1)
+        # Another loop running meanwhile did not take or abort this loop's stream
+        seen.append((connections, len(connections.idle), connections.idle[0][1].is_closing()))
+
+    threads = [threading.Thread(target=asyncio.run, args=(run(),)) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert seen[0][0] is not seen[1][0]
+    assert all(count == 1 and not closing for _, count, closing in seen)
+    # Both loops have finished, so their state is dropped on the next use
+    async def touch():
+        pool.for_loop()
+
+    asyncio.run(touch())
+    assert len(pool.loops) <= 1
+    server.close()
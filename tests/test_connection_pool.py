@@ -0,0 +1,70 @@
+import socket
+import threading
+
+import pytest
+
+import client
+
+RESPONSE = b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: 2\r\n\r\n{}'
+
+
+# Accepts connections and hands each one to `behaviour(conn)`; counts the requests it reads
+class FakeServer:
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.requests = 0
+        self.listener = socket.create_server(('localhost', 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.behaviour, args=(self, conn), daemon=True).start()
+
+    def read_request(self, conn):
+        data = conn.recv(65536)
+        if data:
+            self.requests += 1
+        return data
+
+    def close(self):
+        self.listener.close()
+
+
+def answer_once_then_close(server, conn):
+    with conn:
+        if server.read_request(conn):
+            conn.sendall(RESPONSE)
+
+
+def never_answer(server, conn):
+    with conn:
+        while server.read_request(conn):
+            pass
+
+
+def test_request_on_dropped_idle_connection_is_sent_again():
+    server = FakeServer(answer_once_then_close)
+    pool = client.ConnectionPool('localhost', server.port)
+    payload = client.build_request('POST', '/buy_product', 'localhost', {"product_id": 1})
+    assert pool.request(payload)[0] == 200
+    # The server closed the pooled connection after answering; the next request is replayed once
+    assert pool.request(payload)[0] == 200
+    assert server.requests == 2
+    server.close()
+
+
+def test_request_is_not_sent_again_after_a_timeout():
+    server = FakeServer(never_answer)
+    pool = client.ConnectionPool('localhost', server.port, timeout=0.3)
+    conn = socket.create_connection(('localhost', server.port), timeout=0.3)
+    pool.release(conn)
+    with pytest.raises(socket.timeout):
+        pool.request(client.build_request('POST', '/buy_product', 'localhost', {"product_id": 1}))
+    assert server.requests == 1
+    assert pool.idle == []
+    server.close()
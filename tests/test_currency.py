@@ -0,0 +1,45 @@
+import threading
+import time
+
+import currency
+
+
+class SlowProvider:
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = 0
+
+    def fetch(self, base_currency):
+        self.calls += 1
+        time.sleep(self.delay)
+        return {"USD": 1.0, "EUR": 0.5 + self.calls}
+
+
+def test_expired_rates_are_served_while_one_caller_refreshes():
+    provider = SlowProvider(0.5)
+    rates = currency.RatesCache(provider, ttl=60)
+    rates.entries['USD'] = (time.time() - 120, {"USD": 1.0, "EUR": 0.9})
+    refresher = threading.Thread(target=rates.get_rates)
+    refresher.start()
+    time.sleep(0.1)
+    began = time.perf_counter()
+    assert rates.get_rate('USD', 'EUR') == 0.9
+    assert time.perf_counter() - began < 0.1
+    refresher.join()
+    assert rates.get_rate('USD', 'EUR') == 1.5 and provider.calls == 1
+
+
+def test_callers_without_rates_share_one_fetch():
+    provider = SlowProvider(0.2)
+    rates = currency.RatesCache(provider)
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(rates.get_rate('USD', 'EUR'))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen == [1.5] * 5 and provider.calls == 1
+
+
+def test_missing_prices_stay_none():
+    assert currency.convert_prices([10, None, 2.5], 2) == [20.0, None, 5.0]
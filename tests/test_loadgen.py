@@ -0,0 +1,11 @@
+from benchmarks.loadgen import outcome
+
+
+def test_failures_reported_as_messages_count_as_errors():
+    assert outcome('/rate_product', {"message": "Rating submitted successfully"}) == 'ok'
+    assert outcome('/rate_product', {"message": "Rating must be between 1 and 5"}) == 'error'
+    assert outcome('/buy_product', {"message": "Product not available or sold out"}) == 'declined'
+    assert outcome('/buy_product', {"message": "database is locked"}) == 'error'
+    assert outcome('/products', {"message": "no such table: products"}) == 'error'
+    assert outcome('/products', {"error": "Server busy", "retry_after": 1}) == 'error'
+    assert outcome('/products', []) == 'ok'
@@ -0,0 +1,117 @@
+import json
+import socket
+import asyncio
+
+from client import AUBoutique
+from async_client import AsyncAUBoutique
+from offline_cache import OfflineCache
+
+SOURCE = 'localhost:8080'
+
+
+def products(first, count):
+    return [{"id": i, "name": f"product {i}", "description": "x" * 100} for i in range(first, first + count)]
+
+
+def test_deltas_accumulate_across_restarts(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = OfflineCache(path)
+    cache.save_catalogue(SOURCE, 0, 10, products(1, 10), [])
+    cache.save_catalogue(SOURCE, 10, 12, products(11, 2), [3])
+    cache.close()
+    seq, stored = OfflineCache(path).load_catalogue(SOURCE)
+    assert seq == 12
+    assert sorted(stored) == [i for i in range(1, 13) if i != 3]
+
+
+def test_delta_after_eviction_is_not_stored_as_up_to_date(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = OfflineCache(path, max_bytes=5000)
+    # The full snapshot alone exceeds the budget and is evicted
+    cache.save_catalogue(SOURCE, 0, 100, products(1, 100), [])
+    assert cache.load_catalogue(SOURCE) == (0, {})
+    # The client keeps syncing from its in-memory copy; that delta must not become the stored catalogue
+    cache.save_catalogue(SOURCE, 100, 101, products(101, 1), [])
+    cache.close()
+    # After a restart the client starts over from 0 rather than from a fragment
+    assert OfflineCache(path, max_bytes=5000).load_catalogue(SOURCE) == (0, {})
+
+
+def test_delta_from_another_position_is_ignored(tmp_path):
+    cache = OfflineCache(str(tmp_path / 'cache.db'))
+    cache.save_catalogue(SOURCE, 0, 10, products(1, 10), [])
+    cache.save_catalogue(SOURCE, 20, 25, products(50, 1), [])
+    seq, stored = cache.load_catalogue(SOURCE)
+    assert seq == 10 and sorted(stored) == list(range(1, 11))
+
+
+def test_sharded_positions_round_trip(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = OfflineCache(path)
+    cache.save_catalogue(SOURCE, 0, '3.0', products(1, 3), [])
+    cache.save_catalogue(SOURCE, '3.0', '3.2', products(4, 1), [])
+    cache.close()
+    seq, stored = OfflineCache(path).load_catalogue(SOURCE)
+    assert seq == '3.2' and sorted(stored) == [1, 2, 3, 4]
+
+
+def test_sync_from_zero_replaces_the_stored_catalogue(tmp_path):
+    cache = OfflineCache(str(tmp_path / 'cache.db'))
+    cache.save_catalogue(SOURCE, 0, 10, products(1, 10), [])
+    cache.save_catalogue(SOURCE, 0, '4.4', products(100, 2), [])
+    assert cache.load_catalogue(SOURCE) == ('4.4', {p["id"]: p for p in products(100, 2)})
+
+
+def test_client_construction_leaves_the_cache_file_closed(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = OfflineCache(path)
+    cache.save_rates({"USD": (1000.0, {"USD": 1.0, "EUR": 0.9})})
+    cache.close()
+    cache = OfflineCache(path)
+    boutique = AUBoutique(offline_cache=cache)
+    assert cache.conn is None
+    # The stored rates are read on first use
+    assert boutique.rates_cache.cached('USD') == {"USD": 1.0, "EUR": 0.9}
+
+
+def test_eviction_takes_the_least_recently_used_entries(tmp_path):
+    cache = OfflineCache(str(tmp_path / 'cache.db'), max_bytes=40000)
+    cache.save_catalogue('old:8080', 0, 10, products(1, 100), [])
+    cache.save_catalogue(SOURCE, 0, 10, products(1, 100), [])
+    # Room for the response is made by dropping the older server's catalogue only
+    cache.put_response('GET /products', '"v1"', 'application/json', b'x' * 20000)
+    assert cache.load_catalogue('old:8080') == (0, {})
+    assert cache.load_catalogue(SOURCE)[0] == 10
+    assert cache.get_response('GET /products') is not None
+
+
+def test_oversized_response_does_not_flush_the_catalogue(tmp_path):
+    cache = OfflineCache(str(tmp_path / 'cache.db'), max_bytes=40000)
+    cache.save_catalogue(SOURCE, 0, 10, products(1, 100), [])
+    cache.put_response('GET /small', '"v1"', 'application/json', b'x' * 100)
+    cache.put_response('GET /huge', '"v1"', 'application/json', b'x' * 50000)
+    assert cache.get_response('GET /huge') is None
+    assert cache.get_response('GET /small') is not None
+    assert len(cache.load_catalogue(SOURCE)[1]) == 100
+
+
+def test_async_client_reads_the_offline_cache_without_the_server(tmp_path):
+    # A port with nothing listening, so every request fails to connect
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        port = sock.getsockname()[1]
+    cache = OfflineCache(str(tmp_path / 'cache.db'))
+    source = f'localhost:{port}'
+    cache.save_catalogue(source, 0, 10, products(1, 10), [])
+    key = ['GET', '/products', json.dumps(None)]
+    cache.put_response(json.dumps([source] + key), '"v1"', 'application/json', json.dumps(products(1, 2)).encode())
+    boutique = AsyncAUBoutique(port=port, offline_cache=cache)
+
+    async def offline():
+        stored = await boutique.cached_products()
+        response = await boutique.send_conditional_request('GET', '/products', read_only=True)
+        return stored, response
+
+    stored, response = asyncio.run(offline())
+    assert sorted(p["id"] for p in stored) == list(range(1, 11))
+    assert response == products(1, 2)
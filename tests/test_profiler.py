@@ -0,0 +1,57 @@
+import os
+import json
+import time
+import threading
+
+import profiler
+
+
+def logged(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_connection_execute_shortcuts_are_logged(tmp_path, monkeypatch):
+    log_path = str(tmp_path / 'slow.log')
+    monkeypatch.setattr(profiler, 'SLOW_QUERY_THRESHOLD_MS', 0.0)
+    monkeypatch.setattr(profiler, 'SLOW_QUERY_LOG', log_path)
+    conn = profiler.connect(str(tmp_path / 'test.db'))
+    conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.executemany("INSERT INTO products (name) VALUES (?)", [("lamp",), ("guitar",)])
+    assert conn.execute("SELECT name FROM products WHERE id = ?", (2,)).fetchone() == ("guitar",)
+    conn.cursor().execute("SELECT COUNT(*) FROM products")
+    conn.close()
+    entries = logged(log_path)
+    statements = [entry["sql"] for entry in entries]
+    assert "INSERT INTO products (name) VALUES (?)" in statements
+    assert "SELECT name FROM products WHERE id = ?" in statements
+    assert "SELECT COUNT(*) FROM products" in statements
+    assert [entry["batch"] for entry in entries if entry["sql"].startswith("INSERT")] == [2]
+    select = next(entry for entry in entries if entry["sql"].startswith("SELECT name"))
+    assert select["parameters"] == ["2"] and select["plan"]
+
+
+def test_only_one_of_concurrent_profiles_starts(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, 'PROFILE_DIR', str(tmp_path))
+    start = threading.Barrier(8)
+    started = []
+
+    def request():
+        start.wait()
+        started.append(profiler.start_profile(0.2, 0.01))
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    paths = [path for path in started if path]
+    assert len(paths) == 1
+    while profiler._profile_lock.locked():
+        time.sleep(0.05)
+    assert os.path.exists(paths[0])
+    # The next profile gets its own file even within the same second
+    following = profiler.start_profile(0.01, 0.01)
+    assert following and following != paths[0]
+    while profiler._profile_lock.locked():
+        time.sleep(0.01)
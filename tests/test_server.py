@@ -0,0 +1,82 @@
+import json
+import re
+import socket
+
+import pytest
+
+import server
+import currency
+from client import AUBoutique
+from benchmarks import seed
+
+
+def test_server_restarts_on_the_same_port(tmp_path):
+    db_path = str(tmp_path / 'test.db')
+    seed.seed_database(db_path, 3, 10, 10, 0, 1)
+    running = server.Server(db_path)
+    with running:
+        port = running.port
+        assert len(AUBoutique('localhost', port).list_products()) == 10
+    with running:
+        assert running.port == port
+        assert len(AUBoutique('localhost', port).list_products()) == 10
+
+
+def test_opened_server_that_never_served_releases_its_port(tmp_path):
+    running = server.Server(str(tmp_path / 'test.db')).open()
+    port = running.port
+    running.stop()
+    assert running.socket.fileno() == -1
+    with socket.socket() as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(('localhost', port))
+        s.listen()
+
+
+@pytest.fixture
+def running_server(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'test.db')
+    seed.seed_database(db_path, 3, 10, 10, 0, 1)
+    monkeypatch.setattr(server, 'RATES', currency.RatesCache(currency.StubRatesProvider()))
+    with server.Server(db_path) as running:
+        yield running
+
+
+def get(path):
+    response = server.process_request(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    match = re.search(r'\r\nETag: (\S+)\r\n', response.partition('\r\n\r\n')[0] + '\r\n')
+    return response, match and match.group(1)
+
+
+def test_error_bodies_get_no_etag(running_server):
+    response, etag = get('/products?currency=XYZ')
+    assert '"message"' in response and etag is None
+
+
+def test_success_is_tagged_whatever_the_body_looks_like():
+    response = server.conditional({}, ('/notes',), lambda etag=None: server.products_response({"message": "No products yet"}, etag))
+    assert '\r\nETag: "' in response
+
+
+def test_converted_listing_etag_follows_the_rates(running_server):
+    _, usd = get('/products')
+    _, eur = get('/products?currency=EUR')
+    assert usd and eur and usd != eur
+    assert get('/products?currency=EUR')[1] == eur
+    # Once the rates expire they are fetched again and converted listings get a new ETag
+    fetched_at, rates = server.RATES.entries['USD']
+    server.RATES.entries['USD'] = (fetched_at - server.RATES.ttl - 1, rates)
+    assert get('/products?currency=EUR')[1] != eur
+    assert get('/products')[1] == usd
+
+
+def post(path, data):
+    return server.process_request(f'POST {path} HTTP/1.1\r\nHost: localhost\r\n\r\n' + json.dumps(data))
+
+
+def test_product_without_owner_is_refused(running_server):
+    product = {"name": "Lamp", "category": "furniture", "price": 20, "description": "", "image": None, "quantity": 1}
+    for owner_id in (None, 'someone'):
+        response = post('/add_product', dict(product, owner_id=owner_id))
+        assert response.startswith('HTTP/1.1 400') and 'owner_id' in response
+    assert post('/add_product', dict(product, owner_id=1)) == '{"message": "Product added successfully"}'
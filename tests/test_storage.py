@@ -0,0 +1,250 @@
+import os
+import time
+import random
+import threading
+
+import pytest
+
+import storage
+import message_store
+from benchmarks import seed
+
+# The same checks against every storage backend, plus a randomized workload replayed on each
+# unsharded backend whose results must be identical.
+
+
+def sqlite_backend(shard_count):
+    def open_store(root, db_path=None):
+        return storage.SQLiteStorage(db_path or os.path.join(root, 'store.db'), shard_count,
+                                     message_store.MessageStore(os.path.join(root, 'messages')), os.path.join(root, 'shards'))
+    return open_store
+
+
+def memory_backend(root, db_path=None):
+    return storage.MemoryStorage(sqlite_backend(1)(root, db_path) if db_path else None)
+
+
+BACKENDS = {
+    'sqlite': sqlite_backend(1),
+    'sqlite-3-shards': sqlite_backend(3),
+    'memory': memory_backend
+}
+
+
+# Every test taking `store` runs against each backend
+@pytest.fixture(params=list(BACKENDS))
+def store(request, tmp_path):
+    store = BACKENDS[request.param](str(tmp_path))
+    store.setup()
+    return store
+
+
+def add_users(store, count):
+    return [store.create_user(f"First{i}", f"Last{i}", f"user{i}@mail.aub.edu", f"user{i}", f"hash{i}") for i in range(1, count + 1)]
+
+
+def test_users(store):
+    alice, bob = add_users(store, 2)
+    with pytest.raises(storage.DuplicateUser):
+        store.create_user('Other', 'User', 'other@mail.aub.edu', 'user1', 'x')
+    assert store.authenticate('user1', 'hash1') == alice
+    assert store.authenticate('user1', 'wrong') is None
+    assert store.authenticate('nobody', 'hash1') is None
+    assert store.find_user('user2') == storage.User(bob, 'user2', 0, None, None)
+    store.set_online(bob, 5001, '10.0.0.2')
+    assert store.find_user('user2') == storage.User(bob, 'user2', 1, 5001, '10.0.0.2')
+    store.set_offline(bob)
+    assert store.find_user('user2') == storage.User(bob, 'user2', 0, None, '10.0.0.2')
+    assert store.find_user('nobody') is None
+
+
+def test_products(store):
+    alice, bob = add_users(store, 2)
+    lamp = store.add_product(alice, 'Wooden lamp', 'furniture', '24.5', 'A lamp', 'lamp.jpg', '3')
+    book = store.add_product(bob, 'Calculus textbook', 'books', 60, 'Used', None, 0)
+    mug = store.add_product(alice, '100% ceramic mug', 'crafts', 8, 'A mug', None, 1)
+    assert store.get_product(lamp) == (lamp, 'Wooden lamp', alice, 'furniture', 24.5, 'A lamp', 'lamp.jpg', 3, None)
+    assert store.get_product(10 ** 6) is None
+    assert [row[0] for row in store.all_products()] == sorted([lamp, book, mug])
+    assert [row[0] for row in store.products_by_owner(alice)] == sorted([lamp, mug])
+    assert store.products_by_owner(10 ** 6) == []
+    assert [row[0] for row in store.list_products({'category': 'books'})] == [book]
+    assert [row[0] for row in store.list_products({'price': '10-25'})] == [lamp]
+    assert [row[0] for row in store.list_products({'in_stock': False})] == [book]
+    assert sorted(row[0] for row in store.list_products({'in_stock': True})) == sorted([lamp, mug])
+    assert [row[0] for row in store.search_products('LAMP')] == [lamp]
+    # Search terms are literal, wildcards included
+    assert [row[0] for row in store.search_products('100%')] == [mug]
+    assert store.search_products('_') == []
+    ids = sorted([lamp, book, mug])
+    first = store.list_products(limit=2)
+    assert [row[0] for row in first] == ids[:2]
+    assert [row[0] for row in store.list_products(after=first[-1][0], limit=2)] == ids[2:]
+    assert [row[0] for row in store.search_products('', after=ids[0])] == ids[1:]
+
+
+def test_search_folds_case_for_ascii_letters_only(store):
+    alice, = add_users(store, 1)
+    chair = store.add_product(alice, 'Élan chair', 'furniture', 80, '', None, 1)
+    assert [row[0] for row in store.search_products('CHAIR')] == [chair]
+    assert [row[0] for row in store.search_products('Élan')] == [chair]
+    # SQLite's LIKE folds ASCII letters only, and the memory backend matches it
+    assert store.search_products('élan') == []
+
+
+def test_purchases(store):
+    alice, bob = add_users(store, 2)
+    product = store.add_product(alice, 'Guitar', 'music', 120, 'Acoustic', None, 2)
+    assert store.buy_product(product, bob) == 1
+    assert store.get_product(product)[7:] == (1, None)
+    assert store.buy_product(product, bob) == 0
+    assert store.get_product(product)[7:] == (0, bob)
+    assert store.buy_product(product, bob) is None
+    assert store.buy_product(10 ** 6, bob) is None
+    assert store.sales_totals() == [(product, 2)]
+    assert [row[0] for row in store.list_products({'in_stock': False})] == [product]
+
+
+def test_concurrent_purchases(store):
+    alice, *buyers = add_users(store, 9)
+    product = store.add_product(alice, 'Last lamp', 'furniture', 40, '', None, 1)
+    start = threading.Barrier(len(buyers))
+    sold = []
+
+    def buy(buyer):
+        start.wait()
+        sold.append(store.buy_product(product, buyer))
+
+    threads = [threading.Thread(target=buy, args=(buyer,)) for buyer in buyers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Exactly one buyer gets the last unit, and the sale is counted once
+    assert sorted(sold, key=str) == [0] + [None] * (len(buyers) - 1), sold
+    assert store.sales_totals() == [(product, 1)]
+    assert store.seller_stats(alice)[0][:2] == (1, 40)
+
+
+def test_ratings(store):
+    alice, bob, carol = add_users(store, 3)
+    product = store.add_product(alice, 'Poster', 'collectibles', 15, 'Framed', None, 1)
+    assert store.average_rating(product) is None
+    assert store.rate_product(product, bob, 4) is None
+    assert store.rate_product(product, carol, 1) is None
+    assert store.rate_product(product, bob, 5) == 4
+    assert store.average_rating(product) == 3.0
+    for bad in (0, 6):
+        with pytest.raises(storage.StorageError):
+            store.rate_product(product, carol, bad)
+    assert store.average_rating(product) == 3.0
+    assert sorted(store.all_ratings()) == [(bob, product, 5), (carol, product, 1)]
+    assert store.rating_totals() == [(product, 6, 2)]
+
+
+def test_seller_stats(store):
+    alice, bob = add_users(store, 2)
+    cheap = store.add_product(alice, 'Mug', 'crafts', 5.25, '', None, 1)
+    store.add_product(alice, 'Scarf', 'clothing', 12, '', None, 4)
+    store.add_product(alice, 'Stamp', 'collectibles', 3, '', None, 0)
+    store.buy_product(cheap, bob)
+    store.rate_product(cheap, bob, 2)
+    store.rate_product(cheap, bob, 4)
+    totals, daily = store.seller_stats(alice)
+    assert totals == (1, 5.25, 1, 4, 1), totals
+    assert daily == [(storage.since_day(0), 1, 5.25, 1)], daily
+    assert store.seller_stats(bob) == ((0, 0, 0, 0, 0), [])
+
+
+def test_product_changes(store):
+    alice, bob = add_users(store, 2)
+    first = store.add_product(alice, 'Laptop', 'electronics', 400, '', None, 2)
+    second = store.add_product(bob, 'Racket', 'sports', 30, '', None, 1)
+    changed, rows, more, position = store.product_changes(0, 10)
+    assert sorted(product_id for product_id, _ in changed) == sorted([first, second]) and not more
+    assert store.product_changes(position, 10)[:3] == ([], [], False)
+    store.rate_product(first, bob, 5)
+    store.buy_product(second, alice)
+    expected = {first: store.get_product(first) + (5.0, 1), second: store.get_product(second) + (None, 0)}
+    # Shards order their own changes only, so either product may come first
+    changed, rows, more, position = store.product_changes(position, 1)
+    assert len(changed) == 1 and more
+    assert rows == [expected.pop(changed[0][0])]
+    changed, rows, more, position = store.product_changes(position, 10)
+    assert [product_id for product_id, _ in changed] == list(expected) and not more
+    assert rows == list(expected.values())
+    with pytest.raises(storage.UnknownPosition):
+        store.product_changes('1.2.3.4.5', 10)
+
+
+def test_messages(store):
+    alice, bob, carol = add_users(store, 3)
+    for i in range(5):
+        # Timestamps have millisecond resolution and paging is by timestamp
+        time.sleep(0.002)
+        store.append_message(alice if i % 2 else bob, bob if i % 2 else alice, f"message {i}")
+    store.append_message(alice, carol, "elsewhere")
+    history = store.conversation(bob, alice, limit=3)
+    assert [message["message"] for message in history] == ["message 4", "message 3", "message 2"]
+    assert history[1]["sender_id"] == alice and history[1]["receiver_id"] == bob
+    older = store.conversation(alice, bob, before=history[-1]["timestamp"])
+    assert [message["message"] for message in older] == ["message 1", "message 0"]
+    assert [message["message"] for message in store.conversation(carol, alice)] == ["elsewhere"]
+    assert store.conversation(bob, carol) == []
+
+
+# A random mix of writes and reads; returns everything the reads returned
+def random_workload(store, operations, rng):
+    results = []
+    users = add_users(store, 20)
+    product_ids = []
+    for _ in range(operations):
+        op = rng.random()
+        if op < 0.2 or not product_ids:
+            product_ids.append(store.add_product(rng.choice(users), seed.product_name(rng), rng.choice(seed.CATEGORIES),
+                                                 round(rng.uniform(1, 600), 2), '', None, rng.randint(0, 3)))
+        elif op < 0.4:
+            results.append(store.buy_product(rng.choice(product_ids), rng.choice(users)))
+        elif op < 0.6:
+            results.append(store.rate_product(rng.choice(product_ids), rng.choice(users), rng.randint(1, 5)))
+        elif op < 0.7:
+            filters = {'category': rng.choice(seed.CATEGORIES), 'price': rng.choice(['0-10', '50-100', '500+']),
+                       'in_stock': rng.random() < 0.5}
+            filters = dict(rng.sample(sorted(filters.items()), rng.randint(0, 3)))
+            results.append(store.list_products(filters, rng.choice([None, rng.choice(product_ids)]), rng.choice([None, 5])))
+        elif op < 0.8:
+            results.append(store.search_products(rng.choice(seed.WORDS)[:rng.randint(1, 4)], None, rng.choice([None, 5])))
+        elif op < 0.9:
+            owner = rng.choice(users)
+            results.append((store.products_by_owner(owner), store.seller_stats(owner)))
+        else:
+            results.append((store.average_rating(rng.choice(product_ids)), store.product_changes(rng.randint(0, 50), 10)))
+    results.append((store.all_products(), sorted(store.all_ratings()), sorted(store.rating_totals()), sorted(store.sales_totals())))
+    return results
+
+
+def test_random_workload_gives_the_same_results_on_both_backends(tmp_path):
+    outcomes = {}
+    for name in ('sqlite', 'memory'):
+        root = tmp_path / name
+        root.mkdir()
+        store = BACKENDS[name](str(root))
+        store.setup()
+        outcomes[name] = random_workload(store, 2000, random.Random(42))
+    assert outcomes['sqlite'] == outcomes['memory']
+
+
+# A memory store loaded from a seeded SQLite database reads back the same data
+def test_memory_store_loaded_from_a_seeded_database_matches_sqlite(tmp_path):
+    root = str(tmp_path)
+    db_path = os.path.join(root, 'seeded.db')
+    seed.seed_database(db_path, users=30, products=300, ratings=900, messages=0, seed=42)
+    sqlite_store, memory_store = sqlite_backend(1)(root, db_path), memory_backend(root, db_path)
+    sqlite_store.setup()
+    memory_store.setup()
+    views = [lambda store: store.all_products(), lambda store: sorted(store.all_ratings()),
+             lambda store: sorted(store.rating_totals()), lambda store: store.list_products({'category': 'books'}),
+             lambda store: store.search_products('lamp'), lambda store: [store.seller_stats(owner) for owner in range(1, 31)],
+             lambda store: store.find_user('user7'), lambda store: store.authenticate('user7', seed.seeded_password())]
+    for view in views:
+        assert view(sqlite_store) == view(memory_store)
@@ -0,0 +1,179 @@
+import sys
+import json
+import math
+import struct
+from array import array
+from collections.abc import Sequence
+
+# Opt-in columnar encodings for product result sets. Instead of one nine-key object per
+# row, field names are sent once and values as parallel per-column arrays:
+#   "columnar": JSON {"columns": [...], "data": [[ids...], [names...], ...]}
+#   "binary":   struct-packed columns, Content-Type application/x-auboutique-columnar
+
+PRODUCT_COLUMNS = ["id", "name", "owner_id", "category", "price", "description", "image", "quantity", "buyer_id"]
+PRODUCT_TYPES = "qsqsdssqq"
+BINARY_CONTENT_TYPE = 'application/x-auboutique-columnar'
+MAGIC = b'AUBC'
+VERSION = 1
+NULL_INT = -2 ** 63
+NULL_LENGTH = 0xFFFFFFFF
+
+
+def to_columns(rows, width=len(PRODUCT_COLUMNS)):
+    if not rows:
+        return [[] for _ in range(width)]
+    return [list(column) for column in zip(*rows)]
+
+
+def encode_columnar(columns, data):
+    return {"columns": columns, "data": data}
+
+
+# Arrays are packed little-endian on the wire
+def to_wire(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def from_wire(type_code, blob):
+    values = array(type_code)
+    values.frombytes(blob)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def pack_column(values, type_code):
+    if type_code == 'q':
+        return to_wire(array('q', [NULL_INT if v is None else int(v) for v in values]))
+    if type_code == 'd':
+        return to_wire(array('d', [math.nan if v is None else float(v) for v in values]))
+    encoded = [None if v is None else str(v).encode('utf-8') for v in values]
+    lengths = array('I', [NULL_LENGTH if b is None else len(b) for b in encoded])
+    return to_wire(lengths) + b''.join(b for b in encoded if b is not None)
+
+
+def encode_binary(columns, data, types=PRODUCT_TYPES):
+    count = len(data[0]) if data else 0
+    parts = [MAGIC, struct.pack('<HIH', VERSION, count, len(columns))]
+    for name, type_code in zip(columns, types):
+        encoded_name = name.encode('utf-8')
+        parts.append(struct.pack('<B', len(encoded_name)) + encoded_name + type_code.encode('ascii'))
+    for values, type_code in zip(data, types):
+        packed = pack_column(values, type_code)
+        parts.append(struct.pack('<I', len(packed)) + packed)
+    return b''.join(parts)
+
+
+def unpack_column(blob, type_code, count):
+    if type_code == 'q':
+        return [None if v == NULL_INT else v for v in from_wire('q', blob)]
+    if type_code == 'd':
+        return [None if math.isnan(v) else v for v in from_wire('d', blob)]
+    lengths = from_wire('I', blob[:4 * count])
+    strings = []
+    offset = 4 * count
+    for length in lengths:
+        if length == NULL_LENGTH:
+            strings.append(None)
+        else:
+            strings.append(blob[offset:offset + length].decode('utf-8'))
+            offset += length
+    return strings
+
+
+def decode_binary(payload):
+    if payload[:4] != MAGIC:
+        raise ValueError("Not a columnar payload")
+    version, count, width = struct.unpack_from('<HIH', payload, 4)
+    if version != VERSION:
+        raise ValueError(f"Unsupported columnar version {version}")
+    offset = 12
+    columns, types = [], []
+    for _ in range(width):
+        name_length = payload[offset]
+        columns.append(payload[offset + 1:offset + 1 + name_length].decode('utf-8'))
+        types.append(chr(payload[offset + 1 + name_length]))
+        offset += name_length + 2
+    data = []
+    for type_code in types:
+        (size,) = struct.unpack_from('<I', payload, offset)
+        offset += 4
+        data.append(unpack_column(payload[offset:offset + size], type_code, count))
+        offset += size
+    return ProductRows(columns, data)
+
+
+# Lightweight read-only view of one row; behaves like the dict rows of the default format
+class ProductRow:
+    __slots__ = ('rows', 'index')
+
+    def __init__(self, rows, index):
+        self.rows = rows
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.rows.data[self.rows.positions[key]][self.index]
+
+    def get(self, key, default=None):
+        position = self.rows.positions.get(key)
+        return default if position is None else self.rows.data[position][self.index]
+
+    def keys(self):
+        return list(self.rows.columns)
+
+    def __contains__(self, key):
+        return key in self.rows.positions
+
+    def __iter__(self):
+        return iter(self.rows.columns)
+
+    def __len__(self):
+        return len(self.rows.columns)
+
+    def to_dict(self):
+        return {name: column[self.index] for name, column in zip(self.rows.columns, self.rows.data)}
+
+    def __repr__(self):
+        return f"ProductRow({self.to_dict()!r})"
+
+
+class ProductRows(Sequence):
+    def __init__(self, columns, data):
+        self.columns = columns
+        self.data = data
+        self.positions = {name: i for i, name in enumerate(columns)}
+        self.count = len(data[0]) if data else 0
+
+    def __len__(self):
+        return self.count
+
+    # Callers test result sets with `"error" in response`; rows are never strings
+    def __contains__(self, value):
+        if isinstance(value, str):
+            return False
+        return super().__contains__(value)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ProductRow(self, i) for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return ProductRow(self, index)
+
+    # Whole column without materializing rows
+    def column(self, name):
+        return self.data[self.positions[name]]
+
+
+# Decode a product result set sent in any of the wire formats
+def decode(content_type, payload):
+    if content_type and content_type.startswith(BINARY_CONTENT_TYPE):
+        return decode_binary(payload)
+    parsed = json.loads(payload)
+    if isinstance(parsed, dict) and "columns" in parsed and "data" in parsed:
+        return ProductRows(parsed["columns"], parsed["data"])
+    return parsed